@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRuntime:
+    """Drives the synchronous TeleBot handlers from an asyncio event loop.
+
+    Updates are fetched with long polling on the loop, and every handler (together with its
+    sqlite3 calls) runs in a thread pool, so one slow export or big /show only occupies one
+    worker instead of the whole bot. Updates of the same chat are still handled in order,
+    which the next-step handler chains rely on.
+    """
+
+    def __init__(self, bot, workers=32, poll_timeout=20):
+        self.bot = bot
+        self.poll_timeout = poll_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        self._tails = {}  # chat_id -> last scheduled task of that chat
+        self._running = False
+        # Handlers are run by our executor, not by TeleBot's own worker pool
+        self.bot.threaded = False
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._running = True
+        offset = None
+        try:
+            while self._running:
+                try:
+                    updates = await loop.run_in_executor(
+                        None, lambda: self.bot.get_updates(offset=offset, timeout=self.poll_timeout,
+                                                           long_polling_timeout=self.poll_timeout))
+                except Exception:
+                    logger.exception("Failed to fetch updates")
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    offset = update.update_id + 1
+                    self.dispatch(update)
+        finally:
+            await self.drain()
+
+    def stop(self):
+        self._running = False
+
+    def dispatch(self, update):
+        chat_id = update_chat_id(update)
+        previous = self._tails.get(chat_id)
+        task = asyncio.ensure_future(self._handle(update, previous))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._forget(chat_id, t))
+        return task
+
+    def _forget(self, chat_id, task):
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    async def drain(self):
+        tasks = list(self._tails.values())
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle(self, update, previous):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, self.bot.process_new_updates, [update])
+        except Exception:
+            logger.exception("Handler failed for update %s", update.update_id)
+
+
+def update_chat_id(update):
+    if update.message is not None:
+        return update.message.chat.id
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+    return None
+
+
+if __name__ == "__main__":
+    import cli
+
+    cli.main(["async"])
@@ -0,0 +1,111 @@
+"""Compare updates per second of the synchronous polling loop, the asyncio runtime and the lanes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_runtime --chats 200 --updates 2000 --latency 0.01
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import types
+
+from benchmarks.fake_telegram import FakeTelegram
+
+
+def load_bot(workdir, **settings):
+    # The bot opens EngTeacher.db in the working directory unless DB_PATH is given;
+    # settings are extra config values
+    os.chdir(workdir)
+    # The fake API has no rate limits, so the outbox must not add its own delays
+    config = types.SimpleNamespace(TOKEN="123456:BENCHMARK", OUTBOX_WORKERS=32, HTTP_POOL_SIZE=64,
+                                   OUTBOX_GLOBAL_RATE=1e9, OUTBOX_CHAT_RATE=1e9, OUTBOX_CHAT_BURST=1e9)
+    vars(config).update(settings)
+    import main
+    return main.create_app(config)
+
+
+def push_workload(fake, chats, updates, command):
+    for i in range(updates):
+        fake.push_message(1000 + i % chats, command)
+
+
+def bench_sync(app, fake, chats, updates, command):
+    fake.reset()
+    push_workload(fake, chats, updates, command)
+    return poll(app, fake, updates)
+
+
+def poll(app, fake, updates):
+    start = time.perf_counter()
+    thread = threading.Thread(target=app.bot.polling,
+                              kwargs={"non_stop": True, "timeout": 1, "long_polling_timeout": 1},
+                              daemon=True)
+    thread.start()
+    done = fake.wait_for_calls(updates)
+    elapsed = time.perf_counter() - start
+    app.bot.stop_polling()
+    thread.join(5)
+    return done, elapsed
+
+
+def bench_async(app, fake, chats, updates, command, workers):
+    from async_runtime import AsyncRuntime
+
+    fake.reset()
+    push_workload(fake, chats, updates, command)
+
+    async def run():
+        runtime = AsyncRuntime(app.bot, workers=workers, poll_timeout=1)
+        start = time.perf_counter()
+        task = asyncio.ensure_future(runtime.run())
+        done = await asyncio.get_running_loop().run_in_executor(None, fake.wait_for_calls, updates)
+        elapsed = time.perf_counter() - start
+        runtime.stop()
+        await task
+        return done, elapsed
+
+    return asyncio.run(run())
+
+
+def bench_dispatcher(app, fake, chats, updates, command, workers):
+    from dispatcher import ChatDispatcher
+
+    fake.reset()
+    push_workload(fake, chats, updates, command)
+    dispatcher = ChatDispatcher(app.bot, workers=workers).start().attach()
+    done, elapsed = poll(app, fake, updates)
+    dispatcher.stop()
+    return done, elapsed
+
+
+def report(name, done, elapsed, updates):
+    status = "" if done else " (timed out)"
+    print(f"{name:>6}: {updates} updates in {elapsed:.2f}s -> {updates / elapsed:.0f} updates/s{status}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.01, help="fake API latency per call, seconds")
+    parser.add_argument("--command", default="/reminders", help="command every synthetic update sends")
+    parser.add_argument("--workers", type=int, default=32, help="executor size of the asyncio runtime and number of lanes")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(latency=args.latency).start()
+    with tempfile.TemporaryDirectory() as workdir:
+        app = load_bot(workdir)
+        report("sync", *bench_sync(app, fake, args.chats, args.updates, args.command), args.updates)
+        report("async", *bench_async(app, fake, args.chats, args.updates, args.command, args.workers),
+               args.updates)
+        report("lanes", *bench_dispatcher(app, fake, args.chats, args.updates, args.command, args.workers),
+               args.updates)
+        app.db.conn.close()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main_cli()
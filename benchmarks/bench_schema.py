@@ -0,0 +1,120 @@
+"""Compare the single-table schema (migration 4) with the normalized one on a large database.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_schema --words 1000000 --chats 1000
+
+Builds a database at schema version 4, copies it and migrates the copy to the current
+schema, then reports both file sizes (after VACUUM) and the time of the filtered queries
+the bot runs, against the old single-table SQL and the current DataBase methods.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import migrations
+from database import DataBase
+
+LEGACY_VERSION = 4
+GROUPS = ["default", "irregular verbs", "travel phrases", "food and drinks", "business english",
+          "phrasal verbs", "idioms", "animals", "weather", "at the doctor"]
+LANGS = ["en", "de", "fr", "es", "it"]
+
+# The filtered reads of the single-table schema, as DataBase ran them before migration 5
+LEGACY_QUERIES = {
+    "show page (groups, langs)":
+        ('SELECT rowid, "foreign_word", "native_word", "group", "lang" FROM words WHERE "chat_id" = ? '
+         'AND "group" IN (?, ?) AND "lang" IN (?) ORDER BY rowid LIMIT 20',
+         lambda chat: (chat, GROUPS[1], GROUPS[2], LANGS[0])),
+    "flash ids (group)":
+        ('SELECT rowid FROM "words" WHERE "chat_id" = ? AND "group" IN (?) ORDER BY rowid',
+         lambda chat: (chat, GROUPS[3])),
+    "words by group":
+        ('SELECT "foreign_word", "native_word", "group", "lang" FROM words WHERE chat_id = ? AND "group" = ?',
+         lambda chat: (chat, GROUPS[4])),
+    "flash words (groups, langs)":
+        ('SELECT "foreign_word", "native_word", "group", "lang" FROM "words" WHERE "chat_id" = ? '
+         'AND "group" IN (?, ?) AND "lang" IN (?, ?)',
+         lambda chat: (chat, GROUPS[5], GROUPS[6], LANGS[1], LANGS[2])),
+}
+
+CURRENT_QUERIES = {
+    "show page (groups, langs)": lambda db, chat: db.get_show_words_page(chat, GROUPS[1:3], LANGS[:1]),
+    "flash ids (group)": lambda db, chat: db.get_flash_word_ids(chat, GROUPS[3:4]),
+    "words by group": lambda db, chat: db.get_words_by_group(chat, GROUPS[4]),
+    "flash words (groups, langs)": lambda db, chat: db.get_flash_words(chat, GROUPS[5:7], LANGS[1:3]),
+}
+
+
+def build_legacy(path, words, chats, seed):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    for number, script in enumerate(migrations.MIGRATIONS[:LEGACY_VERSION], start=1):
+        conn.executescript(f'BEGIN;\n{script}\npragma user_version = {number};\nCOMMIT;')
+    rows = ((1000 + rng.randrange(chats), f"word {i}", f"слово {i}", rng.choice(GROUPS), rng.choice(LANGS))
+            for i in range(words))
+    conn.executemany('INSERT INTO words ("chat_id", "foreign_word", "native_word", "group", "lang") '
+                     'VALUES (?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+
+def vacuum_size(path):
+    conn = sqlite3.connect(path)
+    conn.execute('pragma wal_checkpoint(truncate)')
+    conn.execute('VACUUM')
+    conn.close()
+    return os.path.getsize(path)
+
+
+def time_queries(run, chats, rounds, seed):
+    rng = random.Random(seed)
+    sample = [1000 + rng.randrange(chats) for _ in range(rounds)]
+    start = time.perf_counter()
+    for chat in sample:
+        run(chat)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, default=1_000_000)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=2000, help="queries of each kind")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        legacy_path = os.path.join(workdir, "legacy.db")
+        current_path = os.path.join(workdir, "current.db")
+        start = time.perf_counter()
+        build_legacy(legacy_path, args.words, args.chats, args.seed)
+        print(f"built {args.words} words in {time.perf_counter() - start:.1f}s")
+        shutil.copy(legacy_path, current_path)
+        start = time.perf_counter()
+        DataBase(current_path).close()
+        print(f"migrated to version {len(migrations.MIGRATIONS)} in {time.perf_counter() - start:.1f}s")
+
+        legacy_size, current_size = vacuum_size(legacy_path), vacuum_size(current_path)
+        print(f"file size: single table {legacy_size / 2 ** 20:.1f} MiB, "
+              f"normalized {current_size / 2 ** 20:.1f} MiB ({current_size / legacy_size - 1:+.0%})")
+
+        legacy = sqlite3.connect(legacy_path)
+        current = DataBase(current_path, cache_size=0)
+        print(f"{'query':<30}{'single table':>14}{'normalized':>14}")
+        for name, (sql, params) in LEGACY_QUERIES.items():
+            old = time_queries(lambda chat: legacy.execute(sql, params(chat)).fetchall(),
+                               args.chats, args.rounds, args.seed)
+            new = time_queries(lambda chat: CURRENT_QUERIES[name](current, chat),
+                               args.chats, args.rounds, args.seed)
+            print(f"{name:<30}{old:>11.0f} us{new:>11.0f} us")
+        legacy.close()
+        current.close()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,72 @@
+"""Time /find queries against one chat with a large vocabulary.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_search --words 100000 --others 50
+
+Fills one chat with --words generated words (and --others chats with a thousand words
+each, which share the index), then times substring, short-prefix, several-term and
+misspelled (fuzzy) searches with the query cache disabled, reporting the mean and p99.
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+
+from database import DataBase
+
+CHAT_ID = 1000
+QUERIES = {
+    "substring": lambda word: word[1:5],
+    "short prefix": lambda word: word[:2],
+    "two terms": lambda word: f"{word[:4]} {word[-3:]}",
+    "misspelled": lambda word: word[:2] + word[3] + word[2] + word[4:],
+}
+
+
+def random_word(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 10)))
+
+
+def fill(db, words, others, rng):
+    vocabulary = [random_word(rng) for _ in range(words)]
+    db.input_words_many((CHAT_ID, word, f"перевод {word[::-1]}", f"group {i % 20}", "en")
+                        for i, word in enumerate(vocabulary))
+    db.input_words_many((CHAT_ID + 1 + chat, random_word(rng), random_word(rng), "default", "en")
+                        for chat in range(others) for _ in range(1000))
+    return vocabulary
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, default=100_000, help="words of the searched chat")
+    parser.add_argument("--others", type=int, default=50, help="other chats with 1000 words each")
+    parser.add_argument("--rounds", type=int, default=500, help="queries of each kind")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        db = DataBase(os.path.join(workdir, "search.db"), cache_size=0)
+        start = time.perf_counter()
+        vocabulary = fill(db, args.words, args.others, rng)
+        print(f"indexed {args.words + args.others * 1000} words in {time.perf_counter() - start:.1f}s")
+        print(f"{'query':<16}{'mean':>10}{'p99':>10}{'rows':>8}")
+        for name, make in QUERIES.items():
+            timings, rows = [], 0
+            for _ in range(args.rounds):
+                text = make(rng.choice(vocabulary))
+                start = time.perf_counter()
+                rows += len(db.search_words(CHAT_ID, text))
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            mean = sum(timings) / len(timings) * 1000
+            p99 = timings[int(len(timings) * 0.99)] * 1000
+            print(f"{name:<16}{mean:>8.2f}ms{p99:>8.2f}ms{rows / args.rounds:>8.1f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,127 @@
+"""Time concurrent writes on 1, 2 and 4 shards and check that rebalancing keeps every word.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_shards --threads 8 --writes 4000 --chats 500
+    python -m benchmarks.bench_shards --synchronous full
+
+Each of --threads threads adds words one input_words call at a time (a transaction each,
+like /add) for chats spread over all shards, and the words per second are reported for
+every shard count. With the default synchronous = normal a WAL commit does not wait for
+the disk, so the writes are bound by CPU rather than by the write lock; --synchronous full
+makes every commit wait for an fsync, as on a slow disk.
+
+Then a single database of --chats chats is split into four shards by the rebalance tool,
+after a simulated interruption that left one chat copied but not deleted. Every chat must
+read back the same words, review progress included, through ShardedDataBase, live on
+exactly one shard, and still be found by search; reminders must stay on the first shard.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import database
+import shards
+from shards import ShardedDataBase
+
+GROUPS = ["default", "food", "travel"]
+LANGS = ["en", "de"]
+
+
+def write_rate(paths, threads, writes):
+    db = ShardedDataBase(paths, cache_size=0)
+
+    def work(number):
+        for i in range(writes // threads):
+            chat_id = 1000 + (number * 7919 + i) % 10_000
+            db.input_words(chat_id, f"word {number}-{i}", f"слово {number}-{i}", GROUPS[i % 3], LANGS[i % 2])
+
+    workers = [threading.Thread(target=work, args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    db.close()
+    return writes // threads * threads / elapsed
+
+
+def snapshot(db, chats):
+    return {chat_id: sorted(row[1:] for row in db.get_due_words(chat_id, float("inf"), limit=10 ** 6))
+            for chat_id in chats}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=4000, help="words added per shard count")
+    parser.add_argument("--chats", type=int, default=500, help="chats of the rebalanced database")
+    parser.add_argument("--words", type=int, default=50, help="words per chat of the rebalanced database")
+    parser.add_argument("--synchronous", choices=("normal", "full"), default="normal")
+    args = parser.parse_args()
+    database.PRAGMAS = tuple(pragma.replace("synchronous = normal", f"synchronous = {args.synchronous}")
+                             for pragma in database.PRAGMAS)
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for count in (1, 2, 4):
+            paths = [os.path.join(workdir, f"write-{count}-{i}.db") for i in range(count)]
+            print(f"{count} shard(s): {write_rate(paths, args.threads, args.writes):.0f} words/s")
+
+        paths = [os.path.join(workdir, f"words-{i}.db") for i in range(4)]
+        single = ShardedDataBase(paths[:1], cache_size=0)
+        chats = list(range(1000, 1000 + args.chats))
+        single.input_words_many((chat_id, f"apple{chat_id}-{i}", f"яблоко{i}", GROUPS[i % 3], LANGS[i % 2])
+                                for chat_id in chats for i in range(args.words))
+        for chat_id in chats[::10]:
+            single.grade_word(chat_id, single.get_show_words_page(chat_id, limit=1)[0][0], 2.7, 3, 2, 12345)
+            single.add_reminder(chat_id, "default", 3600, "1h", 100)
+        before = snapshot(single, chats)
+        single.close()
+
+        # An interrupted run: one chat was copied to its shard but not yet deleted from the first
+        for path in paths:
+            database.DataBase(path, cache_size=0).close()
+        chat_id, source, target = next(shards.misplaced_chats(paths))
+        conn = sqlite3.connect(source, isolation_level=None)
+        conn.execute('ATTACH ? AS target', (target,))
+        for statement in shards.COPY_CHAT:
+            conn.execute(statement, {"chat": chat_id})
+        conn.close()
+
+        start = time.perf_counter()
+        moved = shards.rebalance(paths)
+        print(f"rebalanced {moved} of {len(chats)} chats in {time.perf_counter() - start:.2f}s")
+        if shards.rebalance(paths):
+            failures.append("a second rebalance moved chats again")
+
+        db = ShardedDataBase(paths, cache_size=0)
+        if snapshot(db, chats) != before:
+            failures.append("the words or their review progress changed")
+        for chat_id in chats:
+            homes = [i for i, shard in enumerate(db.shards)
+                     if shard.fetchone('SELECT count(*) FROM words WHERE "chat_id" = ?', (chat_id,))[0]]
+            if homes != [shards.shard_index(chat_id, len(paths))]:
+                failures.append(f"chat {chat_id} has words on shards {homes}")
+            if len(db.search_words(chat_id, f"apple{chat_id}-1")) < 1:
+                failures.append(f"chat {chat_id} is not found by search")
+        if len(db.get_due_reminders(1000)) != len(chats[::10]):
+            failures.append("reminders did not stay on the first shard")
+        print("words per shard: " + ", ".join(str(shard.fetchone('SELECT count(*) FROM words')[0])
+                                                for shard in db.shards))
+        db.close()
+
+    for failure in failures[:20]:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main_cli()
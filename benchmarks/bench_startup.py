@@ -0,0 +1,103 @@
+"""Measure how long a fresh bot process takes to answer its first update.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --runs 10 --target 0.5
+    python -m benchmarks.bench_startup --imports 15
+
+Starts --runs new interpreters one after another against the fake Telegram API and an
+already migrated database. Each one imports main, builds the app with create_app and
+handles a /start update until its reply is sent; the phases are timed inside the process
+and the whole run (interpreter start and exit included) from outside. Exits with status 1
+when the median time to the first reply is above --target seconds. --imports lists the
+slowest modules imported by ``import main``, from python -X importtime.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PHASES = ("import main", "create_app", "first reply")
+
+
+def child(api_url, db_path):
+    start = time.perf_counter()
+    import types
+
+    import main
+
+    imported = time.perf_counter()
+    from telebot import apihelper
+
+    apihelper.API_URL = api_url
+    app = main.create_app(types.SimpleNamespace(TOKEN="123456:BENCHMARK", DB_PATH=db_path))
+    created = time.perf_counter()
+    app.bot.process_new_updates(app.bot.get_updates(timeout=1))
+    app.outbox.flush()
+    replied = time.perf_counter()
+    app.close()
+    print(json.dumps(dict(zip(PHASES, (imported - start, created - imported, replied - created)))))
+
+
+def slowest_imports(count):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                rows.append((int(cumulative), name.rstrip()))
+    for cumulative, name in sorted(rows, reverse=True)[:count]:
+        print(f"{cumulative / 1000:>9.1f}ms {name}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--target", type=float, default=0.5, help="seconds to the first reply, median")
+    parser.add_argument("--imports", type=int, default=0, help="list this many of the slowest imports")
+    parser.add_argument("--child", nargs=2, metavar=("API_URL", "DB_PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+    if args.imports:
+        slowest_imports(args.imports)
+        return
+
+    from benchmarks.fake_telegram import FakeTelegram
+    from database import DataBase
+
+    fake = FakeTelegram().start()
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "EngTeacher.db")
+        DataBase(db_path).close()
+        for _ in range(args.runs):
+            fake.reset()
+            fake.push_message(1000, "/start")
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, "-m", "benchmarks.bench_startup", "--child", fake.api_url, db_path],
+                                    capture_output=True, text=True, check=True)
+            phases = json.loads(result.stdout.splitlines()[-1])
+            phases["process"] = time.perf_counter() - start
+            runs.append(phases)
+    fake.stop()
+
+    print(f"{'phase':<14}{'median':>10}{'max':>10}")
+    for name in PHASES + ("process",):
+        values = [run[name] * 1000 for run in runs]
+        print(f"{name:<14}{statistics.median(values):>8.1f}ms{max(values):>8.1f}ms")
+    first_reply = statistics.median(sum(run[name] for name in PHASES) for run in runs)
+    print(f"first reply after {first_reply:.3f}s (target {args.target:.3f}s)")
+    if first_reply > args.target:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,395 @@
+"""End-to-end benchmark of the real handlers against the fake Telegram API.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_suite --words 100000 --users 1000 --active 200
+    python -m benchmarks.bench_suite --words 10000000 --users 100000 --db-cache /var/tmp/bench
+    python -m benchmarks.bench_suite --save baseline.json
+    python -m benchmarks.bench_suite --compare baseline.json --tolerance 0.2
+
+Generates a database of synthetic vocabularies (a few users own most of the words, like
+in production), builds the bot on a copy of it with the per-chat lanes and the outbox, and
+plays scripted sessions for --active users at once: /add, /show with its Next page,
+flashcards, /find, the export and setting reminders. Every user sends the next update
+only when the bot has answered the previous one, so each step's latency is measured from
+the update to the reply. Finally a batch of due reminders is fired at once.
+
+Reports steps per second, latency percentiles per scenario and step, and the process RSS.
+--save writes the results as JSON; --compare exits with status 1 when a scenario's
+throughput drops or its p99 grows by more than --tolerance against a saved run.
+--metrics writes the bot's metrics page, with its per-handler and per-query histograms.
+Generated databases are kept in --db-cache and reused by later runs with the same sizes;
+with --shards, the copy is split by the rebalance tool before the bot is built.
+The fake API and the driver share the bot's process, so the numbers are for comparing runs
+on the same machine rather than a forecast of production capacity.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+
+import metrics
+import shards
+from benchmarks.bench_runtime import load_bot
+from benchmarks.fake_telegram import FakeTelegram
+
+FIRST_CHAT = 1000
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "to", "su", "vi", "de", "ba", "po", "an", "el", "in", "or", "us"]
+GROUPS = ["default", "irregular verbs", "travel", "food", "business", "phrasal verbs", "idioms",
+          "animals", "weather", "at the doctor"]
+LANGS = ["en", "de", "fr", "es", "it"]
+REPLIES = ("sendMessage", "editMessageText", "sendDocument")
+PERCENTILES = (50, 90, 99)
+
+
+# -------------------------------
+# Synthetic vocabularies
+# -------------------------------
+def synthetic_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def generate_words(words, users, seed):
+    """Yields (chat_id, foreign, native, group, lang); user n owns about 1/(n + 1) of the words."""
+    rng = random.Random(seed)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(users)))
+    ranks = range(users)
+    for _ in range(0, words, 10000):
+        for rank in rng.choices(ranks, cum_weights=cum_weights, k=10000):
+            yield (FIRST_CHAT + rank, synthetic_word(rng), synthetic_word(rng) + "a",
+                   rng.choice(GROUPS), rng.choice(LANGS))
+
+
+def generated_db(cache_dir, words, users, seed):
+    """Path of a database with the given vocabulary sizes, generated on first use."""
+    from database import DataBase
+
+    path = os.path.join(cache_dir, f"words-{words}-users-{users}-seed-{seed}.db")
+    if os.path.exists(path):
+        return path
+    start = time.perf_counter()
+    partial = path + ".partial"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+    db = DataBase(partial, cache_size=0)
+    count = db.input_words_many(itertools.islice(generate_words(words, users, seed), words), batch_size=10000)
+    db.close()
+    os.replace(partial, path)
+    print(f"generated {count} words of {users} users in {time.perf_counter() - start:.0f}s "
+          f"({os.path.getsize(path) / 2 ** 20:.0f} MiB)")
+    return path
+
+
+# -------------------------------
+# Sessions
+# -------------------------------
+# A session is a list of (label, kind, value): kind "text" sends value as a message,
+# "button" presses the button of the bot's last message whose callback data starts with
+# value; when there is no such button (the last page, an empty deck) the step is skipped.
+def session_add(rng):
+    return [("/add", "text", "/add"),
+            ("foreign word", "text", synthetic_word(rng)),
+            ("language", "text", rng.choice(LANGS)),
+            ("native word", "text", synthetic_word(rng) + "a"),
+            ("group", "text", rng.choice(GROUPS))]
+
+
+def session_show(rng):
+    return [("/show", "text", "/show"),
+            ("groups", "text", rng.choice(["all", ", ".join(rng.sample(GROUPS, 2))])),
+            ("final_show", "text", rng.choice(["all", rng.choice(LANGS)])),
+            ("next page", "button", "show_next"),
+            ("next page", "button", "show_next")]
+
+
+def session_flash(rng):
+    cards = [step for _ in range(5) for step in (("show answer", "button", "flash_show"),
+                                                 ("next card", "button", "flash_next"))]
+    return [("/flash", "text", "/flash"),
+            ("random", "text", rng.choice(["Yes", "No"])),
+            ("groups", "text", "all"),
+            ("languages", "text", rng.choice(["all", rng.choice(LANGS)]))] + cards
+
+
+def session_find(rng):
+    return [("/find", "text", "/find " + rng.choice(SYLLABLES) + rng.choice(SYLLABLES)),
+            ("next page", "button", "find_")]
+
+
+def session_export(rng):
+    return [("/upload", "text", "/upload"),
+            ("upload_words_format", "text", rng.choice(["txt", "csv", "json"]))]
+
+
+def session_reminder(rng):
+    return [("/set_reminder", "text", "/set_reminder"),
+            ("group", "text", rng.choice(GROUPS)),
+            ("interval", "text", rng.choice(["10m", "2h", "1d"])),
+            ("/reminders", "text", "/reminders")]
+
+
+SCENARIOS = {
+    "add": session_add,
+    "show": session_show,
+    "flash": session_flash,
+    "find": session_find,
+    "export": session_export,
+    "reminder": session_reminder,
+}
+
+
+class Driver:
+    """Plays sessions against the bot, one step per chat at a time: the next update of a
+    chat is pushed when the bot has answered the previous one."""
+
+    def __init__(self, fake):
+        self.fake = fake
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._scripts = {}
+        self._pending = {}  # chat_id -> (label, time the update was pushed)
+        self._last = {}     # chat_id -> (message_id, reply_markup) of the bot's last reply
+        self.latencies = defaultdict(list)
+        self.reminders = []  # times the fired reminders arrived
+        fake.on_call = self._on_call
+
+    def run(self, scripts, timeout):
+        """Plays scripts (chat_id -> session) and returns (finished, elapsed, steps)."""
+        self.latencies = defaultdict(list)
+        with self._lock:
+            self._scripts = {chat_id: deque(steps) for chat_id, steps in scripts.items()}
+            self._done.clear()
+            start = time.perf_counter()
+            for chat_id in list(self._scripts):
+                self._next(chat_id)
+            self._check_done()
+        finished = self._done.wait(timeout)
+        elapsed = time.perf_counter() - start
+        return finished, elapsed, sum(len(values) for values in self.latencies.values())
+
+    def _next(self, chat_id):
+        steps = self._scripts.get(chat_id)
+        while steps:
+            label, kind, value = steps.popleft()
+            if kind == "text":
+                self.fake.push_message(chat_id, value)
+            else:
+                message_id, markup = self._last.get(chat_id, (None, None))
+                data = next((button["callback_data"] for row in (markup or {}).get("inline_keyboard", [])
+                             for button in row if button.get("callback_data", "").startswith(value)), None)
+                if data is None:
+                    continue
+                self.fake.push_callback(chat_id, data, message_id=message_id)
+            self._pending[chat_id] = (label, time.perf_counter())
+            return
+        self._scripts.pop(chat_id, None)
+
+    def _check_done(self):
+        if not self._scripts and not self._pending:
+            self._done.set()
+
+    def _on_call(self, method, params, result):
+        if method not in REPLIES:
+            return
+        now = time.perf_counter()
+        chat_id = int(params.get("chat_id", 0))
+        if params.get("text", "").startswith("Reminder:"):
+            with self._lock:
+                self.reminders.append(now)
+            return
+        markup = params.get("reply_markup")
+        with self._lock:
+            self._last[chat_id] = (result["message_id"], json.loads(markup) if markup else None)
+            if chat_id not in self._pending:
+                return
+            label, pushed = self._pending.pop(chat_id)
+            self.latencies[label].append(now - pushed)
+            self._next(chat_id)
+            self._check_done()
+
+
+# -------------------------------
+# Measurements
+# -------------------------------
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def summary(values):
+    values = sorted(values)
+    return {f"p{p}": percentile(values, p) * 1000 for p in PERCENTILES} | {"max": (values[-1] if values else 0) * 1000}
+
+
+def rss_mib():
+    # Current RSS where /proc is available, the peak elsewhere
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return peak_rss_mib()
+
+
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(driver, name, chats, sessions, seed, timeout):
+    rng = random.Random(f"{seed}-{name}")
+    scripts = {chat_id: [step for _ in range(sessions) for step in SCENARIOS[name](rng)] for chat_id in chats}
+    finished, elapsed, steps = driver.run(scripts, timeout)
+    latencies = [value for values in driver.latencies.values() for value in values]
+    return {"finished": finished,
+            "steps": steps,
+            "steps_per_s": steps / elapsed if elapsed else 0.0,
+            "latency_ms": summary(latencies),
+            "per_step_ms": {label: summary(values) for label, values in driver.latencies.items()},
+            "rss_mib": rss_mib()}
+
+
+def fire_reminders(app, driver, users, count, timeout):
+    # Every reminder is due now, so the scheduler fires all of them as soon as it starts
+    due = time.time()
+    for i in range(count):
+        app.db.add_reminder(FIRST_CHAT + i % users, "default", 86400, "1d", due)
+    driver.reminders.clear()
+    start = time.perf_counter()
+    app.reminders.start()
+    deadline = time.monotonic() + timeout
+    while len(driver.reminders) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    lags = [fired - start for fired in driver.reminders]
+    elapsed = max(lags) if lags else 0.0
+    return {"finished": len(lags) >= count,
+            "steps": len(lags),
+            "steps_per_s": len(lags) / elapsed if elapsed else 0.0,
+            "latency_ms": summary(lags),
+            "per_step_ms": {},
+            "rss_mib": rss_mib()}
+
+
+def print_result(name, result):
+    latency = result["latency_ms"]
+    status = "" if result["finished"] else "  (timed out)"
+    print(f"{name:<18}{result['steps']:>8}{result['steps_per_s']:>10.0f}"
+          + "".join(f"{latency[f'p{p}']:>9.1f}" for p in PERCENTILES)
+          + f"{latency['max']:>9.1f}{result['rss_mib']:>9.0f}{status}")
+    for label, values in result["per_step_ms"].items():
+        print(f"  {label:<24}{'':>10}" + "".join(f"{values[f'p{p}']:>9.1f}" for p in PERCENTILES)
+              + f"{values['max']:>9.1f}")
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, result in results.items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            continue
+        if result["steps_per_s"] < old["steps_per_s"] * (1 - tolerance):
+            found.append(f"{name}: {result['steps_per_s']:.0f} steps/s, was {old['steps_per_s']:.0f}")
+        if result["latency_ms"]["p99"] > old["latency_ms"]["p99"] * (1 + tolerance):
+            found.append(f"{name}: p99 {result['latency_ms']['p99']:.1f} ms, was {old['latency_ms']['p99']:.1f}")
+    return found
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, default=100_000, help="words in the generated database (1k to 10M)")
+    parser.add_argument("--users", type=int, default=1000, help="users owning them (1 to 100k)")
+    parser.add_argument("--active", type=int, default=200, help="users playing sessions at the same time")
+    parser.add_argument("--sessions", type=int, default=3, help="sessions per active user and scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--reminders", type=int, default=1000, help="reminders fired at once, 0 to skip")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake API latency per call, seconds")
+    parser.add_argument("--workers", type=int, default=8, help="dispatcher lanes")
+    parser.add_argument("--shards", type=int, default=1, help="split the database into this many shards")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per scenario")
+    parser.add_argument("--db-cache", default=os.path.join(tempfile.gettempdir(), "engteacher-bench"),
+                        help="directory keeping the generated databases")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--metrics", help="write the bot's metrics page (Prometheus text) to this file")
+    args = parser.parse_args()
+
+    os.makedirs(args.db_cache, exist_ok=True)
+    source = generated_db(args.db_cache, args.words, args.users, args.seed)
+    results = {}
+    fake = FakeTelegram(latency=args.latency).start()
+    with tempfile.TemporaryDirectory() as workdir:
+        # The sessions write to the database, so every run starts from a fresh copy
+        path = os.path.join(workdir, "EngTeacher.db")
+        shutil.copy(source, path)
+        storage = {"DB_PATH": path}
+        if args.shards > 1:
+            storage = {"DB_SHARDS": [path] + [os.path.join(workdir, f"words-{i}.db") for i in range(1, args.shards)]}
+            start = time.perf_counter()
+            moved = shards.rebalance(storage["DB_SHARDS"])
+            print(f"moved {moved} chats to {args.shards} shards in {time.perf_counter() - start:.1f}s")
+        print(f"rss before loading the bot: {rss_mib():.0f} MiB")
+        app = load_bot(workdir, DISPATCHER_WORKERS=args.workers, **storage)
+        from dispatcher import ChatDispatcher
+
+        dispatcher = ChatDispatcher(app.bot, workers=args.workers).start().attach()
+        polling = threading.Thread(target=app.bot.polling,
+                                   kwargs={"non_stop": True, "timeout": 1, "long_polling_timeout": 1},
+                                   daemon=True)
+        polling.start()
+        driver = Driver(fake)
+        chats = [FIRST_CHAT + rank
+                 for rank in random.Random(args.seed).sample(range(args.users), min(args.active, args.users))]
+
+        print(f"{'scenario':<18}{'steps':>8}{'steps/s':>10}" + "".join(f"{f'p{p} ms':>9}" for p in PERCENTILES)
+              + f"{'max ms':>9}{'rss MiB':>9}")
+        for name in args.scenarios.split(","):
+            results[name] = run_scenario(driver, name, chats, args.sessions, args.seed, args.timeout)
+            print_result(name, results[name])
+        if args.reminders:
+            results["reminders fired"] = fire_reminders(app, driver, args.users, args.reminders, args.timeout)
+            print_result("reminders fired", results["reminders fired"])
+        print(f"peak rss: {peak_rss_mib():.0f} MiB")
+        if args.metrics:
+            with open(args.metrics, "w") as file:
+                file.write(metrics.REGISTRY.render())
+
+        app.bot.stop_polling()
+        polling.join(5)
+        dispatcher.stop()
+        app.outbox.stop()
+        app.db.close()
+    fake.stop()
+
+    run = {"args": vars(args), "results": results}
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(run, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        changed = [name for name in ("words", "users", "active", "sessions", "latency", "workers")
+                   if baseline["args"].get(name) != run["args"][name]]
+        if changed:
+            print(f"warning: the saved run used different {', '.join(changed)}")
+        found = regressions(results, baseline, args.tolerance)
+        for regression in found:
+            print(f"REGRESSION: {regression}")
+        if found:
+            sys.exit(1)
+    if not all(result["finished"] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
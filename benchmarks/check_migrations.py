@@ -0,0 +1,77 @@
+"""Check that processes started together on a new database migrate it exactly once.
+
+Run from the repository root:
+
+    python -m benchmarks.check_migrations --processes 4 --rounds 10
+
+Every round starts --processes interpreters that wait for a common start time and then
+open the same new database file, as workers of a multi-process or autoscaled deployment
+do. Every process must open it without an error, and the database must end at the latest
+schema version with the words written by all of them.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def child(path, start_at, number):
+    import database
+    import migrations
+
+    time.sleep(max(0.0, float(start_at) - time.time()))
+    db = database.DataBase(path, cache_size=0)
+    db.input_words(1000, f"word {number}", f"слово {number}", "default", "en")
+    version = migrations.schema_version(db.conn)
+    db.close()
+    print(version)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    import migrations
+    from database import DataBase
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for number in range(args.rounds):
+            path = os.path.join(workdir, f"round-{number}.db")
+            # Leaves time for the interpreters to start and import the modules
+            start_at = time.time() + 1.0
+            workers = [subprocess.Popen([sys.executable, "-m", "benchmarks.check_migrations", "--child",
+                                         path, str(start_at), str(i)],
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                       for i in range(args.processes)]
+            for worker in workers:
+                out, err = worker.communicate()
+                if worker.returncode:
+                    failures.append(f"round {number}: {err.strip().splitlines()[-1]}")
+                elif int(out) != len(migrations.MIGRATIONS):
+                    failures.append(f"round {number}: a process saw schema version {out.strip()}")
+            db = DataBase(path, cache_size=0)
+            words = len(db.get_show_words(1000))
+            db.close()
+            if words != args.processes:
+                failures.append(f"round {number}: {words} of {args.processes} words were written")
+    print(f"{args.rounds} rounds of {args.processes} processes opening a new database, "
+          f"{len(failures)} failure(s)")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,117 @@
+"""Check the read-through query cache: repeated sessions must stop reaching SQLite.
+
+Run from the repository root:
+
+    python -m benchmarks.check_query_cache --chats 50 --words 500 --sessions 5
+
+Every chat repeats the same show/flashcard/sort session a few times, with and without the
+cache. The script reports the SQL statements executed, the time taken and the cache
+counters, checks that both databases return the same rows, that a write is visible to
+the very next read, and that writes to many more chats leave the cache's memory unchanged.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from database import DataBase
+from state import sizeof
+
+GROUPS = ["default", "food", "travel"]
+LANGS = ["en", "de"]
+
+
+def fill(db, chats, words):
+    db.input_words_many((1000 + chat, f"f{chat}-{i}", f"n{chat}-{i}", GROUPS[i % len(GROUPS)], LANGS[i % len(LANGS)])
+                        for chat in range(chats) for i in range(words))
+
+
+def session(db, chat_id):
+    # What /show (three pages), /flash in both modes and the sort menu read
+    results = []
+    after = None
+    for _ in range(3):
+        page = db.get_show_words_page(chat_id, ["default", "food"], ["en"], after=after, limit=20)
+        results.append(page)
+        if not page:
+            break
+        after = page[-1][0]
+    results.append(db.get_show_words_page(chat_id, [], [], limit=10))
+    results.append(list(db.get_flash_word_ids(chat_id, ["travel"], [])))
+    results.append(db.get_flash_words(chat_id, ["food"], ["de"]))
+    results.append(db.get_words_by_group(chat_id, "default"))
+    results.append(db.get_show_words(chat_id))
+    return results
+
+
+def run(db, chats, sessions):
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    start = time.perf_counter()
+    results = [session(db, 1000 + chat) for _ in range(sessions) for chat in range(chats)]
+    elapsed = time.perf_counter() - start
+    db.conn.set_trace_callback(None)
+    return results, len(statements), elapsed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--words", type=int, default=500, help="words per chat")
+    parser.add_argument("--sessions", type=int, default=5, help="repetitions of the session per chat")
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        plain = DataBase(os.path.join(workdir, "plain.db"), cache_size=0)
+        cached = DataBase(os.path.join(workdir, "cached.db"))
+        for db in (plain, cached):
+            fill(db, args.chats, args.words)
+        expected, plain_statements, plain_time = run(plain, args.chats, args.sessions)
+        results, cached_statements, cached_time = run(cached, args.chats, args.sessions)
+        print(f"no cache: {plain_statements} statements in {plain_time:.2f}s")
+        print(f"   cache: {cached_statements} statements in {cached_time:.2f}s")
+        print(f"   {cached.cache.metrics()}")
+        if results != expected:
+            failures.append("cached results differ from the database")
+        if cached_statements * args.sessions > plain_statements:
+            failures.append("repeated sessions still reach SQLite")
+
+        # Every kind of write must be visible to the next read
+        chat_id = 1000
+        cached.input_words(chat_id, "new", "neu", "default", "en")
+        if ("new", "neu", "default", "en") not in cached.get_show_words(chat_id):
+            failures.append("input_words is not visible")
+        cached.change_group(chat_id, "neu", "food", "en")
+        if ("new", "neu", "food", "en") not in cached.get_words_by_group(chat_id, "food"):
+            failures.append("change_group is not visible")
+        cached.delete_word(chat_id, "neu", "en")
+        if any(row[0] == "new" for row in cached.get_show_words(chat_id)):
+            failures.append("delete_word is not visible")
+        ids = cached.get_flash_word_ids(chat_id)
+        ids.pop()
+        if len(cached.get_flash_word_ids(chat_id)) != len(ids) + 1:
+            failures.append("changing a returned result changes the cache")
+
+        # Invalidating many chats must not grow the cache outside its budget; the counters
+        # themselves may grow past the small ints Python shares, by at most a few bytes each
+        before = sizeof(vars(cached.cache))
+        for other in range(100000):
+            cached.invalidate(10 ** 9 + other)
+        grown = sizeof(vars(cached.cache)) - before
+        print(f"   100000 more chats written: cache grew by {grown} bytes")
+        if grown > 64 * 1024:
+            failures.append(f"the cache grew by {grown} bytes for 100000 written chats")
+        plain.close()
+        cached.close()
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main_cli()
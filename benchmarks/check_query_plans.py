@@ -0,0 +1,100 @@
+"""Checks with EXPLAIN QUERY PLAN that every DataBase method is served by an index.
+
+Each method is called against a small scratch database while the SQL it runs is captured;
+any statement whose plan scans a whole table fails the check. Run from the repository root:
+
+    python -m benchmarks.check_query_plans
+"""
+import inspect
+import os
+import re
+import sys
+import tempfile
+import time
+
+import database
+from database import DataBase
+
+CHAT_ID = 42
+
+# (method name, args); keep in sync with the public DataBase methods that touch the tables
+CALLS = [
+    ("input_words", (CHAT_ID, "apple", "яблоко", "fruits", "en")),
+    ("get_show_words", (CHAT_ID,)),
+    ("get_show_words", (CHAT_ID, ["fruits"])),
+    ("get_show_words", (CHAT_ID, None, ["en"])),
+    ("get_show_words", (CHAT_ID, ["fruits"], ["en"])),
+    ("get_show_words_page", (CHAT_ID, ["fruits"], ["en"], 0)),
+    ("get_show_words_page", (CHAT_ID, None, None, None, 100)),
+    ("iter_show_words", (CHAT_ID,)),
+    ("get_word_for_editing", (CHAT_ID, "яблоко", "en")),
+    ("change_foreign_word", (CHAT_ID, "яблоко", "apples", "en")),
+    ("change_native_word", (CHAT_ID, "яблоко", "яблоки", "en")),
+    ("change_group", (CHAT_ID, "яблоко", "food", "en")),
+    ("change_lang_code", (CHAT_ID, "яблоко", "de", "en")),
+    ("get_words_by_group", (CHAT_ID, "fruits")),
+    ("get_flash_words", (CHAT_ID, ["fruits", "food"], ["en", "de"])),
+    ("get_flash_word_ids", (CHAT_ID, ["food"], ["de"])),
+    ("get_words_by_ids", (CHAT_ID, [1, 2, 3])),
+    ("search_words", (CHAT_ID, "apple")),
+    ("search_words", (CHAT_ID, "ap")),
+    ("search_words", (CHAT_ID, "aplpe")),
+    ("search_words", (CHAT_ID, "a")),
+    ("get_due_words", (CHAT_ID, time.time())),
+    ("get_due_words", (CHAT_ID, time.time(), ["food"], ["de"], 10)),
+    ("grade_word", (CHAT_ID, 1, 2.6, 1, 1, time.time() + 86400)),
+    ("sync_token", (CHAT_ID,)),
+    ("sync_version", (CHAT_ID, "00000000-1")),
+    ("iter_word_changes", (CHAT_ID, None, 100)),
+    ("iter_word_changes", (CHAT_ID, 1, 100)),
+    ("delete_word", (CHAT_ID, "яблоко", "de")),
+    ("add_reminder", (CHAT_ID, "fruits", 600, "10m", time.time() + 600)),
+    ("get_reminders", (CHAT_ID,)),
+    ("get_due_reminders", (time.time() + 3600,)),
+    ("get_due_reminders", (time.time() + 3600, time.time())),
+    ("set_reminder_active", (1, False, time.time())),
+    ("claim_reminders", ([(time.time() + 600, 1, time.time())],)),
+    ("delete_reminder", (1,)),
+]
+
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def explain(db, sql):
+    return [row[3] for row in db.conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+
+
+def main_cli():
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # Without the query cache, so that every call reaches SQLite
+        db = DataBase(os.path.join(workdir, "plans.db"), cache_size=0)
+        # The scratch chat is tiny; search it through the index as a large one would be
+        database.SCAN_WORDS = 0
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        for name, args in CALLS:
+            statements.clear()
+            result = getattr(db, name)(*args)
+            if inspect.isgenerator(result):
+                list(result)
+            for sql in statements:
+                if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                    continue
+                db.conn.set_trace_callback(None)
+                plan = explain(db, sql)
+                db.conn.set_trace_callback(statements.append)
+                scans = [line for line in plan if FULL_SCAN.match(line)]
+                status = "FULL SCAN" if scans else "ok"
+                print(f"{status:>9}  {name}: {'; '.join(plan)}")
+                if scans:
+                    failures.append(name)
+        db.close()
+    if failures:
+        print(f"\n{len(failures)} statement(s) scan a whole table: {', '.join(sorted(set(failures)))}")
+        sys.exit(1)
+    print("\nEvery statement uses an index")
+
+
+if __name__ == "__main__":
+    main_cli()
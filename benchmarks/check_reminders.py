@@ -0,0 +1,231 @@
+"""Check the reminder scheduler and time its start with a large reminders table.
+
+Run from the repository root:
+
+    python -m benchmarks.check_reminders --reminders 100000 --target 1.0
+
+Seeds --reminders reminders spread over the next 30 days (a tenth of them stopped) and
+times ReminderScheduler.start(), which must load exactly the active reminders of the first
+window; the median of --runs starts must stay under --target seconds. Then, on small
+databases with second-long intervals, checks that a reminder fires after it is added, that
+stop, run and delete take effect, that a reminder that missed many fires while the bot was
+down fires once rather than in a burst, and that a reminder beyond the window is loaded
+by a refill and fires on time. Finally two schedulers on one database, as two workers
+run them, must send every fire once and stop sending a reminder stopped through either,
+and a database error on the scheduler thread must be retried rather than end the thread.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from database import DataBase
+from reminders import ReminderScheduler
+
+CHAT_ID = 1000
+DAY = 86400
+
+
+class Recorder:
+    """send callback that counts the fires of every reminder."""
+
+    def __init__(self):
+        self.fires = []
+        self._cond = threading.Condition()
+
+    def __call__(self, chat_id, reminder):
+        with self._cond:
+            self.fires.append((time.time(), reminder["id"]))
+            self._cond.notify_all()
+
+    def count(self, reminder_id=None):
+        with self._cond:
+            return sum(1 for _, fired in self.fires if reminder_id in (None, fired))
+
+    def wait(self, count, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self.fires) >= count, timeout)
+
+
+def seed(db, count, now, rng):
+    rows = [(CHAT_ID + i % 5000, "default", rng.choice((600, 3600, DAY)), "1h",
+             int(rng.random() >= 0.1), now + rng.random() * 30 * DAY) for i in range(count)]
+    with db.write_lock:
+        db.cur.executemany('INSERT INTO reminders ("chat_id", "group", "interval", "time_input", "active", '
+                           '"next_fire") VALUES (?, ?, ?, ?, ?, ?)', rows)
+        db.conn.commit()
+    return rows
+
+
+def in_window(rows, until):
+    return sum(1 for row in rows if row[4] and row[5] <= until)
+
+
+def time_start(path, rows, runs):
+    times, failure = [], None
+    for _ in range(runs):
+        db = DataBase(path, cache_size=0)
+        scheduler = ReminderScheduler(db, Recorder())
+        before = time.time()
+        start = time.perf_counter()
+        scheduler.start()
+        times.append(time.perf_counter() - start)
+        loaded = scheduler.metrics()["loaded"]
+        low, high = (in_window(rows, moment + scheduler.horizon) for moment in (before, time.time()))
+        if not low <= loaded <= high:
+            failure = f"start loaded {loaded} reminders, expected {low}"
+    return times, failure
+
+
+def check_paths(workdir, failures):
+    # add, stop, run and delete on one scheduler
+    db = DataBase(os.path.join(workdir, "paths.db"), cache_size=0)
+    send = Recorder()
+    scheduler = ReminderScheduler(db, send)
+    scheduler.start()
+    reminder = scheduler.add(CHAT_ID, "default", 1, "1s")
+    if not send.wait(2, 3.5):
+        failures.append(f"an added 1s reminder fired {send.count()} times in 3.5s")
+    scheduler.stop(CHAT_ID, 0)
+    stopped = send.count()
+    time.sleep(1.5)
+    if send.count() != stopped or scheduler.get_reminders(CHAT_ID)[0]["active"]:
+        failures.append("a stopped reminder still fires or is still active")
+    scheduler.run(CHAT_ID, 0)
+    if not send.wait(stopped + 1, 2.5):
+        failures.append("a reminder started again with run does not fire")
+    scheduler.delete(CHAT_ID, 0)
+    deleted = send.count()
+    time.sleep(1.5)
+    if send.count() != deleted or scheduler.get_reminders(CHAT_ID):
+        failures.append("a deleted reminder still fires or is still stored")
+    if scheduler.metrics()["loaded"]:
+        failures.append(f"{scheduler.metrics()['loaded']} reminders left in memory after the delete")
+    print(f"add/stop/run/delete: reminder {reminder['id']} fired {deleted} times")
+
+    # A reminder that missed a hundred fires while the bot was down fires once
+    db = DataBase(os.path.join(workdir, "missed.db"), cache_size=0)
+    missed = db.add_reminder(CHAT_ID, "default", 10, "10s", time.time() - 1000)
+    send = Recorder()
+    now = time.time()
+    ReminderScheduler(db, send).start()
+    send.wait(1, 2)
+    time.sleep(0.5)
+    next_fire = db.get_reminders(CHAT_ID)[0][-1]
+    if send.count(missed) != 1:
+        failures.append(f"a reminder that missed 100 fires fired {send.count(missed)} times")
+    if not now < next_fire <= time.time() + 10:
+        failures.append("the next fire of a missed reminder is not one interval from now")
+    print(f"missed fires: fired {send.count(missed)} time(s), next in {next_fire - time.time():.1f}s")
+
+    # A reminder beyond the first window is loaded by a refill
+    db = DataBase(os.path.join(workdir, "refill.db"), cache_size=0)
+    due = time.time() + 3
+    later = db.add_reminder(CHAT_ID, "default", 3600, "1h", due)
+    send = Recorder()
+    scheduler = ReminderScheduler(db, send, horizon=2)
+    scheduler.start()
+    if scheduler.metrics()["loaded"]:
+        failures.append("a reminder beyond the window was loaded at start")
+    if not send.wait(1, 5):
+        failures.append("a reminder beyond the first window never fired")
+    elif abs(send.fires[0][0] - due) > 0.5:
+        failures.append(f"a refilled reminder fired {send.fires[0][0] - due:+.2f}s off its time")
+    else:
+        print(f"refill: reminder {later} fired {send.fires[0][0] - due:+.3f}s off its time")
+
+
+def check_shared(workdir, failures):
+    # Two workers with a scheduler each on one database file: every fire is sent once, and
+    # a reminder stopped through one worker is no longer sent by the other
+    path = os.path.join(workdir, "shared.db")
+    send = Recorder()
+    first, second = (ReminderScheduler(DataBase(path, cache_size=0), send) for _ in range(2))
+    reminder = first.add(CHAT_ID, "default", 1, "1s")
+    first.start()
+    second.start()  # loads the reminder from the database
+    time.sleep(3.5)
+    fired = send.count()
+    if fired != 3:
+        failures.append(f"a 1s reminder shared by two schedulers fired {fired} times in 3.5s")
+    first.stop(CHAT_ID, 0)
+    time.sleep(0.2)
+    stopped = send.count()
+    time.sleep(2)
+    if send.count() != stopped:
+        failures.append(f"a stopped reminder was sent {send.count() - stopped} more times by the other worker")
+    print(f"two schedulers: reminder {reminder['id']} fired {fired} times in 3.5s, "
+          f"{send.count() - stopped} after the stop")
+
+
+def check_errors(workdir, failures):
+    # A database error on the scheduler thread is retried instead of ending the thread, and
+    # the fire whose claim failed is claimed again
+    db = DataBase(os.path.join(workdir, "errors.db"), cache_size=0)
+    claim = db.claim_reminders
+    errors = []
+
+    def failing_claim(claims):
+        if not errors:
+            errors.append(1)
+            raise sqlite3.OperationalError("database is locked")
+        return claim(claims)
+
+    db.claim_reminders = failing_claim
+    send = Recorder()
+    scheduler = ReminderScheduler(db, send)
+    scheduler.start()
+    reminder = scheduler.add(CHAT_ID, "default", 1, "1s")
+    send.wait(2, 4)
+    if not scheduler.metrics()["threads"]:
+        failures.append("a database error ended the scheduler thread")
+    if send.count(reminder["id"]) < 2:
+        failures.append(f"after a failed claim a 1s reminder fired {send.count()} times in 4s")
+    print(f"database error: {len(errors)} failed claim, then {send.count()} fires, "
+          f"{scheduler.metrics()['threads']} scheduler thread running")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reminders", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5, help="starts to time")
+    parser.add_argument("--target", type=float, default=1.0, help="seconds for a start, median")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "reminders.db")
+        db = DataBase(path, cache_size=0)
+        now = time.time()
+        rows = seed(db, args.reminders, now, rng)
+        db.close()
+        expected = in_window(rows, now + ReminderScheduler(None, None).horizon)
+        times, failure = time_start(path, rows, args.runs)
+        if failure:
+            failures.append(failure)
+        median = statistics.median(times)
+        print(f"start with {args.reminders} reminders ({expected} in the first window): "
+              f"median {median * 1000:.1f} ms, max {max(times) * 1000:.1f} ms (target {args.target:.3f}s)")
+        if median > args.target:
+            failures.append(f"a start took {median:.3f}s")
+
+        check_paths(workdir, failures)
+        check_shared(workdir, failures)
+        check_errors(workdir, failures)
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,106 @@
+"""Checks that conversation state survives a hop between bot workers sharing a Redis backend.
+
+Two groups of stores stand for two worker processes. Each is pointed at the same FakeRedis,
+and a conversation is started on one worker and finished on the other. Then threads of both
+workers, on a FakeRedis with a network-like latency, take one next-step handler at once and
+register handlers for one chat at once: the handler must run exactly once, and no
+registration may be lost. Run from the repository root:
+
+    python -m benchmarks.check_state_backends
+"""
+import sys
+import threading
+import time
+
+import state
+from benchmarks.fake_redis import FakeRedis
+from flashcards import FlashSession
+from telebot import Handler
+
+
+def next_step(message):
+    pass
+
+
+def make_worker(client):
+    # Builds the stores a worker creates at startup, all backed by the shared client
+    state.configure(lambda store: state.RedisBackend(client, f"state:{store.name}:"))
+    steps = state.StateStore("steps", ttl=1800)
+    load = state.StateStore("load", ttl=1)
+    flash = state.StateStore("flash", ttl=1800)
+    return steps, load, flash, state.StepHandlerBackend(steps)
+
+
+def race(workers, action):
+    # Runs action(worker, number) on every worker from threads released together
+    barrier = threading.Barrier(len(workers))
+    results = [None] * len(workers)
+
+    def run(number):
+        barrier.wait()
+        results[number] = action(workers[number], number)
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(len(workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def check_concurrent(check, rounds=20, threads=8):
+    client = FakeRedis(latency=0.001)
+    pair = [make_worker(client)[3] for _ in range(2)]
+    workers = [pair[number % 2] for number in range(threads)]
+    taken = registered = 0
+    for chat_id in range(rounds):
+        workers[0].register_handler(chat_id, Handler(next_step))
+        results = race(workers, lambda handlers, _: handlers.get_handlers(chat_id))
+        taken = max(taken, sum(result is not None for result in results))
+    for chat_id in range(rounds, 2 * rounds):
+        race(workers, lambda handlers, number: handlers.register_handler(chat_id, Handler(next_step, number)))
+        registered = min(registered or threads, len(workers[0].get_handlers(chat_id) or []))
+    print(f"{rounds} rounds of {threads} threads: a handler was taken by up to {taken}, "
+          f"at least {registered} of {threads} registrations kept")
+    check("a next-step handler taken by threads of two workers at once runs once", taken == 1)
+    check("handlers registered at once by two workers are all kept", registered == threads)
+
+
+def main_cli():
+    client = FakeRedis()
+    steps_a, load_a, flash_a, handlers_a = make_worker(client)
+    steps_b, load_b, flash_b, handlers_b = make_worker(client)
+    failures = []
+
+    def check(name, condition):
+        print(f"{'ok' if condition else 'FAILED':>6}  {name}")
+        if not condition:
+            failures.append(name)
+
+    load_a[7] = ["apple", "en"]
+    handlers_a.register_handler(7, Handler(next_step))
+    check("cache written by worker A is read by worker B", load_b[7] == ["apple", "en"])
+    handlers = handlers_b.get_handlers(7)
+    check("next-step handler registered on A runs on B",
+          handlers is not None and handlers[0].callback is next_step)
+    check("handlers are consumed once", handlers_a.get_handlers(7) is None)
+
+    session = FlashSession.__new__(FlashSession)
+    session.groups, session.langs, session.seed, session.ids, session.cursor, session.window = \
+        ["g"], [], None, None, 5, [(6, "f", "n", "g", "en")]
+    flash_a[7] = session
+    restored = flash_b[7]
+    check("flashcard sessions round-trip", restored.cursor == 5 and restored.window == session.window)
+
+    time.sleep(1.1)
+    check("entries expire after their TTL", 7 not in load_b)
+    check("cancel on one worker clears the state for all", flash_a.pop(7) is not None and 7 not in flash_b)
+
+    check_concurrent(check)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,162 @@
+"""Check that /sync exports bring a copy of the vocabulary up to date and cost what changed.
+
+Run from the repository root:
+
+    python -m benchmarks.check_sync --words 50000 --rounds 20
+
+A client copy of a chat is built from a full sync export and then kept up to date by
+--rounds delta exports only, each after a random batch of adds, deletes, renames, group
+and language changes and imports of existing words; after every round the copy must equal
+the chat's words, and grading words alone must export nothing. The time of a sync of a
+few changes is compared between a small chat and a chat of --words words, and the time
+of importing --words words is compared with the change tracking triggers dropped.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from database import WORD_COLUMNS, WORDS, DataBase
+from word_io import export_changes
+
+CHAT_ID = 1000
+GROUPS = ["default", "food", "travel"]
+LANGS = ["en", "de"]
+
+
+def sync(db, chat_id, token=None):
+    new_token = db.sync_token(chat_id)
+    since = db.sync_version(chat_id, token) if token else None
+    with export_changes(db.iter_word_changes(chat_id, since, db.sync_version(chat_id, new_token)),
+                        new_token, since is None) as file:
+        return json.load(file)
+
+
+def apply(copy, document):
+    if document["full"]:
+        copy.clear()
+    for change in document["changes"]:
+        if change.get("deleted"):
+            copy.pop(change["id"], None)
+        else:
+            copy[change["id"]] = (change["foreign"], change["native"], change["group"], change["lang"])
+    return document["token"]
+
+
+def words_of(db, chat_id):
+    return {row[0]: tuple(row[1:]) for row in
+            db.fetchall(f'SELECT words."id", {WORD_COLUMNS} {WORDS} WHERE words."chat_id" = ?', (chat_id,))}
+
+
+def edit(db, rng, chat_id, count):
+    # Words picked after an earlier edit changed them just make that edit change nothing
+    words = list(words_of(db, chat_id).values())
+    for _ in range(count):
+        foreign, native, group, lang = rng.choice(words) if words else ("x", "x", "default", "en")
+        number = rng.randrange(10 ** 6)
+        action = rng.randrange(7)
+        if action == 0:
+            db.input_words(chat_id, f"new {number}", f"новое {number}", rng.choice(GROUPS), rng.choice(LANGS))
+        elif action == 1:
+            db.delete_word(chat_id, native, lang)
+        elif action == 2:
+            db.change_foreign_word(chat_id, native, rng.choice([foreign + "!", words[0][0]]), lang)
+        elif action == 3:
+            db.change_native_word(chat_id, native, rng.choice([native + "!", words[0][1]]), lang)
+        elif action == 4:
+            db.change_group(chat_id, native, rng.choice(GROUPS), lang)
+        elif action == 5:
+            db.change_lang_code(chat_id, native, rng.choice(LANGS), lang)
+        else:
+            db.input_words_many([(chat_id, foreign, native, rng.choice(GROUPS), lang)])
+
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def import_time(path, words, tracked):
+    db = DataBase(path, cache_size=0)
+    if not tracked:
+        for (name,) in db.fetchall('SELECT "name" FROM sqlite_master WHERE "type" = \'trigger\' '
+                                   'AND "name" LIKE \'words_sync_%\''):
+            db.query(f'DROP TRIGGER {name}')
+    start = time.perf_counter()
+    db.input_words_many((CHAT_ID, f"word {i}", f"слово {i}", GROUPS[i % 3], LANGS[i % 2]) for i in range(words))
+    elapsed = time.perf_counter() - start
+    db.close()
+    return elapsed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, default=50000, help="words of the large chat")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--edits", type=int, default=10, help="changes per round")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db = DataBase(os.path.join(workdir, "words.db"), cache_size=0)
+        db.input_words_many((CHAT_ID, f"word {i}", f"слово {i}", GROUPS[i % 3], LANGS[i % 2]) for i in range(200))
+        copy = {}
+        token = apply(copy, sync(db, CHAT_ID))
+        for _ in range(args.rounds):
+            edit(db, rng, CHAT_ID, args.edits)
+            document = sync(db, CHAT_ID, token)
+            if document["full"]:
+                failures.append("a delta sync fell back to a full export")
+            token = apply(copy, document)
+            if copy != words_of(db, CHAT_ID):
+                failures.append(f"the copy differs from the chat after {token}")
+                break
+        for word_id in list(copy)[:20]:
+            db.grade_word(CHAT_ID, word_id, 2.6, 1, 1, time.time())
+        if sync(db, CHAT_ID, token)["changes"]:
+            failures.append("grading words was exported as a change")
+        other = DataBase(os.path.join(workdir, "other.db"), cache_size=0)
+        if other.sync_version(CHAT_ID, token) is not None or db.sync_version(CHAT_ID, "garbage") is not None:
+            failures.append("a token of another database was accepted")
+        other.close()
+        print(f"{args.rounds} delta syncs of {args.edits} edits kept the copy up to date")
+
+        # A sync of a few changes should cost the same for a small and a large vocabulary
+        db.input_words_many((CHAT_ID + 1, f"word {i}", f"слово {i}", GROUPS[i % 3], LANGS[i % 2])
+                            for i in range(args.words))
+        results = {}
+        for chat_id, size in ((CHAT_ID, len(copy)), (CHAT_ID + 1, args.words)):
+            token = db.sync_token(chat_id)
+            edit(db, rng, chat_id, args.edits)
+            delta = timed(lambda: sync(db, chat_id, token))
+            full = timed(lambda: sync(db, chat_id), repeat=1)
+            results[size] = delta
+            print(f"{size:>7} words: delta sync {delta * 1000:.2f} ms, full export {full * 1000:.1f} ms")
+        small, large = results.values()
+        if large > small * 5:
+            failures.append(f"a delta sync of the large chat took {large / small:.1f}x as long")
+        db.close()
+
+        before = import_time(os.path.join(workdir, "before.db"), args.words, tracked=False)
+        after = import_time(os.path.join(workdir, "after.db"), args.words, tracked=True)
+        print(f"import of {args.words} words: {before:.2f}s without the change tracking triggers, {after:.2f}s with "
+              f"({(after / before - 1) * 100:+.0f}%)")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,133 @@
+"""Check that words stay unique: the migration merges old duplicates and inserts upsert.
+
+Run from the repository root:
+
+    python -m benchmarks.check_upsert --words 50000
+
+Builds a database at schema version 6 where a third of the rows repeat an earlier word,
+migrates it and checks that one row per (chat, language, native, foreign) is left with the
+review progress of the oldest copy. Then imports a batch where half the words already
+exist and checks the reported count, that existing words moved to the new group and that
+no duplicates were created, and that renaming a word onto an existing one merges the two.
+Finally a file with a malformed line is imported, on one database and on shards, and the
+words before the line must be added.
+"""
+import argparse
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import migrations
+from database import DataBase
+from shards import ShardedDataBase
+from word_io import import_words
+
+CHAT_ID = 1000
+DUPLICATES_VERSION = 6
+
+
+def build_with_duplicates(path, words, rng):
+    conn = sqlite3.connect(path)
+    for number, script in enumerate(migrations.MIGRATIONS[:DUPLICATES_VERSION], start=1):
+        conn.executescript(f'BEGIN;\n{script}\npragma user_version = {number};\nCOMMIT;')
+    conn.execute('INSERT INTO users ("id") VALUES (?)', (CHAT_ID,))
+    conn.execute('INSERT INTO groups ("chat_id", "name") VALUES (?, ?)', (CHAT_ID, "default"))
+    conn.execute('INSERT INTO languages ("code") VALUES (?)', ("en",))
+    unique = words * 2 // 3
+    rows = [(CHAT_ID, f"word {i}", f"слово {i}", i) for i in range(unique)]
+    rows += [(CHAT_ID, f"word {i}", f"слово {i}", -1) for i in rng.sample(range(unique), words - unique)]
+    # repetitions marks the oldest copy of each word with its number
+    conn.executemany('INSERT INTO words ("chat_id", "foreign_word", "native_word", "group_id", "lang_id", '
+                     '"repetitions") VALUES (?, ?, ?, 1, 1, ?)', rows)
+    conn.commit()
+    conn.close()
+    return unique
+
+
+def check_malformed(db, chat_id, failures):
+    file = io.BytesIO("cat --- кот\ndog --- пёс\nbad line\nfox --- лиса\n".encode())
+    words = ((chat_id, foreign, native, "default", "en") for foreign, native in import_words(file, "txt"))
+    try:
+        db.input_words_many(words)
+        failures.append(f"{type(db).__name__}: a malformed line did not stop the import")
+    except ValueError:
+        pass
+    added = [row[0] for row in db.get_show_words(chat_id)]
+    if added != ["cat", "dog"]:
+        failures.append(f"{type(db).__name__}: an import stopped by a malformed line added {added}")
+    print(f"{type(db).__name__}: an import stopped at line 3 added {added}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "words.db")
+        unique = build_with_duplicates(path, args.words, rng)
+        start = time.perf_counter()
+        db = DataBase(path, cache_size=0)
+        print(f"migrated {args.words} rows in {time.perf_counter() - start:.2f}s")
+        rows = db.fetchall('SELECT "foreign_word", "repetitions" FROM words WHERE "chat_id" = ?', (CHAT_ID,))
+        print(f"{len(rows)} rows left of {args.words}")
+        if len(rows) != unique:
+            failures.append(f"{len(rows)} rows after the migration, expected {unique}")
+        if any(repetitions != int(foreign.split()[1]) for foreign, repetitions in rows):
+            failures.append("a duplicate replaced the oldest copy")
+        if db.fetchone('SELECT count(*) FROM words_fts WHERE words_fts MATCH \'"word"\'')[0] != unique:
+            failures.append("the search index still has the removed duplicates")
+
+        if db.input_words(CHAT_ID, "word 0", "слово 0", "default", "en"):
+            failures.append("input_words added an existing word")
+        if not db.input_words(CHAT_ID, "word 0", "слово ноль", "default", "en"):
+            failures.append("input_words did not add a second translation")
+
+        batch = [(CHAT_ID, f"word {i}", f"слово {i}", "imported", "en") for i in range(unique // 2, unique + unique // 2)]
+        batch += batch[:10]  # repeated within the batch as well
+        start = time.perf_counter()
+        added = db.input_words_many(batch, batch_size=len(batch))
+        elapsed = time.perf_counter() - start
+        print(f"imported {len(batch)} words ({added} new) in {elapsed:.2f}s")
+        if added != unique // 2:
+            failures.append(f"input_words_many reported {added} new words")
+        moved = db.fetchone('SELECT count(*) FROM words JOIN groups ON groups."id" = words."group_id" '
+                            'WHERE words."chat_id" = ? AND groups."name" = ?', (CHAT_ID, "imported"))[0]
+        if moved != unique:
+            failures.append(f"{moved} words in the imported group, expected {unique}")
+        if db.fetchone('SELECT count(*) FROM words WHERE "chat_id" = ?', (CHAT_ID,))[0] != unique + unique // 2 + 1:
+            failures.append("the import created duplicates")
+
+        # Renaming a word onto one that exists merges them instead of failing
+        db.input_words(CHAT_ID + 1, "bank", "берег", "default", "en")
+        db.input_words(CHAT_ID + 1, "shore", "берег", "default", "en")
+        db.change_foreign_word(CHAT_ID + 1, "берег", "bank", "en")
+        db.input_words(CHAT_ID + 1, "bank", "банк", "default", "en")
+        db.change_native_word(CHAT_ID + 1, "банк", "берег", "en")
+        db.input_words(CHAT_ID + 1, "bank", "берег", "default", "de")
+        db.change_lang_code(CHAT_ID + 1, "берег", "en", "de")
+        if db.get_show_words(CHAT_ID + 1) != [("bank", "берег", "default", "en")]:
+            failures.append(f"renames left {db.get_show_words(CHAT_ID + 1)}")
+
+        check_malformed(db, CHAT_ID + 2, failures)
+        db.close()
+        sharded = ShardedDataBase([os.path.join(workdir, f"shard-{i}.db") for i in range(2)], cache_size=0)
+        check_malformed(sharded, CHAT_ID + 2, failures)
+        sharded.close()
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main_cli()
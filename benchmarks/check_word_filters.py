@@ -0,0 +1,117 @@
+"""Check and time every word read for every combination of group and language filters.
+
+Run from the repository root:
+
+    python -m benchmarks.check_word_filters --words 20000 --rounds 20
+
+Fills a chat with words spread over four groups and three languages, then calls each
+filtered DataBase read with every subset of the groups (none, one, several, all, plus a
+name that does not exist) crossed with every subset of the languages. The rows must match
+a plain Python filter of the whole table; the time of each method is reported per filter
+shape, along with the number of distinct statement texts the query builder compiled.
+The renames of change_native_word are checked at the end.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+import database
+from database import DataBase
+
+CHAT_ID = 1000
+GROUPS = ["default", "food", "travel", "verbs"]
+LANGS = ["en", "de", "fr"]
+
+
+def subsets(values, extra):
+    for size in range(len(values) + 1):
+        yield from (list(combo) for combo in itertools.combinations(values, size))
+    yield values[:1] + [extra]
+
+
+def expected_rows(words, groups, langs):
+    return [word for word in words
+            if (not groups or word[3] in groups) and (not langs or word[4] in langs)]
+
+
+def read_all_pages(db, groups, langs):
+    rows, after = [], None
+    while True:
+        page = db.get_show_words_page(CHAT_ID, groups, langs, after=after, limit=200)
+        if not page:
+            return rows
+        rows += page
+        after = page[-1][0]
+
+
+# name -> (call, project a reference row (id, foreign, native, group, lang) to the result)
+METHODS = {
+    "get_show_words": (lambda db, g, l: db.get_show_words(CHAT_ID, g, l), lambda row: row[1:]),
+    "get_show_words_page": (read_all_pages, lambda row: row),
+    "get_flash_words": (lambda db, g, l: db.get_flash_words(CHAT_ID, g, l), lambda row: row[1:]),
+    "get_flash_word_ids": (lambda db, g, l: list(db.get_flash_word_ids(CHAT_ID, g, l)), lambda row: row[0]),
+    "get_due_words": (lambda db, g, l: [row[:5] for row in db.get_due_words(CHAT_ID, time.time(), g, l, 10 ** 9)],
+                      lambda row: row),
+}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--words", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=20, help="timed calls per method and filter")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db = DataBase(os.path.join(workdir, "filters.db"), cache_size=0)
+        db.input_words_many((CHAT_ID, f"word {i}", f"слово {i}", rng.choice(GROUPS), rng.choice(LANGS))
+                            for i in range(args.words))
+        db.input_words_many([(CHAT_ID + 1, "other", "другое", group, lang) for group in GROUPS for lang in LANGS])
+        words = db.fetchall(f'SELECT words."id", {database.WORD_COLUMNS} {database.WORDS} '
+                            f'WHERE words."chat_id" = ? ORDER BY words."id"', (CHAT_ID,))
+        unordered = {"get_show_words", "get_flash_words", "get_due_words"}
+
+        print(f"{'groups':>6}{'langs':>6}" + "".join(f"{name:>22}" for name in METHODS))
+        for groups, langs in itertools.product(subsets(GROUPS, "missing"), subsets(LANGS, "xx")):
+            timings = []
+            reference = expected_rows(words, groups, langs)
+            for name, (call, project) in METHODS.items():
+                rows = call(db, groups, langs)
+                want = [project(row) for row in reference]
+                if name in unordered:
+                    rows, want = sorted(rows), sorted(want)
+                if rows != want:
+                    failures.append(f"{name} groups={groups} langs={langs}: {len(rows)} rows, expected {len(want)}")
+                start = time.perf_counter()
+                for _ in range(args.rounds):
+                    call(db, groups, langs)
+                timings.append((time.perf_counter() - start) / args.rounds * 1000)
+            print(f"{len(groups):>6}{len(langs):>6}" + "".join(f"{ms:>20.2f}ms" for ms in timings))
+        print(f"statement texts compiled: {database.word_sql.cache_info().currsize}")
+
+        # A rename touches only the given language, or every language with "all"
+        db.input_words_many([(CHAT_ID + 2, "apple", "яблоко", "food", "en"),
+                             (CHAT_ID + 2, "Apfel", "яблоко", "food", "de")])
+        db.change_native_word(CHAT_ID + 2, "яблоко", "яблоки", "de")
+        if sorted(row[1] for row in db.get_show_words(CHAT_ID + 2)) != ["яблоки", "яблоко"]:
+            failures.append("change_native_word with a language")
+        db.change_native_word(CHAT_ID + 2, "яблоко", "яблоки", "all")
+        if [row[1] for row in db.get_show_words(CHAT_ID + 2)] != ["яблоки", "яблоки"]:
+            failures.append('change_native_word with "all"')
+        db.close()
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main_cli()
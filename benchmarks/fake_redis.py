@@ -0,0 +1,143 @@
+"""A minimal in-process stand-in for a Redis client, for exercising RedisBackend locally.
+
+Implements the subset of commands RedisBackend uses (get, set with ex, expire, delete),
+including key expiry, and redis-py's pipeline with MULTI/EXEC transactions and WATCH.
+latency, in seconds, is spent outside the lock on every round trip, as on a network, so
+that races between commands of concurrent clients show up.
+"""
+import threading
+import time
+
+from redis.exceptions import WatchError
+
+
+class FakeRedis:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._data = {}  # key -> (value, expires_at or None)
+        self._versions = {}  # key -> number of writes, for WATCH
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._call(self._get, key)
+
+    def set(self, key, value, ex=None):
+        return self._call(self._set, key, value, ex)
+
+    def expire(self, key, seconds):
+        return self._call(self._expire, key, seconds)
+
+    def delete(self, *keys):
+        return self._call(self._delete, *keys)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self, transaction)
+
+    def dbsize(self):
+        with self._lock:
+            return sum(self._live(key) is not None for key in list(self._data))
+
+    def _call(self, command, *args):
+        self._round_trip()
+        with self._lock:
+            return command(*args)
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _get(self, key):
+        entry = self._live(key)
+        return None if entry is None else entry[0]
+
+    def _set(self, key, value, ex=None):
+        self._data[key] = (value, None if ex is None else time.monotonic() + ex)
+        self._touch(key)
+        return True
+
+    def _expire(self, key, seconds):
+        entry = self._live(key)
+        if entry is None:
+            return False
+        self._data[key] = (entry[0], time.monotonic() + seconds)
+        self._touch(key)
+        return True
+
+    def _delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self._data.pop(key, None) is not None:
+                self._touch(key)
+                deleted += 1
+        return deleted
+
+    def _touch(self, key):
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            self._touch(key)
+            return None
+        return entry
+
+
+class FakePipeline:
+    """Queues commands until execute, which runs them in one step, or fails with WatchError
+    when a key passed to watch was written since. Between watch and multi, commands run
+    immediately, as in redis-py."""
+
+    def __init__(self, client, transaction):
+        self.client = client
+        self.transaction = transaction
+        self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reset()
+
+    def reset(self):
+        self._commands = []
+        self._watched = None
+        self._immediate = False
+
+    def watch(self, *keys):
+        self.client._round_trip()
+        with self.client._lock:
+            self._watched = {key: self.client._versions.get(key, 0) for key in keys}
+        self._immediate = True
+
+    def multi(self):
+        self._immediate = False
+
+    def get(self, key):
+        return self._queue(self.client._get, key)
+
+    def set(self, key, value, ex=None):
+        return self._queue(self.client._set, key, value, ex)
+
+    def expire(self, key, seconds):
+        return self._queue(self.client._expire, key, seconds)
+
+    def delete(self, *keys):
+        return self._queue(self.client._delete, *keys)
+
+    def execute(self):
+        self.client._round_trip()
+        try:
+            with self.client._lock:
+                if self._watched and any(self.client._versions.get(key, 0) != version
+                                         for key, version in self._watched.items()):
+                    raise WatchError("Watched variable changed.")
+                return [command(*args) for command, args in self._commands]
+        finally:
+            self.reset()
+
+    def _queue(self, command, *args):
+        if self._immediate:
+            return self.client._call(command, *args)
+        self._commands.append((command, args))
+        return self
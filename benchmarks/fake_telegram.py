@@ -0,0 +1,204 @@
+"""A local stand-in for the Telegram Bot API used by the benchmarks.
+
+It serves getUpdates from an in-memory queue of synthetic updates and answers every other
+method with a plausible result after an optional artificial latency, counting the calls.
+With rate_limits=(global_rate, chat_rate, chat_burst) it answers 429 with retry_after like
+Telegram does when the bot sends too fast. on_call, when set, is called as
+on_call(method, params, result) after every answered call other than getUpdates.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from outbox import TokenBucket
+
+RETRY_AFTER = 1
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.0, rate_limits=None):
+        self.latency = latency
+        self.rate_limits = rate_limits
+        self.on_call = None
+        self.calls = Counter()
+        self.limited = Counter()
+        self._buckets = {}
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self.server = _Server(("127.0.0.1", 0), _make_handler(self))
+        self._thread = None
+
+    @property
+    def api_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        from telebot import apihelper
+
+        apihelper.API_URL = self.api_url
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._cond:
+            self._updates.clear()
+            self.calls.clear()
+            self.limited.clear()
+            self._buckets.clear()
+
+    # -------------------------------
+    # Synthetic updates
+    # -------------------------------
+    def push_message(self, chat_id, text):
+        update_id = next(self._update_ids)
+        self._push({"update_id": update_id,
+                    "message": {"message_id": next(self._message_ids),
+                                "date": int(time.time()),
+                                "chat": {"id": chat_id, "type": "private"},
+                                "from": {"id": chat_id, "is_bot": False, "first_name": "user"},
+                                "text": text}})
+        return update_id
+
+    def push_callback(self, chat_id, data, message_id=1, text=""):
+        update_id = next(self._update_ids)
+        self._push({"update_id": update_id,
+                    "callback_query": {"id": str(update_id),
+                                       "chat_instance": str(chat_id),
+                                       "from": {"id": chat_id, "is_bot": False, "first_name": "user"},
+                                       "data": data,
+                                       "message": {"message_id": message_id,
+                                                   "date": int(time.time()),
+                                                   "chat": {"id": chat_id, "type": "private"},
+                                                   "text": text}}})
+        return update_id
+
+    def _push(self, update):
+        with self._cond:
+            self._updates.append(update)
+            self._cond.notify_all()
+
+    def wait_for_calls(self, count, methods=("sendMessage", "editMessageText", "sendDocument"), timeout=60):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while sum(self.calls[m] for m in methods) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # -------------------------------
+    # API methods
+    # -------------------------------
+    def handle(self, method, params):
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if self.latency:
+            time.sleep(self.latency)
+        if self._over_limit(params.get("chat_id")):
+            with self._cond:
+                self.limited[method] += 1
+            raise RateLimited()
+        result = self._result(method, params)
+        with self._cond:
+            self.calls[method] += 1
+            self._cond.notify_all()
+        if self.on_call is not None:
+            self.on_call(method, params, result)
+        return result
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method in ("sendMessage", "sendDocument", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            message_id = int(params.get("message_id") or next(self._message_ids))
+            return {"message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": params.get("text", "")}
+        return True
+
+    def _over_limit(self, chat_id):
+        if self.rate_limits is None or chat_id is None:
+            return False
+        global_rate, chat_rate, chat_burst = self.rate_limits
+        now = time.monotonic()
+        with self._cond:
+            if None not in self._buckets:
+                self._buckets[None] = TokenBucket(global_rate, global_rate)
+            if chat_id not in self._buckets:
+                self._buckets[chat_id] = TokenBucket(chat_rate, chat_burst)
+            buckets = self._buckets[None], self._buckets[chat_id]
+            if any(bucket.delay(now) for bucket in buckets):
+                return True
+            for bucket in buckets:
+                bucket.take(now)
+            return False
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = min(float(params.get("timeout") or 0), 0.5)
+        with self._cond:
+            # Like Telegram, an offset confirms every update before it
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            if not self._updates and timeout:
+                self._cond.wait(timeout)
+            return self._updates[:limit]
+
+
+class RateLimited(Exception):
+    pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def _make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._dispatch()
+
+        def do_POST(self):
+            self._dispatch()
+
+        def _dispatch(self):
+            url = urlsplit(self.path)
+            method = url.path.rsplit("/", 1)[-1]
+            params = dict(parse_qsl(url.query))
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                params.update(parse_qsl(body.decode()))
+            try:
+                status, payload = 200, {"ok": True, "result": fake.handle(method, params)}
+            except RateLimited:
+                status, payload = 429, {"ok": False, "error_code": 429,
+                                        "description": f"Too Many Requests: retry after {RETRY_AFTER}",
+                                        "parameters": {"retry_after": RETRY_AFTER}}
+            payload = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,120 @@
+"""Send a burst of messages (like many reminders firing at once) to a rate-limited fake API.
+
+Run from the repository root:
+
+    python -m benchmarks.outbox_burst --chats 50 --messages 4
+
+"inline" sends every message from a pool of threads with bot.send_message, like the
+handlers did before the outbox; "outbox" queues them in an Outbox. For both, the script
+reports how many requests the fake API rejected with 429 and how many messages were lost.
+It then queues repeated edits of one message to show how they coalesce, and checks that a
+document answered with 429 is sent whole again on the retry.
+"""
+import argparse
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+from telebot.apihelper import ApiTelegramException
+
+from benchmarks.fake_telegram import FakeTelegram
+from outbox import Outbox
+
+
+def burst(chats, messages):
+    return [(1000 + chat, f"Reminder {number}") for number in range(messages) for chat in range(chats)]
+
+
+def bench_inline(bot, fake, jobs, threads):
+    fake.reset()
+    lost = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        for future in [pool.submit(bot.send_message, chat_id, text) for chat_id, text in jobs]:
+            try:
+                future.result()
+            except ApiTelegramException:
+                lost += 1
+    # The calling thread is blocked for the whole burst
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, lost
+
+
+def bench_outbox(bot, fake, jobs, threads, limits):
+    fake.reset()
+    outbox = Outbox(bot, workers=threads, global_rate=limits[0], chat_rate=limits[1], chat_burst=limits[2])
+    start = time.perf_counter()
+    futures = [outbox.send_message(chat_id, text) for chat_id, text in jobs]
+    enqueued = time.perf_counter() - start
+    outbox.flush()
+    elapsed = time.perf_counter() - start
+    outbox.stop()
+    return elapsed, enqueued, sum(1 for future in futures if future.exception() is not None)
+
+
+def bench_coalescing(bot, fake, edits):
+    fake.reset()
+    outbox = Outbox(bot)
+    for number in range(edits):
+        outbox.edit_message_text(f"Page {number}", 1000, 1)
+    outbox.flush()
+    outbox.stop()
+    return fake.calls["editMessageText"]
+
+
+class RateLimitedDocuments:
+    """Bot stub whose send_document reads the whole file and answers 429 the first time."""
+
+    def __init__(self):
+        self.received = []
+
+    def send_document(self, chat_id, document, **kwargs):
+        self.received.append(document.read())
+        if len(self.received) == 1:
+            raise ApiTelegramException("sendDocument", None, {"error_code": 429, "description": "Too Many Requests",
+                                                              "parameters": {"retry_after": 0}})
+        return True
+
+
+def bench_document_retry():
+    # The retry of a document must send the whole file again, not what the first attempt left
+    bot = RateLimitedDocuments()
+    outbox = Outbox(bot)
+    file = io.BytesIO("apple --- яблоко\n".encode() * 1000)
+    outbox.send_document(1000, file).result(timeout=10)
+    outbox.stop()
+    return [len(body) for body in bot.received]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=4, help="messages per chat")
+    parser.add_argument("--threads", type=int, default=8, help="sending threads in both modes")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake API latency per call, seconds")
+    parser.add_argument("--limits", type=float, nargs=3, default=(30, 1, 3),
+                        metavar=("GLOBAL", "CHAT", "BURST"), help="rate limits of the fake API")
+    parser.add_argument("--edits", type=int, default=20, help="edits of one message for the coalescing run")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(latency=args.latency, rate_limits=tuple(args.limits)).start()
+    bot = telebot.TeleBot("123456:BENCHMARK")
+    jobs = burst(args.chats, args.messages)
+    for name, run in (("inline", lambda: bench_inline(bot, fake, jobs, args.threads)),
+                      ("outbox", lambda: bench_outbox(bot, fake, jobs, args.threads, args.limits))):
+        elapsed, enqueued, lost = run()
+        print(f"{name:>6}: {len(jobs)} messages in {elapsed:.2f}s (queued in {enqueued * 1000:.1f} ms), "
+              f"{sum(fake.limited.values())} answered 429, {lost} lost")
+    print(f"{args.edits} queued edits of one message -> {bench_coalescing(bot, fake, args.edits)} API calls")
+    fake.stop()
+    sizes = bench_document_retry()
+    print(f"document answered 429 once -> attempts sent {sizes} bytes")
+    if len(set(sizes)) != 1:
+        print("FAILED: the retry of a document did not send the whole file")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,66 @@
+"""Multi-threaded stress test for DataBase: checks isolation of results and measures throughput.
+
+Every thread owns one chat, interleaves inserts with reads of its own words and verifies that
+each read sees exactly its own rows. Run from the repository root:
+
+    python -m benchmarks.stress_database --threads 16 --ops 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from database import DataBase
+
+
+def worker(db, chat_id, ops, reads_per_write, errors, counters):
+    inserted = 0
+    for i in range(ops):
+        if i % (reads_per_write + 1) == 0:
+            db.input_words(chat_id, f"w{chat_id}-{inserted}", "native", "default", "en")
+            inserted += 1
+            counters["writes"] += 1
+            continue
+        rows = db.get_words_by_group(chat_id, "default")
+        counters["reads"] += 1
+        if len(rows) != inserted or any(not row[0].startswith(f"w{chat_id}-") for row in rows):
+            errors.append(f"chat {chat_id}: expected {inserted} own rows, got {len(rows)}")
+            return
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=2000, help="operations per thread")
+    parser.add_argument("--reads-per-write", type=int, default=4)
+    parser.add_argument("--cache-size", type=int, default=10000, help="query cache entries, 0 to disable")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db = DataBase(os.path.join(workdir, "stress.db"), cache_size=args.cache_size)
+        errors = []
+        counters = {"reads": 0, "writes": 0}
+        threads = [threading.Thread(target=worker,
+                                    args=(db, chat_id, args.ops, args.reads_per_write, errors, counters))
+                   for chat_id in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        db.close()
+
+    total = args.threads * args.ops
+    print(f"{args.threads} threads, {total} ops in {elapsed:.2f}s -> {total / elapsed:.0f} ops/s "
+          f"(~{counters['reads']} reads, ~{counters['writes']} writes)")
+    if errors:
+        print("FAILED:\n" + "\n".join(errors[:10]))
+        sys.exit(1)
+    print("OK: every read returned exactly its own chat's rows")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,165 @@
+"""Load-test the webhook server: post synthetic updates and report handler latency.
+
+Run from the repository root:
+
+    python -m benchmarks.webhook_load --chats 200 --updates 5000 --clients 32 --latency 0.01
+
+Latency is measured from the moment an update is posted until its handler returns, so it
+includes the time spent waiting in the dispatcher queue. Rejected (429) posts are retried
+after --retry-delay like Telegram would, and counted. The run fails if the updates of any
+chat were handled out of order, or if malformed bodies are not answered with 400.
+"""
+import argparse
+import json
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from benchmarks.bench_runtime import load_bot
+from benchmarks.fake_telegram import FakeTelegram
+
+
+def make_update(update_id, chat_id, text):
+    return {"update_id": update_id,
+            "message": {"message_id": update_id,
+                        "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"},
+                        "from": {"id": chat_id, "is_bot": False, "first_name": "user"},
+                        "text": text}}
+
+
+class Recorder:
+    """Records the order in which the dispatcher accepts and finishes the updates of each chat,
+    and when every update finishes."""
+
+    def __init__(self, dispatcher):
+        self.posted = {}
+        self.finished = {}
+        self.accepted = defaultdict(list)
+        self.order = defaultdict(list)
+        self.lock = threading.Lock()
+        self._handle = dispatcher.handle
+        self._submit = dispatcher.submit
+        dispatcher.handle = self.handle
+        dispatcher.submit = self.submit
+
+    def submit(self, update, block=False):
+        # Queue and record under one lock so that the recorded order is the queued order
+        with self.lock:
+            self._submit(update, block)
+            self.accepted[update.message.chat.id].append(update.update_id)
+
+    def handle(self, updates):
+        self._handle(updates)
+        now = time.perf_counter()
+        with self.lock:
+            for update in updates:
+                self.finished[update.update_id] = now
+                self.order[update.message.chat.id].append(update.update_id)
+
+    def latencies(self):
+        return sorted(self.finished[i] - self.posted[i] for i in self.finished)
+
+
+def post_all(url, jobs, recorder, retry_delay, stats):
+    while True:
+        try:
+            update = jobs.get_nowait()
+        except queue.Empty:
+            return
+        body = json.dumps(update).encode()
+        recorder.posted.setdefault(update["update_id"], time.perf_counter())
+        while True:
+            request = urllib.request.Request(url, body, {"Content-Type": "application/json"})
+            try:
+                urllib.request.urlopen(request).close()
+                break
+            except urllib.error.HTTPError as e:
+                if e.code != 429:
+                    raise
+                stats["rejected"] += 1
+                time.sleep(retry_delay)
+
+
+def post_status(url, body):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body)) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent posting threads")
+    parser.add_argument("--workers", type=int, default=8, help="dispatcher worker threads")
+    parser.add_argument("--queue-size", type=int, default=100, help="dispatcher queue size per worker")
+    parser.add_argument("--latency", type=float, default=0.01, help="fake API latency per call, seconds")
+    parser.add_argument("--retry-delay", type=float, default=0.05, help="wait after a 429, seconds")
+    parser.add_argument("--command", default="/reminders", help="command every synthetic update sends")
+    args = parser.parse_args()
+
+    from dispatcher import ChatDispatcher
+    from webhook import WebhookServer
+
+    fake = FakeTelegram(latency=args.latency).start()
+    with tempfile.TemporaryDirectory() as workdir:
+        app = load_bot(workdir)
+        dispatcher = ChatDispatcher(app.bot, workers=args.workers, queue_size=args.queue_size).start()
+        recorder = Recorder(dispatcher)
+        server = WebhookServer(("127.0.0.1", 0), dispatcher)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://%s:%d/" % server.server_address
+        malformed = {body: post_status(url, body) for body in (b"null", b"[]", b"{", b"")}
+
+        jobs = queue.Queue()
+        for i in range(1, args.updates + 1):
+            jobs.put(make_update(i, 1000 + i % args.chats, args.command))
+        stats = {"rejected": 0}
+        start = time.perf_counter()
+        clients = [threading.Thread(target=post_all, args=(url, jobs, recorder, args.retry_delay, stats))
+                   for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        dispatcher.stop()
+        lanes = dispatcher.metrics()
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+        app.db.close()
+    fake.stop()
+
+    latencies = recorder.latencies()
+    print(f"{len(latencies)} updates in {elapsed:.2f}s -> {len(latencies) / elapsed:.0f} updates/s, "
+          f"{stats['rejected']} posts rejected with 429")
+    print(f"handler latency: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms, "
+          f"mean {statistics.mean(latencies) * 1000:.1f} ms")
+    print(f"dispatcher: max lane depth {max(lane['max_depth'] for lane in lanes['lanes'])}, "
+          f"max queue wait {lanes['wait_max'] * 1000:.1f} ms")
+    unordered = [chat for chat, ids in recorder.order.items() if ids != recorder.accepted[chat]]
+    for body, status in malformed.items():
+        if status != 400:
+            print(f"FAILED: a body of {body!r} was answered with {status}")
+            sys.exit(1)
+    if len(latencies) != args.updates or unordered:
+        print(f"FAILED: {args.updates - len(latencies)} updates lost, {len(unordered)} chats out of order")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,74 @@
+"""Command line entry point of the bot.
+
+    python cli.py                    # long polling, handlers run on the per-chat lanes
+    python cli.py webhook            # Telegram pushes updates to a local HTTP server
+    python cli.py async              # long polling from an asyncio loop
+    python cli.py --config prod_config polling
+
+The settings are read from the config module (config.py by default). Only the runtime
+that is chosen is imported.
+"""
+import argparse
+import importlib
+
+import metrics
+
+
+def run_polling(app):
+    from dispatcher import ChatDispatcher
+
+    # Updates of one chat are handled in order, updates of different chats in parallel
+    ChatDispatcher(app.bot, workers=getattr(app.config, "DISPATCHER_WORKERS", 8)).start().attach()
+    app.reminders.start()
+    app.bot.infinity_polling()
+
+
+def run_webhook(app):
+    from dispatcher import ChatDispatcher
+    from webhook import WebhookServer
+
+    config = app.config
+    dispatcher = ChatDispatcher(app.bot,
+                                workers=getattr(config, "WEBHOOK_WORKERS", 8),
+                                queue_size=getattr(config, "WEBHOOK_QUEUE_SIZE", 100)).start()
+    secret = getattr(config, "WEBHOOK_SECRET", None)
+    server = WebhookServer((getattr(config, "WEBHOOK_HOST", "0.0.0.0"), getattr(config, "WEBHOOK_PORT", 8443)),
+                           dispatcher, secret)
+    app.bot.remove_webhook()
+    app.bot.set_webhook(url=config.WEBHOOK_URL, secret_token=secret)
+    app.reminders.start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        dispatcher.stop()
+
+
+def run_async(app):
+    import asyncio
+
+    from async_runtime import AsyncRuntime
+
+    app.reminders.start()
+    asyncio.run(AsyncRuntime(app.bot).run())
+
+
+RUNTIMES = {"polling": run_polling, "webhook": run_webhook, "async": run_async}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("runtime", nargs="?", choices=RUNTIMES, default="polling")
+    parser.add_argument("--config", default="config", help="module the settings are read from")
+    args = parser.parse_args(argv)
+
+    from main import create_app
+
+    app = create_app(importlib.import_module(args.config))
+    if getattr(app.config, "METRICS_PORT", None):
+        metrics.serve(app.config.METRICS_PORT, getattr(app.config, "METRICS_HOST", "0.0.0.0"))
+    RUNTIMES[args.runtime](app)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,155 @@
+import functools
+import itertools
 import sqlite3 as lite
+import threading
+from array import array
 
+import metrics
+import migrations
+import search
+from query_cache import QueryCache, cached
 
+# Applied to every connection. WAL lets readers run alongside the single writer.
+PRAGMAS = (
+    'pragma journal_mode = wal',
+    'pragma synchronous = normal',
+    'pragma busy_timeout = 5000',
+    'pragma cache_size = -16000',
+    'pragma temp_store = memory',
+    'pragma mmap_size = 268435456',
+    'pragma foreign_keys = on',
+)
+
+SEARCH_LIMIT = 100
+FUZZY_CANDIDATES = 200  # best trigram matches that are ranked by similarity
+SCAN_WORDS = 5000  # chats with at most this many words are searched without the index
+
+# Words are stored with the ids of their group and language; queries join the names back
+WORDS = 'FROM words JOIN groups ON groups."id" = words."group_id" JOIN languages ON languages."id" = words."lang_id"'
+WORD_COLUMNS = 'words."foreign_word", words."native_word", groups."name", languages."code"'
+GROUP_ID = '(SELECT "id" FROM groups WHERE "chat_id" = ? AND "name" = ?)'
+LANG_ID = '(SELECT "id" FROM languages WHERE "code" = ?)'
+NOW = "(julianday('now') - 2440587.5) * 86400.0"  # unix time in SQL
+# Adding a word that is already there moves it to the new group and keeps its review progress.
+# New words are stamped with the time and the next sync_clock version (see migration 8).
+INSERT_WORD = (f'INSERT INTO words ("chat_id", "foreign_word", "native_word", "group_id", "lang_id", '
+               f'"created_at", "updated_at", "version") '
+               f'VALUES (?, ?, ?, {GROUP_ID}, {LANG_ID}, {NOW}, {NOW}, '
+               f'(SELECT "version" + 1 FROM sync_clock WHERE "id" = 0)) '
+               f'ON CONFLICT ("chat_id", "lang_id", "native_word", "foreign_word") '
+               f'DO UPDATE SET "group_id" = excluded."group_id" WHERE "group_id" IS NOT excluded."group_id"')
+# Changes to a chat's words in (since, until] by sync_clock version: the words added or edited
+# in that range, then the tombstones of the words deleted in it, as rows of
+# (id, foreign, native, group, lang, created_at, changed_at, deleted, version)
+SYNC_WORDS = (f'SELECT words."id", {WORD_COLUMNS}, words."created_at", words."updated_at", 0, words."version" '
+              f'{WORDS} WHERE words."chat_id" = ? AND words."version" > ? AND words."version" <= ?')
+SYNC_TOMBSTONES = ('SELECT t."word_id", t."foreign_word", t."native_word", NULL, languages."code", NULL, '
+                   't."deleted_at", 1, t."version" '
+                   'FROM word_tombstones AS t JOIN languages ON languages."id" = t."lang_id" '
+                   'WHERE t."chat_id" = ? AND t."version" > ? AND t."version" <= ?')
+
+
+def padded(values):
+    """values as a list whose length is rounded up to a power of two by repeating the last value.
+
+    IN lists of similar length then share one statement text, so they hit the sqlite3
+    statement cache instead of being compiled again; the repeated values change nothing."""
+    values = list(values or ())
+    if len(values) > 1:
+        values += values[-1:] * ((1 << (len(values) - 1).bit_length()) - len(values))
+    return values
+
+
+@functools.lru_cache(maxsize=512)
+def word_sql(columns, groups=0, langs=0, where='', order='words."id"', limit=False, source=WORDS):
+    """SELECT text for a chat's words filtered by the given numbers of group names and language
+    codes. The names are resolved to ids first, so the words are filtered by integer
+    comparisons on the indexes. The placeholders are, in order: chat_id, chat_id and the group
+    names, the language codes, the values of where, the limit."""
+    query = f'SELECT {columns} {source} WHERE words."chat_id" = ?'
+    if groups:
+        query += (f' AND words."group_id" IN (SELECT "id" FROM groups '
+                  f'WHERE "chat_id" = ? AND "name" IN ({", ".join(["?"] * groups)}))')
+    if langs:
+        query += f' AND words."lang_id" IN (SELECT "id" FROM languages WHERE "code" IN ({", ".join(["?"] * langs)}))'
+    if where:
+        query += f' AND {where}'
+    if order:
+        query += f' ORDER BY {order}'
+    if limit:
+        query += ' LIMIT ?'
+    return query
+
+
+def word_query(columns, chat_id, groups=None, langs=None, where='', params=(), order='words."id"', limit=None,
+               source=WORDS):
+    """Returns (sql, params) selecting columns of a chat's words; every word read goes through here.
+
+    where is an extra condition whose values are params, order an ORDER BY clause (words are
+    in rowid order by default) and source the FROM clause, WORDS or 'FROM words' when no
+    names are read."""
+    groups, langs = padded(groups), padded(langs)
+    values = [chat_id]
+    if groups:
+        values += [chat_id] + groups
+    values += langs
+    values += params
+    if limit is not None:
+        values.append(limit)
+    return word_sql(columns, len(groups), len(langs), where, order, limit is not None, source), values
+
+
+@metrics.timed_methods(metrics.QUERY_SECONDS, exclude=("query", "fetchone", "fetchall", "invalidate", "close"))
 class DataBase:
-    def __init__(self):
-        self.conn = lite.connect("EngTeacher.db", check_same_thread=False)
-        self.conn.execute('pragma foreign_keys = on')
-        self.conn.commit()
-        self.cur = self.conn.cursor()
+    """Each thread gets its own connection and cursor; writes are serialized by write_lock.
+
+    Per-chat word queries go through a read-through QueryCache (cache_size=0 disables it);
+    every method that changes a chat's words invalidates that chat.
+    """
+
+    def __init__(self, path="EngTeacher.db", cache_size=10000, cache_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.cache = QueryCache(cache_size, cache_bytes) if cache_size else None
+        self.write_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        with self.write_lock:
+            migrations.migrate(self.conn)
+
+    def _thread_state(self):
+        local = self._local
+        if not hasattr(local, "conn"):
+            local.conn = lite.connect(self.path, check_same_thread=False)
+            for pragma in PRAGMAS:
+                local.conn.execute(pragma)
+            local.cur = local.conn.cursor()
+            with self._connections_lock:
+                self._connections.append(local.conn)
+        return local
+
+    @property
+    def conn(self):
+        return self._thread_state().conn
+
+    @property
+    def cur(self):
+        return self._thread_state().cur
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
 
     def query(self, arg, values=None):
-        if values is None:
-            self.cur.execute(arg)
-        else:
-            self.cur.execute(arg, values)
-        self.conn.commit()
+        with self.write_lock:
+            if values is None:
+                self.cur.execute(arg)
+            else:
+                self.cur.execute(arg, values)
+            self.conn.commit()
 
     def fetchone(self, arg, values=None):
         if values is None:
@@ -22,6 +158,10 @@ class DataBase:
             self.cur.execute(arg, values)
         return self.cur.fetchone()
 
+    def invalidate(self, chat_id):
+        if self.cache is not None:
+            self.cache.invalidate(chat_id)
+
     def fetchall(self, arg, values=None):
         if values is None:
             self.cur.execute(arg)
@@ -29,106 +169,333 @@ class DataBase:
             self.cur.execute(arg, values)
         return self.cur.fetchall()
 
+    def _add_labels(self, rows):
+        # rows: (chat_id, group, lang); creates the users, groups and languages that are missing.
+        # Runs inside the caller's write transaction.
+        self.cur.executemany('INSERT OR IGNORE INTO users ("id") VALUES (?)', {(row[0],) for row in rows})
+        self.cur.executemany('INSERT OR IGNORE INTO groups ("chat_id", "name") VALUES (?, ?)',
+                             {(row[0], row[1]) for row in rows})
+        self.cur.executemany('INSERT OR IGNORE INTO languages ("code") VALUES (?)', {(row[2],) for row in rows})
+
+    def _last_word_id(self):
+        return self.cur.execute('SELECT coalesce(max("id"), 0) FROM words').fetchone()[0]
+
     def input_words(self, chat_id, foreign_word, native_word, group, lang):
-        # Insert the word with the given group
-        self.cur.execute('INSERT INTO words ("chat_id", "foreign_word", "native_word", "group", "lang") VALUES (?, ?, ?, ?, ?)',
-                         (chat_id,
-                          foreign_word,
-                          native_word,
-                          group,
-                          lang))
-        self.conn.commit()
+        # Insert the word with the given group; returns False when it was already there
+        with self.write_lock:
+            self._add_labels([(chat_id, group, lang)])
+            last_id = self._last_word_id()
+            self.cur.execute(INSERT_WORD,
+                             (chat_id,
+                              foreign_word,
+                              native_word,
+                              chat_id, group,
+                              lang))
+            added = self._last_word_id() > last_id
+            self.conn.commit()
+        self.invalidate(chat_id)
+        return added
+
+    def input_words_many(self, words, batch_size=1000):
+        # words: iterable of (chat_id, foreign_word, native_word, group, lang), consumed lazily.
+        # Every batch is one executemany in its own transaction; duplicates, in the table or
+        # within the batch, are merged by the upsert. Returns the number of new words. When
+        # iterating words raises, the words read before the error are added and it propagates.
+        words = iter(words)
+        count = 0
+        while True:
+            batch = []
+            try:
+                for word in itertools.islice(words, batch_size):
+                    batch.append(word)
+            finally:
+                if batch:
+                    count += self._insert_words(batch)
+            if len(batch) < batch_size:
+                return count
+
+    def _insert_words(self, batch):
+        with self.write_lock:
+            self._add_labels([(word[0], word[3], word[4]) for word in batch])
+            last_id = self._last_word_id()
+            self.cur.executemany(INSERT_WORD,
+                                 [(word[0], word[1], word[2], word[0], word[3], word[4]) for word in batch])
+            # New rows get ids above the old maximum; merged ones keep theirs
+            count = self.cur.execute('SELECT count(*) FROM words WHERE "id" > ?', (last_id,)).fetchone()[0]
+            self.conn.commit()
+        for chat_id in {word[0] for word in batch}:
+            self.invalidate(chat_id)
+        return count
 
+    @cached
     def get_show_words(self, chat_id, groups=None, langs=None):
-        if not groups:
-            groups = []
-        if not langs:
-            langs = []
-        groups_placeholders = ", ".join(["?"] * len(groups))
-        langs_placeholders = ", ".join(["?"] * len(langs))
-        params = [chat_id] + groups + langs
-        if groups and langs:
-            return self.fetchall(
-                f'SELECT "foreign_word", "native_word", "group", "lang" '
-                f'FROM words WHERE "chat_id" = (?) '
-                f'AND "group" IN ({groups_placeholders}) AND "lang" = ({langs_placeholders})',
-                params)
-        elif groups and not langs:
-            return self.fetchall(
-                f'SELECT "foreign_word", "native_word", "group", "lang" '
-                f'FROM words WHERE "chat_id" = (?) AND "group" = ({groups_placeholders})',
-                params)
-        elif not groups and langs:
-            return self.fetchall(
-                f'SELECT "foreign_word", "native_word", "group", "lang" '
-                f'FROM words WHERE "chat_id" = (?) AND "lang" = ({langs_placeholders})',
-                params)
+        return self.fetchall(*word_query(WORD_COLUMNS, chat_id, groups, langs))
+
+    @cached
+    def get_show_words_page(self, chat_id, groups=None, langs=None, after=None, before=None, limit=20):
+        # Keyset pagination on rowid: every page is a range scan of the (chat_id, rowid) index,
+        # so a deep page costs the same as the first one.
+        # Returns up to limit rows of (rowid, foreign, native, group, lang) in rowid order.
+        where, params = [], []
+        if after is not None:
+            where.append('words."id" > ?')
+            params.append(after)
+        if before is not None:
+            where.append('words."id" < ?')
+            params.append(before)
+        rows = self.fetchall(*word_query(f'words."id", {WORD_COLUMNS}', chat_id, groups, langs,
+                                         ' AND '.join(where), params,
+                                         'words."id" DESC' if before is not None else 'words."id"', limit))
+        return rows[::-1] if before is not None else rows
+
+    def iter_show_words(self, chat_id, batch_size=500):
+        # A dedicated cursor keeps the stream independent of other queries made by this thread
+        cur = self.conn.cursor()
+        try:
+            cur.execute(*word_query(WORD_COLUMNS, chat_id))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cur.close()
+
+    # Sync tokens are "<database>-<version>" of sync_clock. The database id is random per file,
+    # so a token from another file (a restored backup, or a shard the chat was moved from)
+    # is not taken for a version of this one.
+    def sync_token(self, chat_id):
+        return "%s-%d" % self.fetchone('SELECT "database", "version" FROM sync_clock WHERE "id" = 0')
+
+    def sync_version(self, chat_id, token):
+        # The version a token of this database stands for, None when the token is not one
+        database, version = self.fetchone('SELECT "database", "version" FROM sync_clock WHERE "id" = 0')
+        prefix, _, since = (token or "").strip().partition("-")
+        if prefix != database or not since.isdigit() or int(since) > version:
+            return None
+        return int(since)
+
+    def iter_word_changes(self, chat_id, since, until, batch_size=500):
+        # Changes after version since up to version until, in the order they were made; rows as
+        # in SYNC_WORDS. since=None lists every word and no tombstones. Both parts are range
+        # scans of their (chat_id, version) index, so the cost follows the number of changes.
+        if since is None:
+            sql, params = SYNC_WORDS + ' ORDER BY words."version"', (chat_id, -1, until)
         else:
-            return self.fetchall(
-                'SELECT "foreign_word", "native_word", "group", "lang" FROM words WHERE "chat_id" = (?)',
-                params)
+            sql, params = f'{SYNC_WORDS} UNION ALL {SYNC_TOMBSTONES} ORDER BY 9', (chat_id, since, until) * 2
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cur.close()
 
     def delete_word(self, chat_id: int, native: str, lang: str):
-        self.cur.execute('DELETE FROM words WHERE chat_id = (?) AND native_word = (?) AND lang = (?)',
-                         (chat_id, native, lang))
-        self.conn.commit()
+        with self.write_lock:
+            self.cur.execute(f'DELETE FROM words WHERE chat_id = (?) AND native_word = (?) AND lang_id = {LANG_ID}',
+                             (chat_id, native, lang))
+            self.conn.commit()
+        self.invalidate(chat_id)
 
+    @cached
     def get_word_for_editing(self, chat_id: int, native_word: str, lang: str):
-        self.cur.execute('SELECT "foreign_word", "native_word", "group", "lang" FROM words WHERE "chat_id" = (?) AND "native_word" = (?) AND "lang" = (?)',
-                         (chat_id, native_word, lang))
-        return self.cur.fetchall()
+        return self.fetchall(*word_query(WORD_COLUMNS, chat_id, langs=[lang],
+                                         where='words."native_word" = ?', params=[native_word], order=None))
 
+    # A rename onto a word that already exists merges the two: UPDATE OR IGNORE skips the
+    # rows that would collide and the DELETE that follows drops them, keeping the existing word.
     def change_native_word(self, chat_id: int, old_native_word: str, new_native_word: str, lang="all"):
-        if lang == "all":
-            self.cur.execute(
-                'UPDATE words SET native_word = (?) WHERE chat_id = (?) AND native_word = (?) AND lang = (?)',
-                (chat_id, new_native_word, old_native_word))
-        else:
-            self.cur.execute(
-                'UPDATE words SET native_word = (?) WHERE chat_id = (?) AND native_word = (?) AND lang = (?)',
-                (chat_id, new_native_word, old_native_word, lang))
-        self.conn.commit()
+        if new_native_word == old_native_word:
+            return
+        lang_filter = '' if lang == "all" else f' AND lang_id = {LANG_ID}'
+        params = (chat_id, old_native_word) if lang == "all" else (chat_id, old_native_word, lang)
+        with self.write_lock:
+            self.cur.execute(f'UPDATE OR IGNORE words SET native_word = (?) '
+                             f'WHERE chat_id = (?) AND native_word = (?){lang_filter}',
+                             (new_native_word,) + params)
+            self.cur.execute(f'DELETE FROM words WHERE chat_id = (?) AND native_word = (?){lang_filter}', params)
+            self.conn.commit()
+        self.invalidate(chat_id)
 
     def change_foreign_word(self, chat_id: int, native_word: str, foreign_word: str, lang: str):
-        self.cur.execute('UPDATE words SET foreign_word = (?) WHERE chat_id = (?) AND native_word = (?) AND lang = (?)',
-                         (foreign_word, chat_id, native_word, lang))
-        self.conn.commit()
+        with self.write_lock:
+            self.cur.execute(f'UPDATE OR IGNORE words SET foreign_word = (?) WHERE chat_id = (?) AND native_word = (?) AND lang_id = {LANG_ID}',
+                             (foreign_word, chat_id, native_word, lang))
+            self.cur.execute(f'DELETE FROM words WHERE chat_id = (?) AND native_word = (?) AND lang_id = {LANG_ID} '
+                             f'AND foreign_word IS NOT (?)',
+                             (chat_id, native_word, lang, foreign_word))
+            self.conn.commit()
+        self.invalidate(chat_id)
 
     def change_group(self, chat_id: int, native_word: str, group: str, lang: str):
-        print(group)
-        self.cur.execute('UPDATE words SET "group" = (?) WHERE "chat_id" = (?) AND "native_word" = (?) AND "lang" = (?)',
-                         (group, chat_id, native_word, lang))
-        self.conn.commit()
+        with self.write_lock:
+            self._add_labels([(chat_id, group, lang)])
+            self.cur.execute(f'UPDATE words SET "group_id" = {GROUP_ID} WHERE "chat_id" = (?) AND "native_word" = (?) AND "lang_id" = {LANG_ID}',
+                             (chat_id, group, chat_id, native_word, lang))
+            self.conn.commit()
+        self.invalidate(chat_id)
 
     def change_lang_code(self, chat_id: int, native_word: str, new_lang: str, old_lang: str):
-        self.cur.execute('UPDATE words SET lang = (?) WHERE chat_id = (?) AND native_word = (?) AND lang = (?)',
-                         (new_lang, chat_id, native_word, old_lang))
-        self.conn.commit()
+        if new_lang == old_lang:
+            return
+        with self.write_lock:
+            self.cur.execute('INSERT OR IGNORE INTO languages ("code") VALUES (?)', (new_lang,))
+            self.cur.execute(f'UPDATE OR IGNORE words SET lang_id = {LANG_ID} WHERE chat_id = (?) AND native_word = (?) AND lang_id = {LANG_ID}',
+                             (new_lang, chat_id, native_word, old_lang))
+            self.cur.execute(f'DELETE FROM words WHERE chat_id = (?) AND native_word = (?) AND lang_id = {LANG_ID}',
+                             (chat_id, native_word, old_lang))
+            self.conn.commit()
+        self.invalidate(chat_id)
 
+    @cached
     def get_words_by_group(self, chat_id, group):
         # Fetch words for the specified group and chat_id
-        return self.fetchall('SELECT "foreign_word", "native_word", "group", "lang" '
-                             'FROM words WHERE chat_id = ? AND "group" = ?',
-                             (chat_id, group))
+        return self.fetchall(*word_query(WORD_COLUMNS, chat_id, [group], order=None))
 
+    @cached
     def get_flash_words(self, user_id, groups=None, languages=None):
-        query = 'SELECT "foreign_word", "native_word", "group", "lang" FROM "words" WHERE "chat_id" = ?'
-        params = [user_id]
+        query, params = word_query(WORD_COLUMNS, user_id, groups, languages, order=None)
+        self.cur.execute(query, params)
+        return self.cur.fetchall()
 
-        # Apply filters
-        if groups and len(groups) > 0:
-            placeholders = ", ".join(["?"] * len(groups))
-            query += f' AND "group" IN ({placeholders})'
-            params.extend(groups)
+    @cached
+    def get_flash_word_ids(self, chat_id, groups=None, languages=None):
+        # Only the rowids, packed into an array: 8 bytes per word instead of a tuple of strings
+        cur = self.conn.cursor()
+        try:
+            rows = cur.execute(*word_query('words."id"', chat_id, groups, languages, source='FROM words'))
+            return array("q", (row[0] for row in rows))
+        finally:
+            cur.close()
 
-        if languages and len(languages) > 0:
-            placeholders = ", ".join(["?"] * len(languages))
-            query += f' AND "lang" IN ({placeholders})'
-            params.extend(languages)
-        print(params)
+    def get_words_by_ids(self, chat_id, word_ids):
+        word_ids = padded(word_ids)
+        return self.fetchall(*word_query(f'words."id", {WORD_COLUMNS}', chat_id,
+                                         where=f'words."id" IN ({", ".join(["?"] * len(word_ids))})',
+                                         params=word_ids, order=None))
 
-        self.cur.execute(query, params)
-        return self.cur.fetchall()
+    @cached
+    def search_words(self, chat_id, text, limit=SEARCH_LIMIT):
+        # Words containing every term of text in their foreign or native side, best match first.
+        # When that finds less than a page, words spelled similarly are added after the matches.
+        # Returns up to limit rows of (rowid, foreign, native, group, lang).
+        words = search.terms(text)
+        if not words:
+            return []
+        if self.fetchone('SELECT count(*) FROM (SELECT 1 FROM words WHERE "chat_id" = ? LIMIT ?)',
+                         (chat_id, SCAN_WORDS + 1))[0] <= SCAN_WORDS:
+            return search.rank_rows(words, self.fetchall(*word_query(f'words."id", {WORD_COLUMNS}', chat_id)), limit)
+        indexed = [word for word in words if len(word) >= search.MIN_PREFIX]
+        letters = [word for word in words if len(word) < search.MIN_PREFIX]
+        if not indexed:
+            return self._prefix_words(chat_id, letters, limit)
+        rows = self._match_words(chat_id, search.match_expression(indexed),
+                                 FUZZY_CANDIDATES if letters else limit)
+        rows = [row for row in rows if search.has_prefixes(letters, row)]
+        long_words = [word for word in words if len(word) >= search.MIN_TERM]
+        if len(rows) < search.FUZZY_MIN_RESULTS and long_words:
+            prefixes = [word for word in words if len(word) < search.MIN_TERM]
+            found = {row[0] for row in rows}
+            candidates = [(search.similarity(long_words, row), row)
+                          for row in self._match_words(chat_id, search.fuzzy_expression(long_words),
+                                                       FUZZY_CANDIDATES)
+                          if row[0] not in found and search.has_prefixes(prefixes, row)]
+            rows += [row for ratio, row in sorted(candidates, key=lambda item: -item[0])
+                     if ratio >= search.FUZZY_MIN_RATIO]
+        return rows[:limit]
+
+    def _prefix_words(self, chat_id, prefixes, limit):
+        # Scans the chat's words in the (chat_id, rowid) index and stops after limit matches
+        params = []
+        for prefix in prefixes:
+            pattern = "% " + prefix.replace("!", "!!").replace("%", "!%").replace("_", "!_") + "%"
+            params.extend([pattern, pattern])
+        where = ' AND '.join(['(\' \' || words."foreign_word" LIKE ? ESCAPE \'!\' '
+                              'OR \' \' || words."native_word" LIKE ? ESCAPE \'!\')'] * len(prefixes))
+        return self.fetchall(*word_query(f'words."id", {WORD_COLUMNS}', chat_id, where=where, params=params,
+                                         limit=limit))
+
+    def _match_words(self, chat_id, expression, limit):
+        # CROSS JOIN keeps the index lookup as the outer loop, so only the matches are ranked
+        return self.fetchall(f'SELECT words."id", {WORD_COLUMNS} FROM words_fts '
+                             f'CROSS JOIN words ON words."id" = words_fts.rowid '
+                             f'JOIN groups ON groups."id" = words."group_id" '
+                             f'JOIN languages ON languages."id" = words."lang_id" '
+                             f'WHERE words_fts MATCH ? AND words."chat_id" = ? ORDER BY words_fts.rank LIMIT ?',
+                             (expression, chat_id, limit))
+
+    def get_due_words(self, chat_id, now, groups=None, langs=None, limit=20):
+        # Walks the (chat_id, due) index in due order and stops after limit cards
+        # Returns rows of (rowid, foreign, native, group, lang, ease, interval_days, repetitions)
+        return self.fetchall(*word_query(f'words."id", {WORD_COLUMNS}, words."ease", words."interval_days", '
+                                         f'words."repetitions"', chat_id, groups, langs,
+                                         'words."due" <= ?', [now], 'words."due"', limit))
+
+    def grade_word(self, chat_id, word_id, ease, interval_days, repetitions, due):
+        self.query('UPDATE words SET "ease" = ?, "interval_days" = ?, "repetitions" = ?, "due" = ? '
+                   'WHERE "id" = ? AND "chat_id" = ?',
+                   (ease, interval_days, repetitions, due, word_id, chat_id))
+
+    def add_reminder(self, chat_id, group, interval, time_input, next_fire):
+        with self.write_lock:
+            self.cur.execute('INSERT INTO reminders ("chat_id", "group", "interval", "time_input", "next_fire") '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (chat_id, group, interval, time_input, next_fire))
+            self.conn.commit()
+        return self.cur.lastrowid
+
+    def get_reminders(self, chat_id):
+        return self.fetchall('SELECT "id", "chat_id", "group", "interval", "time_input", "active", "next_fire" '
+                             'FROM reminders WHERE "chat_id" = ? ORDER BY "id"',
+                             (chat_id,))
+
+    def get_due_reminders(self, until, after=None):
+        # Both queries are range scans over the partial next_fire index, so startup and refills
+        # only touch the reminders that fire soon.
+        if after is None:
+            return self.fetchall('SELECT "id", "chat_id", "group", "interval", "time_input", "active", "next_fire" '
+                                 'FROM reminders WHERE "active" = 1 AND "next_fire" <= ?',
+                                 (until,))
+        return self.fetchall('SELECT "id", "chat_id", "group", "interval", "time_input", "active", "next_fire" '
+                             'FROM reminders WHERE "active" = 1 AND "next_fire" > ? AND "next_fire" <= ?',
+                             (after, until))
+
+    def set_reminder_active(self, reminder_id, active, next_fire):
+        self.query('UPDATE reminders SET "active" = ?, "next_fire" = ? WHERE "id" = ?',
+                   (int(active), next_fire, reminder_id))
+
+    def claim_reminders(self, claims):
+        # claims: iterable of (next_fire, reminder_id, fired_at). Moves every reminder that is
+        # still active and due at fired_at on to next_fire. When several processes run a
+        # scheduler on one database, only one of them claims each fire; a reminder another
+        # process fired, stopped or deleted is not claimed. Returns the claimed ids and the
+        # current rows of the others (None once deleted), read in the same transaction.
+        claimed, others = [], {}
+        with self.write_lock:
+            try:
+                for next_fire, reminder_id, fired_at in claims:
+                    self.cur.execute('UPDATE reminders SET "next_fire" = ? '
+                                     'WHERE "id" = ? AND "active" = 1 AND "next_fire" = ?',
+                                     (next_fire, reminder_id, fired_at))
+                    if self.cur.rowcount == 1:
+                        claimed.append(reminder_id)
+                    else:
+                        others[reminder_id] = self.cur.execute(
+                            'SELECT "id", "chat_id", "group", "interval", "time_input", "active", "next_fire" '
+                            'FROM reminders WHERE "id" = ?', (reminder_id,)).fetchone()
+                self.conn.commit()
+            except BaseException:
+                # Claims that are not committed must not be committed by a later write
+                self.conn.rollback()
+                raise
+        return claimed, others
+
+    def delete_reminder(self, reminder_id):
+        self.query('DELETE FROM reminders WHERE "id" = ?', (reminder_id,))
 
     def __del__(self):
-        self.conn.close()
+        self.close()
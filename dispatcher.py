@@ -0,0 +1,119 @@
+import logging
+import queue
+import threading
+import time
+
+import metrics
+from async_runtime import update_chat_id
+
+logger = logging.getLogger(__name__)
+
+
+class Lane:
+    """One worker's queue together with its depth and wait-time counters."""
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handled = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def metrics(self):
+        return {"depth": self.queue.qsize(),
+                "max_depth": self.max_depth,
+                "handled": self.handled,
+                "wait_avg": self.wait_total / self.handled if self.handled else 0.0,
+                "wait_max": self.wait_max}
+
+
+class ChatDispatcher:
+    """Runs TeleBot handlers on a fixed pool of worker threads.
+
+    Every worker has its own bounded queue (a lane) and every chat is pinned to one lane, so
+    the updates of a chat are handled one after another (as the next-step handler chains and
+    the read-modify-write of the conversation state need), while different chats are handled
+    in parallel. When a lane is full, submit raises queue.Full and the caller is expected to
+    push back on the sender.
+    """
+
+    def __init__(self, bot, workers=8, queue_size=100):
+        self.bot = bot
+        self.handle = bot.process_new_updates
+        self.lanes = [Lane(queue_size) for _ in range(workers)]
+        self.threads = []
+        # Handlers are run by our workers, not by TeleBot's own worker pool
+        self.bot.threaded = False
+
+    def start(self):
+        for number, lane in enumerate(self.lanes):
+            thread = threading.Thread(target=self._run, args=(lane,), name=f"dispatcher-{number}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        metrics.REGISTRY.gauge("bot_dispatcher_queue_depth", "Updates waiting in a dispatcher lane.",
+                               lambda: {str(n): lane.queue.qsize() for n, lane in enumerate(self.lanes)}, "lane")
+        metrics.REGISTRY.counter("bot_dispatcher_handled_total", "Updates handled by a dispatcher lane.",
+                                 lambda: {str(n): lane.handled for n, lane in enumerate(self.lanes)}, "lane")
+        metrics.REGISTRY.gauge("bot_dispatcher_wait_max_seconds", "Longest time an update has waited in a lane.",
+                               lambda: max(lane.wait_max for lane in self.lanes))
+        return self
+
+    def attach(self):
+        """Routes the updates TeleBot's own polling loop fetches through the lanes.
+
+        The polling loop blocks while a lane is full, so Telegram keeps the updates instead.
+        """
+        self.bot.process_new_updates = self._submit_polled
+        return self
+
+    def _submit_polled(self, updates):
+        # TeleBot moves its getUpdates offset in process_new_updates, which now runs later on a
+        # lane; moving it here keeps the next poll from fetching (and handling) these again
+        for update in updates:
+            self.submit(update, block=True)
+            self.bot.last_update_id = max(self.bot.last_update_id, update.update_id)
+
+    def submit(self, update, block=False):
+        """Queues an update; raises queue.Full when its chat's lane is full and block is False."""
+        lane = self.lanes[self.lane(update_chat_id(update))]
+        lane.queue.put((time.monotonic(), update), block=block)
+        lane.max_depth = max(lane.max_depth, lane.queue.qsize())
+
+    def submit_all(self, updates, block=False):
+        for update in updates:
+            self.submit(update, block)
+
+    def lane(self, chat_id):
+        # Chat ids are ints, so the lane of a chat is the same in every process
+        return (chat_id or 0) % len(self.lanes)
+
+    def metrics(self):
+        lanes = [lane.metrics() for lane in self.lanes]
+        return {"depth": sum(lane["depth"] for lane in lanes),
+                "handled": sum(lane["handled"] for lane in lanes),
+                "wait_max": max(lane["wait_max"] for lane in lanes),
+                "lanes": lanes}
+
+    def stop(self):
+        """Handles every queued update, stops the workers and detaches from polling."""
+        vars(self.bot).pop("process_new_updates", None)
+        for lane in self.lanes:
+            lane.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _run(self, lane):
+        while True:
+            item = lane.queue.get()
+            if item is None:
+                return
+            queued_at, update = item
+            wait = time.monotonic() - queued_at
+            lane.wait_total += wait
+            lane.wait_max = max(lane.wait_max, wait)
+            try:
+                self.handle([update])
+            except Exception:
+                logger.exception("Handler failed for update %s", update.update_id)
+            lane.handled += 1
@@ -0,0 +1,58 @@
+import random
+
+WINDOW_SIZE = 10
+
+
+class FlashSession:
+    """A flashcard deck that is read from the database a small window at a time.
+
+    In order mode the deck is the chat's words in rowid order and ``cursor`` is the last
+    fetched rowid. In random mode the session keeps only the word ids, packed in an array and
+    shuffled deterministically from ``seed``, and ``cursor`` is the next position in it.
+    """
+
+    __slots__ = ("groups", "langs", "seed", "ids", "cursor", "window")
+
+    def __init__(self, db, chat_id, groups, langs, randomize):
+        self.groups = groups
+        self.langs = langs
+        self.seed = random.getrandbits(32) if randomize else None
+        self.ids = None
+        if randomize:
+            self.ids = db.get_flash_word_ids(chat_id, groups, langs)
+            random.Random(self.seed).shuffle(self.ids)
+        self.cursor = 0
+        self.window = []
+
+    @property
+    def random(self):
+        return self.seed is not None
+
+    def current(self, db, chat_id):
+        """Returns the current card as (rowid, foreign, native, group, lang), or None at the end."""
+        if not self.window:
+            self._fill(db, chat_id)
+        return self.window[0] if self.window else None
+
+    def advance(self):
+        if self.window:
+            self.window.pop(0)
+
+    def restart(self):
+        # Random mode replays the same shuffled order, like retrying the same deck
+        self.cursor = 0
+        self.window = []
+
+    def _fill(self, db, chat_id):
+        if self.ids is None:
+            self.window = db.get_show_words_page(chat_id, self.groups, self.langs,
+                                                 after=self.cursor, limit=WINDOW_SIZE)
+            if self.window:
+                self.cursor = self.window[-1][0]
+            return
+        # Words deleted since the session started are skipped
+        while not self.window and self.cursor < len(self.ids):
+            ids = self.ids[self.cursor:self.cursor + WINDOW_SIZE]
+            self.cursor += len(ids)
+            rows = {row[0]: row for row in db.get_words_by_ids(chat_id, ids)}
+            self.window = [rows[word_id] for word_id in ids if word_id in rows]
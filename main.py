@@ -1,223 +1,459 @@
+"""The bot's handlers and create_app, which builds the bot and everything the handlers use.
+
+Importing this module only defines the handlers. create_app(config) creates the bot, the
+database, the outbox, the reminder scheduler and the state store backends from the given
+config and registers the handlers; cli.py runs the result.
+"""
+import functools
+import io
+import time
+
 import telebot
+from telebot import apihelper
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
-import config
-import threading
-import random
-import csv
-import json
-import time
+import metrics
+import srs
+import state
 from database import DataBase
+from flashcards import FlashSession
+from outbox import Outbox, pooled_session
+from reminders import ReminderScheduler
+from shards import ShardedDataBase
+from state import RedisBackend, StateExpired, StateStore, StepHandlerBackend, memory_backend
+
+# Set by create_app. The handlers are module-level functions so that the next-step handler
+# chains can be pickled by name into a shared backend, so there is one app per process.
+bot = db = outbox = reminders = None
+
+# Stores for temporary data during conversations; entries expire after their TTL (seconds)
+step_cache = StateStore("steps", ttl=1800)          # For next-step handler chains
+load_cache = StateStore("load", ttl=1800)           # For /add word flow
+show_cache = StateStore("show", ttl=3 * 3600)       # For showing list of words
+edit_cache = StateStore("edit", ttl=1800)           # For editing a selected word
+flash_cache = StateStore("flash", ttl=3 * 3600)     # For flashcards session
+reminder_cache = StateStore("reminder", ttl=1800)   # For reminder settings
+import_cache = StateStore("import", ttl=1800)       # For /import options
+review_cache = StateStore("review", ttl=3 * 3600)   # For spaced-repetition review sessions
+find_cache = StateStore("find", ttl=3 * 3600)       # For /find search results
+
+HANDLERS = []  # (TeleBot registration method, handler, filters) for create_app
+
 
-TOKEN = config.TOKEN
-bot = telebot.TeleBot(TOKEN)
-db = DataBase()
+def message_handler(**filters):
+    def decorator(func):
+        HANDLERS.append(("register_message_handler", func, filters))
+        return func
+    return decorator
 
-# Caches for storing temporary data during conversations
-load_cache = {}      # For /add word flow
-show_cache = {}      # For showing list of words
-edit_cache = {}      # For editing a selected word
-flash_cache = {}     # For flashcards session
-reminder_cache = {}  # For reminder settings
-user_sessions = {}
 
-# Dictionary to keep track of reminder timers per chat
-reminder_timers = {}
+def callback_query_handler(**filters):
+    def decorator(func):
+        HANDLERS.append(("register_callback_query_handler", func, filters))
+        return func
+    return decorator
+
+
+def send_reminder(chat_id, reminder):
+    outbox.send_message(chat_id, f"Reminder: Review your words in group '{reminder['group']}'!")
 
 
 # -------------------------------
 # Menu and /start command
 # -------------------------------
-@bot.message_handler(commands=["start", "menu"])
+@message_handler(commands=["start", "menu"])
 def send_instruction(message):
     markup = InlineKeyboardMarkup(row_width=2)
     markup.add(
         InlineKeyboardButton("Add Word", callback_data="menu_add"),
         InlineKeyboardButton("Edit Word", callback_data="menu_edit"),
         InlineKeyboardButton("Show Words", callback_data="menu_show"),
+        InlineKeyboardButton("Find Words", callback_data="menu_find"),
         InlineKeyboardButton("Flashcards", callback_data="menu_flash"),
+        InlineKeyboardButton("Review Due Words", callback_data="menu_review"),
         InlineKeyboardButton("Set Reminder", callback_data="menu_reminder"),
         InlineKeyboardButton("Export Words", callback_data="menu_export"),
+        InlineKeyboardButton("Import Words", callback_data="menu_import"),
+        InlineKeyboardButton("Sync Changes", callback_data="menu_sync"),
         InlineKeyboardButton("Survey", callback_data="menu_survey")
     )
-    bot.send_message(message.chat.id, "Welcome to the ForWordsBot! Choose an option:", reply_markup=markup)
+    outbox.send_message(message.chat.id, "Welcome to the ForWordsBot! Choose an option:", reply_markup=markup)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("menu_"))
+@callback_query_handler(func=lambda call: call.data.startswith("menu_"))
 def menu_handler(call):
     if call.data == "menu_add":
         start_input(call.message)
     elif call.data == "menu_edit":
-        bot.send_message(call.message.chat.id, "Use /edit to edit words.")
+        outbox.send_message(call.message.chat.id, "Use /edit to edit words.")
     elif call.data == "menu_show":
         show_words(call.message)
+    elif call.data == "menu_find":
+        find_words(call.message)
     elif call.data == "menu_flash":
         start_flashcards(call.message)
+    elif call.data == "menu_review":
+        start_review(call.message)
     elif call.data == "menu_sort":
-        bot.send_message(call.message.chat.id, "Sort words by which language? Type 'en' for foreign or 'ru' for native:")
+        outbox.send_message(call.message.chat.id, "Sort words by which language? Type 'en' for foreign or 'ru' for native:")
         bot.register_next_step_handler(call.message, sort_words)
     elif call.data == "menu_reminder":
-        bot.send_message(call.message.chat.id, "Enter the group for which to set a reminder (or type 'all'):")
+        outbox.send_message(call.message.chat.id, "Enter the group for which to set a reminder (or type 'all'):")
         bot.register_next_step_handler(call.message, process_reminder_group)
     elif call.data == "menu_export":
-        bot.send_message(call.message.chat.id, "Choose export format: txt, csv, or json:")
+        outbox.send_message(call.message.chat.id, "Choose export format: txt, csv, or json:")
         bot.register_next_step_handler(call.message, upload_words_format)
+    elif call.data == "menu_import":
+        start_import(call.message)
+    elif call.data == "menu_sync":
+        send_changes(call.message.chat.id, None)
     elif call.data == "menu_survey":
-        bot.send_message(call.message.chat.id, "You can take a survey about this telegram bot:\n"
-                                               "https://forms.gle/WTaK4Qed9GRKr8BcA")
-
-
-def cancel_fsm(func):
-    def wrapper(message):
-        if message.text == "cancel":
-            bot.send_message(message.chat.id, "Action has been canceled!")
-            return
-        else:
-            func(message)
-    return wrapper
+        outbox.send_message(call.message.chat.id, "You can take a survey about this telegram bot:\n"
+                                                  "https://forms.gle/WTaK4Qed9GRKr8BcA")
+
+
+def cancel_fsm(store):
+    """Wraps a next-step handler of the flow that keeps its state in store."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(message):
+            if message.text == "cancel":
+                store.pop(message.chat.id, None)
+                outbox.send_message(message.chat.id, "Action has been canceled!")
+                return
+            try:
+                func(message)
+            except StateExpired:
+                outbox.send_message(message.chat.id, "This conversation has expired. Please start again.")
+        return wrapper
+    return decorator
 
 
 # -------------------------------
 # Adding new words (/add)
 # -------------------------------
-@bot.message_handler(commands=['add'])
+@message_handler(commands=['add'])
 def start_input(message):
-    msg = bot.reply_to(message, "Let's add a new word or phrase!\n"
-                                "Send to me the word or phrase in the foreign language.\n"
-                                "If you want to input multiple translations,\n"
-                                "just write words separating them using ', '(comma and space)")
-    bot.register_next_step_handler(msg, process_foreign_word)
+    outbox.reply_to(message, "Let's add a new word or phrase!\n"
+                             "Send to me the word or phrase in the foreign language.\n"
+                             "If you want to input multiple translations,\n"
+                             "just write words separating them using ', '(comma and space)")
+    bot.register_next_step_handler(message, process_foreign_word)
 
 
-@cancel_fsm
+@cancel_fsm(load_cache)
 def process_foreign_word(message):
     load_cache[message.chat.id] = [message.text.lower()]
-    msg = bot.reply_to(message, "Send to me a code of foreign language (e.g en, ru, aa)")
-    bot.register_next_step_handler(msg, process_language_name)
+    outbox.reply_to(message, "Send to me a code of foreign language (e.g en, ru, aa)")
+    bot.register_next_step_handler(message, process_language_name)
 
 
-@cancel_fsm
+@cancel_fsm(load_cache)
 def process_language_name(message):
-    load_cache[message.chat.id].append(message.text)
-    msg = bot.reply_to(message, "Send to me the translation in your native language")
-    bot.register_next_step_handler(msg, process_native_word)
+    load_cache[message.chat.id] = load_cache[message.chat.id] + [message.text]
+    outbox.reply_to(message, "Send to me the translation in your native language")
+    bot.register_next_step_handler(message, process_native_word)
 
 
-@cancel_fsm
+@cancel_fsm(load_cache)
 def process_native_word(message):
-    load_cache[message.chat.id].append(message.text)
-    msg = bot.reply_to(message, "Send to me the group name for this word, or leave empty for default group")
-    bot.register_next_step_handler(msg, process_group)
+    load_cache[message.chat.id] = load_cache[message.chat.id] + [message.text]
+    outbox.reply_to(message, "Send to me the group name for this word, or leave empty for default group")
+    bot.register_next_step_handler(message, process_group)
 
 
-@cancel_fsm
+@cancel_fsm(load_cache)
 def process_group(message):
     group = message.text.strip() if message.text.strip() != "" else "default"
-    load_cache[message.chat.id].append(group)
-    # Assume db.input_words now accepts three arguments: foreign, native, and group
-    db.input_words(message.chat.id,
-                   load_cache[message.chat.id][0],
-                   load_cache[message.chat.id][2],
-                   group,
-                   load_cache[message.chat.id][1])
+    foreign_word, lang, native_word = load_cache[message.chat.id]
+    added = db.input_words(message.chat.id, foreign_word, native_word, group, lang)
     load_cache.pop(message.chat.id)
-    bot.send_message(message.chat.id, "The word has been added successfully!")
+    if added:
+        outbox.send_message(message.chat.id, "The word has been added successfully!")
+    else:
+        outbox.send_message(message.chat.id, f"You already have this word, it is now in the group '{group}'")
 
 
 # -------------------------------
 # Exporting words (/upload)
 # -------------------------------
-@bot.message_handler(commands=['upload'])
+@message_handler(commands=['upload'])
 def upload_words(message):
-    msg = bot.reply_to(message, "Choose export format: txt, csv, or json")
-    bot.register_next_step_handler(msg, upload_words_format)
+    outbox.reply_to(message, "Choose export format: txt, csv, or json")
+    bot.register_next_step_handler(message, upload_words_format)
 
 
 def upload_words_format(message):
-    data = db.get_show_words(message.chat.id)  # Expecting list of tuples: (foreign, native, group)
+    from word_io import EXPORT_FORMATS, export_words
+
     fmt = message.text.lower()
-    if fmt == 'txt':
-        filename = f'words.txt'
-        with open(filename, 'w', encoding='utf-8') as file:
-            for line in data:
-                file.write(f"{line[0]} --- {line[1]}\n")
-        bot.send_document(message.chat.id, open(filename, 'rb'))
-    elif fmt == 'csv':
-        filename = f'words.csv'
-        with open(filename, 'w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(["Foreign", "Native"])
-            for line in data:
-                writer.writerow([line[0], line[1]])
-        bot.send_document(message.chat.id, open(filename, 'rb'))
-    elif fmt == 'json':
-        filename = f'words.json'
-        words_list = [{"foreign": line[0], "native": line[1]} for line in data]
-        with open(filename, 'w', encoding='utf-8') as file:
-            json.dump(words_list, file, ensure_ascii=False, indent=2)
-        bot.send_document(message.chat.id, open(filename, 'rb'))
-    else:
-        bot.send_message(message.chat.id, "Unsupported format. Please choose txt, csv, or json.")
+    if fmt not in EXPORT_FORMATS:
+        outbox.send_message(message.chat.id, "Unsupported format. Please choose txt, csv, or json.")
+        return
+    file = export_words(db.iter_show_words(message.chat.id), fmt)
+    # The outbox sends the file later, so it is closed once it has been sent. The upload
+    # itself reads the whole file into memory (see word_io).
+    sent = outbox.send_document(message.chat.id, file, visible_file_name=f"words.{fmt}")
+    sent.add_done_callback(lambda _: file.close())
+
+
+# -------------------------------
+# Syncing changes (/sync)
+# -------------------------------
+@message_handler(commands=['sync'])
+def sync_words(message):
+    send_changes(message.chat.id, message.text.partition(" ")[2].strip() or None)
+
+
+def send_changes(chat_id, token):
+    from word_io import export_changes
+
+    # Only the changes up to the new token are listed; one made while the file is written
+    # goes into the next sync
+    new_token = db.sync_token(chat_id)
+    since = db.sync_version(chat_id, token) if token else None
+    changes = db.iter_word_changes(chat_id, since, db.sync_version(chat_id, new_token))
+    file = export_changes(changes, new_token, since is None)
+    sent = outbox.send_document(chat_id, file, visible_file_name="words-sync.json")
+    sent.add_done_callback(lambda _: file.close())
+    note = "All your words" if since is None else "The changes since your last sync"
+    if token and since is None:
+        note = "This sync token is not known, so here are all your words"
+    outbox.send_message(chat_id, f"{note}. Next time send\n/sync {new_token}\nto get only what changed after this.")
+
+
+# -------------------------------
+# Importing words (/import)
+# -------------------------------
+@message_handler(commands=['import'])
+def start_import(message):
+    outbox.reply_to(message, "Let's import words from a file!\n"
+                             "Send to me a code of foreign language and a group name for the imported words\n"
+                             "separated by space (e.g. 'en default')")
+    bot.register_next_step_handler(message, process_import_options)
+
+
+@cancel_fsm(import_cache)
+def process_import_options(message):
+    try:
+        lang, group = message.text.strip().split(" ", 1)
+    except (AttributeError, ValueError):
+        outbox.reply_to(message, "You need to write lang code and group name\nFor example: (en default)")
+        bot.register_next_step_handler(message, process_import_options)
+        return
+    import_cache[message.chat.id] = {"lang": lang, "group": group.strip() or "default"}
+    outbox.reply_to(message, "Now send to me the file: .txt, .csv or .json in the same format as the export")
+    bot.register_next_step_handler(message, process_import_file)
+
+
+@cancel_fsm(import_cache)
+def process_import_file(message):
+    from word_io import EXPORT_FORMATS, import_words
+
+    chat_id = message.chat.id
+    document = message.document
+    fmt = document.file_name.rsplit(".", 1)[-1].lower() if document and document.file_name else None
+    if fmt not in EXPORT_FORMATS:
+        outbox.reply_to(message, "Please send a .txt, .csv or .json file:")
+        bot.register_next_step_handler(message, process_import_file)
+        return
+    options = import_cache[chat_id]
+    import_cache.pop(chat_id)
+    file = io.BytesIO(bot.download_file(bot.get_file(document.file_id).file_path))
+    stopped = []
+
+    def words():
+        # A malformed line ends the import; the words read before it are still added
+        try:
+            for foreign, native in import_words(file, fmt):
+                yield chat_id, foreign, native, options["group"], options["lang"]
+        except ValueError as e:
+            stopped.append(e)
+
+    count = db.input_words_many(words())
+    if stopped:
+        outbox.send_message(chat_id, f"Import stopped: {stopped[0]}\n"
+                                     f"{count} new words before this point have been added.")
+        return
+    outbox.send_message(chat_id, f"{count} new words have been imported successfully!")
 
 
 # -------------------------------
 # Showing words (/show)
 # -------------------------------
-@bot.message_handler(commands=['show'])
+@message_handler(commands=['show'])
 def show_words(message):
-    msg = bot.reply_to(message,
-                       "What group do you want to see?\n"
-                       "If you want to see multiple groups\njust write them separating by ', '(comma and space)\n"
-                       "If you want to see all groups write 'all'")
-    bot.register_next_step_handler(msg, process_group_show)
+    outbox.reply_to(message,
+                    "What group do you want to see?\n"
+                    "If you want to see multiple groups\njust write them separating by ', '(comma and space)\n"
+                    "If you want to see all groups write 'all'")
+    bot.register_next_step_handler(message, process_group_show)
 
 
-@cancel_fsm
+@cancel_fsm(show_cache)
 def process_group_show(message):
     groups = message.text.split(", ")
     if groups == ["all"]:
         show_cache[message.chat.id] = {"groups": []}
     else:
         show_cache[message.chat.id] = {"groups": groups}
-    msg = bot.reply_to(message,
-                       "What languages do you want to see?\n"
-                       "If you want to see multiple langs\njust write them separating by ', '(comma and space)\n"
-                       "If you want to see all lang write 'all'")
-    bot.register_next_step_handler(msg, final_show)
+    outbox.reply_to(message,
+                    "What languages do you want to see?\n"
+                    "If you want to see multiple langs\njust write them separating by ', '(comma and space)\n"
+                    "If you want to see all lang write 'all'")
+    bot.register_next_step_handler(message, final_show)
 
 
-@cancel_fsm
+@cancel_fsm(show_cache)
 def final_show(message):
     langs = message.text.split(", ")
-    if langs == ["all"]:
-        show_cache[message.chat.id]["langs"] = []
+    filters = show_cache[message.chat.id]
+    filters["langs"] = [] if langs == ["all"] else langs
+    show_cache[message.chat.id] = filters
+    send_show_page(message.chat.id)
+
+
+SHOW_PAGE_SIZE = 20
+MESSAGE_LIMIT = 4096
+
+
+def send_show_page(chat_id, message_id=None, after=None, before=None):
+    """Sends (or edits into message_id) one page of words after/before the given rowid."""
+    filters = show_cache.get(chat_id)
+    if filters is None or "langs" not in filters:
+        outbox.send_message(chat_id, "This list is outdated. Use /show to see your words.")
+        return
+    rows = db.get_show_words_page(chat_id, filters["groups"], filters["langs"],
+                                  after=after, before=before, limit=SHOW_PAGE_SIZE + 1)
+    # One extra row tells whether there is a page further in the direction we are moving
+    if before is None:
+        has_prev, has_next = after is not None, len(rows) > SHOW_PAGE_SIZE
+        rows = rows[:SHOW_PAGE_SIZE]
+    else:
+        has_prev, has_next = len(rows) > SHOW_PAGE_SIZE, True
+        rows = rows[-SHOW_PAGE_SIZE:]
+    if not rows and after is None and before is None:
+        outbox.send_message(chat_id, "There are no words for these groups and languages.")
+        return
+
+    header = "Your words:\n\n"
+    lines = [f"{line[2]}  --  {line[1]} \n    Group: {line[3]}, Lang: {line[4]}\n\n"[:MESSAGE_LIMIT - len(header)]
+             for line in rows]
+    # Keep the page under Telegram's message limit; rows that don't fit go to the neighbouring page
+    size = len(header)
+    for count, line in enumerate(lines if before is None else reversed(lines)):
+        size += len(line)
+        if size > MESSAGE_LIMIT:
+            if before is None:
+                rows, lines, has_next = rows[:count], lines[:count], True
+            else:
+                rows, lines, has_prev = rows[len(rows) - count:], lines[len(lines) - count:], True
+            break
+
+    markup = InlineKeyboardMarkup(row_width=2)
+    buttons = []
+    if has_prev and rows:
+        buttons.append(InlineKeyboardButton("⬅ Prev", callback_data=f"show_prev_{rows[0][0]}"))
+    if has_next and rows:
+        buttons.append(InlineKeyboardButton("Next ➡", callback_data=f"show_next_{rows[-1][0]}"))
+    markup.add(*buttons)
+    msg_text = header + "".join(lines) if lines else "There are no more words."
+    if message_id:
+        outbox.edit_message_text(msg_text, chat_id, message_id, reply_markup=markup)
+    else:
+        outbox.send_message(chat_id, msg_text, reply_markup=markup)
+
+
+@callback_query_handler(func=lambda call: call.data.startswith("show_"))
+def show_page_callback(call):
+    direction, rowid = call.data[len("show_"):].split("_")
+    if direction == "next":
+        send_show_page(call.message.chat.id, call.message.message_id, after=int(rowid))
+    elif direction == "prev":
+        send_show_page(call.message.chat.id, call.message.message_id, before=int(rowid))
+
+
+# -------------------------------
+# Searching words (/find)
+# -------------------------------
+FIND_PAGE_SIZE = 10
+
+
+@message_handler(commands=['find'])
+def find_words(message):
+    text = message.text.partition(" ")[2].strip() if message.text.startswith("/find") else ""
+    if text:
+        start_find(message.chat.id, text)
+        return
+    outbox.reply_to(message,
+                    "What do you want to find?\n"
+                    "Send a part of a foreign or native word; small typos are fine")
+    bot.register_next_step_handler(message, process_find_query)
+
+
+@cancel_fsm(find_cache)
+def process_find_query(message):
+    start_find(message.chat.id, message.text or "")
+
+
+def start_find(chat_id, text):
+    if not text.strip():
+        outbox.send_message(chat_id, "Send some text to search for. Use /find to try again.")
+        return
+    find_cache[chat_id] = text
+    send_find_page(chat_id, 0)
+
+
+def send_find_page(chat_id, offset, message_id=None):
+    """Sends (or edits into message_id) one page of the search results, best matches first."""
+    text = find_cache.get(chat_id)
+    if text is None:
+        outbox.send_message(chat_id, "These results are outdated. Use /find to search again.")
+        return
+    rows = db.search_words(chat_id, text)
+    if not rows:
+        outbox.send_message(chat_id, f"Nothing found for '{text}'.")
+        return
+    page = rows[offset:offset + FIND_PAGE_SIZE]
+    lines = [f"{line[2]}  --  {line[1]} \n    Group: {line[3]}, Lang: {line[4]}\n\n" for line in page]
+    msg_text = (f"Found for '{text}' ({offset + 1}-{offset + len(page)} of {len(rows)}):\n\n"
+                + "".join(lines))[:MESSAGE_LIMIT]
+
+    markup = InlineKeyboardMarkup(row_width=2)
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton("⬅ Prev", callback_data=f"find_{max(0, offset - FIND_PAGE_SIZE)}"))
+    if offset + FIND_PAGE_SIZE < len(rows):
+        buttons.append(InlineKeyboardButton("Next ➡", callback_data=f"find_{offset + FIND_PAGE_SIZE}"))
+    markup.add(*buttons)
+    if message_id:
+        outbox.edit_message_text(msg_text, chat_id, message_id, reply_markup=markup)
     else:
-        show_cache[message.chat.id]["langs"] = langs
-    data = db.get_show_words(message.chat.id, show_cache[message.chat.id]["groups"], show_cache[message.chat.id]["langs"])
-    msg_text = "Your words:\n\n"
-    for line in data:
-        msg_text += f"{line[1]}  --  {line[0]} \n    Group: {line[2]}, Lang: {line[3]}\n\n"
-    bot.send_message(message.chat.id, msg_text)
+        outbox.send_message(chat_id, msg_text, reply_markup=markup)
+
+
+@callback_query_handler(func=lambda call: call.data.startswith("find_"))
+def find_page_callback(call):
+    send_find_page(call.message.chat.id, int(call.data[len("find_"):]), call.message.message_id)
 
 
 # -------------------------------
 # Editing words (/edit)
 # -------------------------------
-@bot.message_handler(commands=['edit'])
+@message_handler(commands=['edit'])
 def edit_words(message):
-    msg = bot.reply_to(message, "Write word in native language and foreign lang code (separated by space)")
-    bot.register_next_step_handler(msg, select_edit_word)
+    outbox.reply_to(message, "Write word in native language and foreign lang code (separated by space)")
+    bot.register_next_step_handler(message, select_edit_word)
 
 
-@cancel_fsm
+@cancel_fsm(edit_cache)
 def select_edit_word(message):
     try:
         native, lang = message.text.split(" ")
-        edit_cache[message.chat.id] = [native, lang]
     except (TypeError, KeyError, ValueError):
-        msg = bot.reply_to(message,
-                           'You need to write two words: word in native and lang code\nFor example: (target ru)')
-        bot.register_next_step_handler(msg, edit_words)
+        outbox.reply_to(message,
+                        'You need to write two words: word in native and lang code\nFor example: (target ru)')
+        bot.register_next_step_handler(message, edit_words)
         return
     data = db.get_word_for_editing(message.chat.id, native, lang)
     if data:
@@ -227,95 +463,99 @@ def select_edit_word(message):
             InlineKeyboardButton('Delete', callback_data='edit_cb_del'),
             InlineKeyboardButton('Change', callback_data='edit_cb_change')
         )
-        bot.send_message(message.chat.id, f'Editing word:\n{edit_cache[message.chat.id]}', reply_markup=markup)
+        outbox.send_message(message.chat.id, f'Editing word:\n{edit_cache[message.chat.id]}', reply_markup=markup)
     else:
-        msg = bot.reply_to(message, "There are no any words with this pair of native word and lang!\nEnter again:")
-        bot.register_next_step_handler(msg, select_edit_word)
+        outbox.reply_to(message, "There are no any words with this pair of native word and lang!\nEnter again:")
+        bot.register_next_step_handler(message, select_edit_word)
 
 
-@cancel_fsm
+@cancel_fsm(edit_cache)
 def enter_foreign_change(message):
     db.change_foreign_word(message.chat.id,
                            edit_cache[message.chat.id][1],
                            message.text,
                            edit_cache[message.chat.id][3])
-    bot.send_message(message.chat.id, "Foreign word has been changed!")
+    outbox.send_message(message.chat.id, "Foreign word has been changed!")
     edit_cache.pop(message.chat.id, None)
 
 
-@cancel_fsm
+@cancel_fsm(edit_cache)
 def enter_native_change(message):
     db.change_native_word(message.chat.id,
                           edit_cache[message.chat.id][1],
                           message.text,
                           edit_cache[message.chat.id][3])
-    bot.send_message(message.chat.id, "Native word has been changed!")
+    outbox.send_message(message.chat.id, "Native word has been changed!")
     edit_cache.pop(message.chat.id, None)
 
 
-@cancel_fsm
+@cancel_fsm(edit_cache)
 def enter_group_change(message):
     db.change_group(message.chat.id,
                     edit_cache[message.chat.id][1],
                     message.text,
                     edit_cache[message.chat.id][3])
-    bot.send_message(message.chat.id, "Group of word has been changed!")
+    outbox.send_message(message.chat.id, "Group of word has been changed!")
     edit_cache.pop(message.chat.id, None)
 
 
-@cancel_fsm
+@cancel_fsm(edit_cache)
 def enter_lang_change(message):
     db.change_lang_code(message.chat.id,
                         edit_cache[message.chat.id][1],
                         message.text,
                         edit_cache[message.chat.id][3])
-    bot.send_message(message.chat.id, "Lang code of word has been changed!")
+    outbox.send_message(message.chat.id, "Lang code of word has been changed!")
     edit_cache.pop(message.chat.id, None)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("edit_"))
+@callback_query_handler(func=lambda call: call.data.startswith("edit_"))
 def callback_query(call):
+    if call.message.chat.id not in edit_cache:
+        outbox.send_message(call.message.chat.id, "This edit has expired. Use /edit to choose the word again.")
+        return
     if call.data == 'edit_cb_del':
         markup = InlineKeyboardMarkup(row_width=2)
         markup.add(InlineKeyboardButton('Yes', callback_data='edit_del_y'),
                    InlineKeyboardButton('No', callback_data='edit_del_n'))
-        bot.edit_message_text(f'Deleting word:\n{edit_cache[call.message.chat.id]}\nConfirm?',
-                              call.message.chat.id,
-                              call.message.message_id,
-                              reply_markup=markup)
+        outbox.edit_message_text(f'Deleting word:\n{edit_cache[call.message.chat.id]}\nConfirm?',
+                                 call.message.chat.id,
+                                 call.message.message_id,
+                                 reply_markup=markup)
     elif call.data == 'edit_del_y':
         db.delete_word(call.message.chat.id, edit_cache[call.message.chat.id][1], edit_cache[call.message.chat.id][3])
-        bot.send_message(call.message.chat.id, "Word deleted successfully.")
+        outbox.send_message(call.message.chat.id, "Word deleted successfully.")
         edit_cache.pop(call.message.chat.id, None)
     elif call.data == 'edit_del_n':
-        bot.send_message(call.message.chat.id, "Deletion cancelled.")
+        outbox.send_message(call.message.chat.id, "Deletion cancelled.")
+        edit_cache.pop(call.message.chat.id, None)
     elif call.data == "edit_cb_change":  # Change word info
         markup = InlineKeyboardMarkup(row_width=2)
         markup.add(InlineKeyboardButton('Change foreign', callback_data='edit_change_fgn'),
                    InlineKeyboardButton('Change native', callback_data='edit_change_ntv'),
                    InlineKeyboardButton('Change group', callback_data='edit_change_grp'),
                    InlineKeyboardButton('Change lang code', callback_data='edit_change_lng'))
-        bot.edit_message_text(f"Choose what to change:\n{edit_cache[call.message.chat.id]}",
-                              call.message.chat.id,
-                              call.message.message_id,
-                              reply_markup=markup)
+        outbox.edit_message_text(f"Choose what to change:\n{edit_cache[call.message.chat.id]}",
+                                 call.message.chat.id,
+                                 call.message.message_id,
+                                 reply_markup=markup)
     elif call.data == "edit_change_fgn":  # Change foreign word
         markup = InlineKeyboardMarkup().add(InlineKeyboardButton("Back", callback_data='edit_cb_change'))
-        bot.edit_message_text(call.message.text + "\nEnter new foreign word:",
-                              call.message.chat.id,
-                              call.message.message_id,
-                              reply_markup=markup)
+        outbox.edit_message_text(call.message.text + "\nEnter new foreign word:",
+                                 call.message.chat.id,
+                                 call.message.message_id,
+                                 reply_markup=markup)
         bot.register_next_step_handler(call.message, enter_foreign_change)
     elif call.data == "edit_change_ntv":  # Change native word
-        bot.edit_message_text(call.message.text + "\nEnter new native word:",
-                              call.message.chat.id,
-                              call.message.message_id)
+        outbox.edit_message_text(call.message.text + "\nEnter new native word:",
+                                 call.message.chat.id,
+                                 call.message.message_id)
         bot.register_next_step_handler(call.message, enter_native_change)
     elif call.data == "edit_change_grp":  # Change native word
-        bot.edit_message_text("Enter new group:", call.message.chat.id, call.message.message_id)
+        outbox.edit_message_text("Enter new group:", call.message.chat.id, call.message.message_id)
         bot.register_next_step_handler(call.message, enter_group_change)
     elif call.data == "edit_change_lng":  # Change native word
-        bot.edit_message_text("Enter new lang code:", call.message.chat.id, call.message.message_id)
+        outbox.edit_message_text("Enter new lang code:", call.message.chat.id, call.message.message_id)
         bot.register_next_step_handler(call.message, enter_lang_change)
 
 
@@ -330,90 +570,85 @@ def sort_words(message):
     elif sort_by == 'ru':
         sorted_data = sorted(data, key=lambda x: x[1])
     else:
-        bot.send_message(message.chat.id, "Invalid sort option. Use 'en' or 'ru'.")
+        outbox.send_message(message.chat.id, "Invalid sort option. Use 'en' or 'ru'.")
         return
     msg_text = "Sorted words:\n"
     for i, line in enumerate(sorted_data, 1):
         msg_text += f"{i}. {line[0]} --- {line[1]} (Group: {line[2]})\n"
-    bot.send_message(message.chat.id, msg_text)
+    outbox.send_message(message.chat.id, msg_text)
 
 
 # -------------------------------
 # Flashcards (/flash)
 # -------------------------------
-@bot.message_handler(commands=['flash'])
+@message_handler(commands=['flash'])
 def start_flashcards(message):
     markup = ReplyKeyboardMarkup(resize_keyboard=True).add(KeyboardButton("Yes"), KeyboardButton("No"))
-    msg = bot.send_message(message.chat.id, "Do you want the flashcards to be randomized?", reply_markup=markup)
-    bot.register_next_step_handler(msg, process_flashcard_random)
+    outbox.send_message(message.chat.id, "Do you want the flashcards to be randomized?", reply_markup=markup)
+    bot.register_next_step_handler(message, process_flashcard_random)
 
 
-@cancel_fsm
+@cancel_fsm(flash_cache)
 def process_flashcard_random(message):
     if message.text == "Yes":
         flash_cache[message.chat.id] = {"random": True}
     elif message.text == "No":
         flash_cache[message.chat.id] = {"random": False}
     else:
-        msg = bot.reply_to(message, "Your answer isn't correct. You need to just write 'Yes' or 'No'.")
-        bot.register_next_step_handler(msg, process_flashcard_random)
+        outbox.reply_to(message, "Your answer isn't correct. You need to just write 'Yes' or 'No'.")
+        bot.register_next_step_handler(message, process_flashcard_random)
         return
 
-    msg = bot.reply_to(message,
-                       "Select groups for flashcards (comma with space separated) or type 'all' for all groups:")
-    bot.register_next_step_handler(msg, process_flashcard_groups)
+    outbox.reply_to(message,
+                    "Select groups for flashcards (comma with space separated) or type 'all' for all groups:")
+    bot.register_next_step_handler(message, process_flashcard_groups)
 
 
-@cancel_fsm
+@cancel_fsm(flash_cache)
 def process_flashcard_groups(message):
     groups = message.text.split(", ") if message.text.lower() != "all" else []
-    flash_cache[message.chat.id]["groups"] = groups
+    options = flash_cache[message.chat.id]
+    options["groups"] = groups
+    flash_cache[message.chat.id] = options
 
-    msg = bot.reply_to(message, "Select languages (comma and space separated) or type 'all' for all languages:")
-    bot.register_next_step_handler(msg, process_flashcard_languages)
+    outbox.reply_to(message, "Select languages (comma and space separated) or type 'all' for all languages:")
+    bot.register_next_step_handler(message, process_flashcard_languages)
 
 
-@cancel_fsm
+@cancel_fsm(flash_cache)
 def process_flashcard_languages(message):
     langs = message.text.split(", ") if message.text.lower() != "all" else []
-    flash_cache[message.chat.id]["langs"] = langs
+    options = flash_cache[message.chat.id]
 
-    # Fetch filtered words from the database
-    data = db.get_flash_words(message.chat.id, flash_cache[message.chat.id]["groups"], langs)
-
-    if not data:
-        bot.send_message(message.chat.id, "No words found for the selected filters.")
+    # The session keeps only the order of the deck and a small window of prefetched cards
+    session = FlashSession(db, message.chat.id, options["groups"], langs, options["random"])
+    if session.current(db, message.chat.id) is None:
+        flash_cache.pop(message.chat.id, None)
+        outbox.send_message(message.chat.id, "No words found for the selected filters.")
         return
 
-    # Check if randomization is enabled and shuffle words
-    if flash_cache[message.chat.id]["random"]:
-        random.shuffle(data)
-
-    flash_cache[message.chat.id]["words"] = data
-    flash_cache[message.chat.id]["index"] = 0
-
+    flash_cache[message.chat.id] = session
     show_flashcard(message.chat.id)
 
 
 def show_flashcard(chat_id, message_id=None):
     """Edits the current flashcard message instead of sending a new one."""
-    index = flash_cache[chat_id]["index"]
-    words = flash_cache[chat_id]["words"]
+    session = flash_cache[chat_id]
+    word = session.current(db, chat_id)
+    flash_cache[chat_id] = session
 
-    if index >= len(words):  # All words checked
+    if word is None:  # All words checked
         offer_retry(chat_id, message_id)
         return
 
-    word = words[index]
     markup = InlineKeyboardMarkup()
     markup.add(InlineKeyboardButton("Show Answer", callback_data="flash_show"))
 
     if message_id:
-        bot.edit_message_text(f"Flashcard:\nWord: {word[0]}\nWhat is the translation?",
-                              chat_id, message_id, reply_markup=markup)
+        outbox.edit_message_text(f"Flashcard:\nWord: {word[1]}\nWhat is the translation?",
+                                 chat_id, message_id, reply_markup=markup)
     else:
-        msg = bot.send_message(chat_id, f"Flashcard:\nWord: {word[0]}\nWhat is the translation?", reply_markup=markup)
-        flash_cache[chat_id]["message_id"] = msg.message_id  # Store the message ID
+        outbox.send_message(chat_id, f"Flashcard:\nWord: {word[1]}\nWhat is the translation?", reply_markup=markup)
 
 
 def offer_retry(chat_id, message_id):
@@ -424,57 +659,158 @@ def offer_retry(chat_id, message_id):
         InlineKeyboardButton("📂 Choose New Groups/Languages", callback_data="flash_new")
     )
 
-    bot.edit_message_text("You've gone through all words! What do you want to do next?",
-                          chat_id, message_id, reply_markup=markup)
+    outbox.edit_message_text("You've gone through all words! What do you want to do next?",
+                             chat_id, message_id, reply_markup=markup)
 
 
-@bot.callback_query_handler(func=lambda call: call.data in ["flash_retry", "flash_new"])
+@callback_query_handler(func=lambda call: call.data in ["flash_retry", "flash_new"])
 def handle_retry_option(call):
     chat_id = call.message.chat.id
+    session = flash_cache.get(chat_id)
+    if not isinstance(session, FlashSession):
+        outbox.send_message(chat_id, "This flashcard session has ended. Use /flash to start a new one.")
+        return
     if call.data == "flash_retry":
-        flash_cache[chat_id]["index"] = 0  # Reset index
+        session.restart()
+        flash_cache[chat_id] = session
         show_flashcard(chat_id)
     elif call.data == "flash_new":
-        bot.send_message(chat_id, "Let's choose new words! Enter the groups you want to study:")
+        flash_cache[chat_id] = {"random": session.random}
+        outbox.send_message(chat_id, "Let's choose new words! Enter the groups you want to study:")
         bot.register_next_step_handler(call.message, process_flashcard_groups)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("flash_"))
+@callback_query_handler(func=lambda call: call.data.startswith("flash_"))
 def flash_callback(call):
     chat_id = call.message.chat.id
-    index = flash_cache[chat_id]["index"]
-    word = flash_cache[chat_id]["words"][index]
+    session = flash_cache.get(chat_id)
+    if not isinstance(session, FlashSession):
+        outbox.send_message(chat_id, "This flashcard session has ended. Use /flash to start a new one.")
+        return
+    word = session.current(db, chat_id)
 
-    if call.data == "flash_show":
+    if call.data == "flash_show" and word is not None:
         markup = InlineKeyboardMarkup()
         markup.add(InlineKeyboardButton("Next", callback_data="flash_next"))
-        bot.edit_message_text(f"Flashcard:\nWord: {word[0]}\nTranslation: {word[1]}",
-                              chat_id, call.message.message_id, reply_markup=markup)
+        outbox.edit_message_text(f"Flashcard:\nWord: {word[1]}\nTranslation: {word[2]}",
+                                 chat_id, call.message.message_id, reply_markup=markup)
     elif call.data == "flash_next":
-        flash_cache[chat_id]["index"] += 1
+        session.advance()
+        flash_cache[chat_id] = session
         show_flashcard(chat_id, call.message.message_id)  # Pass the existing message ID
 
 
+# -------------------------------
+# Spaced repetition (/review)
+# -------------------------------
+REVIEW_BATCH_SIZE = 20
+
+
+@message_handler(commands=['review'])
+def start_review(message):
+    outbox.reply_to(message,
+                    "Let's review the words that are due!\n"
+                    "Select groups (comma with space separated) or type 'all' for all groups:")
+    bot.register_next_step_handler(message, process_review_groups)
+
+
+@cancel_fsm(review_cache)
+def process_review_groups(message):
+    groups = message.text.split(", ") if message.text.lower() != "all" else []
+    review_cache[message.chat.id] = {"groups": groups}
+    outbox.reply_to(message, "Select languages (comma and space separated) or type 'all' for all languages:")
+    bot.register_next_step_handler(message, process_review_languages)
+
+
+@cancel_fsm(review_cache)
+def process_review_languages(message):
+    langs = message.text.split(", ") if message.text.lower() != "all" else []
+    session = review_cache[message.chat.id]
+    session["langs"] = langs
+    review_cache[message.chat.id] = session
+    load_review_batch(message.chat.id)
+
+
+def load_review_batch(chat_id, message_id=None):
+    """Fetches the next cards that are due, most overdue first, and shows the first one."""
+    session = review_cache[chat_id]
+    session["cards"] = db.get_due_words(chat_id, time.time(), session["groups"], session["langs"],
+                                        limit=REVIEW_BATCH_SIZE)
+    session["index"] = 0
+    review_cache[chat_id] = session
+    if not session["cards"]:
+        text = "No words are due for review. Come back later!"
+        if message_id:
+            outbox.edit_message_text(text, chat_id, message_id)
+        else:
+            outbox.send_message(chat_id, text)
+        review_cache.pop(chat_id, None)
+        return
+    show_review_card(chat_id, message_id)
+
+
+def show_review_card(chat_id, message_id=None):
+    card = review_cache[chat_id]["cards"][review_cache[chat_id]["index"]]
+    markup = InlineKeyboardMarkup().add(InlineKeyboardButton("Show Answer", callback_data="srs_show"))
+    text = f"Review:\nWord: {card[1]}\nWhat is the translation?"
+    if message_id:
+        outbox.edit_message_text(text, chat_id, message_id, reply_markup=markup)
+    else:
+        outbox.send_message(chat_id, text, reply_markup=markup)
+
+
+@callback_query_handler(func=lambda call: call.data.startswith("srs_"))
+def review_callback(call):
+    chat_id = call.message.chat.id
+    session = review_cache.get(chat_id)
+    if session is None or "cards" not in session:
+        outbox.edit_message_text("This review session has ended. Use /review to start a new one.",
+                                 chat_id, call.message.message_id)
+        return
+    card = session["cards"][session["index"]]
+
+    if call.data == "srs_show":
+        markup = InlineKeyboardMarkup(row_width=3)
+        markup.add(InlineKeyboardButton("Again", callback_data="srs_again"),
+                   InlineKeyboardButton("Good", callback_data="srs_good"),
+                   InlineKeyboardButton("Easy", callback_data="srs_easy"))
+        outbox.edit_message_text(f"Review:\nWord: {card[1]}\nTranslation: {card[2]}",
+                                 chat_id, call.message.message_id, reply_markup=markup)
+        return
+
+    grade = call.data[len("srs_"):]
+    if grade not in srs.GRADES:
+        return
+    ease, interval_days, repetitions, due = srs.schedule(card[5], card[6], card[7], grade, time.time())
+    db.grade_word(chat_id, card[0], ease, interval_days, repetitions, due)
+    session["index"] += 1
+    review_cache[chat_id] = session
+    if session["index"] < len(session["cards"]):
+        show_review_card(chat_id, call.message.message_id)
+    else:
+        load_review_batch(chat_id, call.message.message_id)
+
+
 # -------------------------------
 # Reminder Functionality
 # -------------------------------
-@bot.message_handler(commands=["set_reminder"])
+@message_handler(commands=["set_reminder"])
 def make_reminder(message):
-    msg = bot.send_message(message.chat.id, "Enter the group for which to set a reminder (or type 'all'):")
-    bot.register_next_step_handler(msg, process_reminder_group)
+    outbox.send_message(message.chat.id, "Enter the group for which to set a reminder (or type 'all'):")
+    bot.register_next_step_handler(message, process_reminder_group)
 
 
 # Step 1: Process the group for the reminder
-@cancel_fsm
+@cancel_fsm(reminder_cache)
 def process_reminder_group(message):
     group = message.text.strip()
     reminder_cache[message.chat.id] = {"group": group}
-    bot.send_message(message.chat.id, "Enter the time interval for the reminder (e.g., '10m', '2h', '1d'):")
+    outbox.send_message(message.chat.id, "Enter the time interval for the reminder (e.g., '10m', '2h', '1d'):")
     bot.register_next_step_handler(message, process_reminder_time)
 
 
 # Step 2: Process the time interval for the reminder
-@cancel_fsm
+@cancel_fsm(reminder_cache)
 def process_reminder_time(message):
     time_input = message.text.strip().lower()
     chat_id = message.chat.id
@@ -490,113 +826,176 @@ def process_reminder_time(message):
         if interval < 60 or interval > 2592000:  # Minimum 1 minute, maximum 1 month
             raise ValueError("Time out of range")
     except (ValueError, IndexError):
-        bot.send_message(chat_id, "Invalid time format. Please try again (e.g., '10m', '2h', '1d'):")
+        outbox.send_message(chat_id, "Invalid time format. Please try again (e.g., '10m', '2h', '1d'):")
         bot.register_next_step_handler(message, process_reminder_time)
         return
 
     # Save the interval and start the reminder
-    reminder_cache[chat_id]["interval"] = interval
-    reminder_cache[chat_id]["time_input"] = time_input
     group = reminder_cache[chat_id]["group"]
+    reminder_cache.pop(chat_id)
     start_reminder(chat_id, group, interval, time_input)
-    bot.send_message(chat_id, f"Reminder set for group '{group}' every {time_input}. Use /reminders to manage reminders.")
+    outbox.send_message(chat_id, f"Reminder set for group '{group}' every {time_input}. Use /reminders to manage reminders.")
 
 
 # Step 3: Start the reminder
 def start_reminder(chat_id, group, interval, time_input):
-    if chat_id in reminder_timers:
-        reminder_timers[chat_id].append({"group": group,
-                                         "interval": interval,
-                                         "time_input": time_input,
-                                         "active": True})
-    else:
-        reminder_timers[chat_id] = [{"group": group,
-                                     "interval": interval,
-                                     "time_input": time_input,
-                                     "active": True}]
-
-    # Start a background thread for the reminder
-    def reminder_thread():
-        while any(r["active"] for r in reminder_timers[chat_id]):
-            for reminder in reminder_timers[chat_id]:
-                if reminder["active"]:
-                    bot.send_message(chat_id, f"Reminder: Review your words in group '{reminder['group']}'!")
-                    time.sleep(reminder["interval"])
-
-    threading.Thread(target=reminder_thread, daemon=True).start()
+    reminders.add(chat_id, group, interval, time_input)
 
 
 # Step 4: List active reminders
-@bot.message_handler(commands=["reminders"])
+@message_handler(commands=["reminders"])
 def list_reminders(message):
     chat_id = message.chat.id
-    if chat_id not in reminder_timers or not reminder_timers[chat_id]:
-        bot.send_message(chat_id, "You have no active reminders.")
+    chat_reminders = reminders.get_reminders(chat_id)
+    if not chat_reminders:
+        outbox.send_message(chat_id, "You have no active reminders.")
         return
 
     response = "Your active reminders:\n"
-    for i, reminder in enumerate(reminder_timers[chat_id], start=1):
+    for i, reminder in enumerate(chat_reminders, start=1):
         status = "Active" if reminder["active"] else "Inactive"
         response += f"{i}. Group: {reminder['group']}, Interval: {reminder['time_input']}, Status: {status}\n"
     response += "\nTo stop a reminder, use /stop_reminder <number>."
     response += "\nTo run a reminder, use /run_reminder <number>."
     response += "\nTo delete a reminder, use /delete_reminder <number>."
-    bot.send_message(chat_id, response)
+    outbox.send_message(chat_id, response)
 
 
-@bot.message_handler(commands=["stop_reminder"])
+@message_handler(commands=["stop_reminder"])
 def stop_reminder(message):
     chat_id = message.chat.id
-    if chat_id not in reminder_timers or not reminder_timers[chat_id]:
-        bot.send_message(chat_id, "You have no active reminders to stop.")
+    if not reminders.get_reminders(chat_id):
+        outbox.send_message(chat_id, "You have no active reminders to stop.")
         return
 
     try:
         index = int(message.text.split()[1]) - 1
-        if index < 0 or index >= len(reminder_timers[chat_id]):
-            raise IndexError("Invalid index")
-        reminder_timers[chat_id][index]["active"] = False
-        bot.send_message(chat_id, f"Reminder {index + 1} has been stopped.")
+        reminders.stop(chat_id, index)
+        outbox.send_message(chat_id, f"Reminder {index + 1} has been stopped.")
     except (IndexError, ValueError):
-        bot.send_message(chat_id, "Invalid command. Use /stop_reminder <number> to stop a reminder.")
+        outbox.send_message(chat_id, "Invalid command. Use /stop_reminder <number> to stop a reminder.")
 
 
-@bot.message_handler(commands=["run_reminder"])
+@message_handler(commands=["run_reminder"])
 def run_reminder(message):
     chat_id = message.chat.id
-    if chat_id not in reminder_timers or not reminder_timers[chat_id]:
-        bot.send_message(chat_id, "You have no inactive reminders to run.")
+    if not reminders.get_reminders(chat_id):
+        outbox.send_message(chat_id, "You have no inactive reminders to run.")
         return
 
     try:
         index = int(message.text.split()[1]) - 1
-        if index < 0 or index >= len(reminder_timers[chat_id]):
-            raise IndexError("Invalid index")
-        reminder_timers[chat_id][index]["active"] = True
-        bot.send_message(chat_id, f"Reminder {index + 1} has been launched.")
+        reminders.run(chat_id, index)
+        outbox.send_message(chat_id, f"Reminder {index + 1} has been launched.")
     except (IndexError, ValueError):
-        bot.send_message(chat_id, "Invalid command. Use /stop_reminder <number> to run a reminder.")
+        outbox.send_message(chat_id, "Invalid command. Use /stop_reminder <number> to run a reminder.")
 
 
 # Step 5: Delete a reminder
-@bot.message_handler(commands=["delete_reminder"])
+@message_handler(commands=["delete_reminder"])
 def delete_reminder(message):
     chat_id = message.chat.id
-    if chat_id not in reminder_timers or not reminder_timers[chat_id]:
-        bot.send_message(chat_id, "You have no reminders to delete.")
+    if not reminders.get_reminders(chat_id):
+        outbox.send_message(chat_id, "You have no reminders to delete.")
         return
 
     try:
         index = int(message.text.split()[1]) - 1
-        if index < 0 or index >= len(reminder_timers[chat_id]):
-            raise IndexError("Invalid index")
-        reminder_timers[chat_id].pop(index)
-        bot.send_message(chat_id, f"Reminder {index + 1} has been deleted.")
+        reminders.delete(chat_id, index)
+        outbox.send_message(chat_id, f"Reminder {index + 1} has been deleted.")
     except (IndexError, ValueError):
-        bot.send_message(chat_id, "Invalid command. Use /delete_reminder <number> to delete a reminder.")
+        outbox.send_message(chat_id, "Invalid command. Use /delete_reminder <number> to delete a reminder.")
 
 
 # -------------------------------
-# Start polling
+# App factory
 # -------------------------------
-bot.infinity_polling()
+class App:
+    def __init__(self, config, bot, db, outbox, reminders):
+        self.config = config
+        self.bot = bot
+        self.db = db
+        self.outbox = outbox
+        self.reminders = reminders
+
+    def close(self):
+        self.outbox.stop()
+        self.db.close()
+
+
+def create_app(config):
+    """Builds the bot from config (TOKEN, and optionally DB_PATH or DB_SHARDS, REDIS_URL, QUERY_CACHE_SIZE,
+    HTTP_POOL_SIZE, OUTBOX_*, SLOW_QUERY_MS) and registers the handlers. Nothing is started."""
+    global bot, db, outbox, reminders
+    # With REDIS_URL set, conversation state (and the next-step handler chains) lives in Redis,
+    # so updates of one chat can be handled by any of several bot workers
+    redis_url = getattr(config, "REDIS_URL", None)
+    if redis_url:
+        import redis
+
+        redis_client = redis.Redis.from_url(redis_url)
+        state.configure(lambda store: RedisBackend(redis_client, f"state:{store.name}:"))
+    else:
+        state.configure(memory_backend)
+
+    bot = telebot.TeleBot(config.TOKEN, next_step_backend=StepHandlerBackend(step_cache))
+    # With DB_SHARDS (a list of paths) set, every chat's words live in one of several files
+    # The query cache only sees this process's writes, so it is off by default when REDIS_URL
+    # means several workers share the database
+    cache_size = getattr(config, "QUERY_CACHE_SIZE", 0 if redis_url else 10000)
+    if getattr(config, "DB_SHARDS", None):
+        db = ShardedDataBase(config.DB_SHARDS, cache_size=cache_size)
+    else:
+        db = DataBase(getattr(config, "DB_PATH", "EngTeacher.db"), cache_size=cache_size)
+
+    # Handlers queue their messages here and return; the outbox sends them within Telegram's rate
+    # limits over a connection pool shared by every thread
+    apihelper.session = pooled_session(getattr(config, "HTTP_POOL_SIZE", 16))
+    outbox = Outbox(bot,
+                    workers=getattr(config, "OUTBOX_WORKERS", 4),
+                    global_rate=getattr(config, "OUTBOX_GLOBAL_RATE", 30),
+                    chat_rate=getattr(config, "OUTBOX_CHAT_RATE", 1),
+                    chat_burst=getattr(config, "OUTBOX_CHAT_BURST", 3))
+
+    # One scheduler thread serves the reminders of every chat
+    reminders = ReminderScheduler(db, send_reminder)
+
+    for method, handler, filters in HANDLERS:
+        getattr(bot, method)(handler, **filters)
+
+    # Handler and query latencies, plus the sizes of the stores, for the /metrics page
+    metrics.configure(slow_query_ms=getattr(config, "SLOW_QUERY_MS", 100))
+    metrics.instrument_bot(bot)
+    register_gauges(db, outbox, reminders)
+    return App(config, bot, db, outbox, reminders)
+
+
+def register_gauges(db, outbox, reminders):
+    metrics.REGISTRY.gauge("bot_state_entries", "Entries in a conversation state store.",
+                           lambda: {name: m["entries"] for name, m in state.metrics().items() if "entries" in m},
+                           "store")
+    metrics.REGISTRY.gauge("bot_state_bytes", "Approximate size of a conversation state store.",
+                           lambda: {name: m["bytes"] for name, m in state.metrics().items() if "bytes" in m},
+                           "store")
+    caches = [shard.cache for shard in getattr(db, "shards", [db]) if shard.cache is not None]
+    if caches:
+        metrics.REGISTRY.gauge("bot_query_cache_entries", "Results in the query cache.",
+                               lambda: sum(cache.metrics()["entries"] for cache in caches))
+        metrics.REGISTRY.counter("bot_query_cache_requests_total", "Query cache lookups.",
+                                 lambda: {"hit": sum(cache.hits for cache in caches),
+                                          "miss": sum(cache.misses for cache in caches)}, "result")
+    metrics.REGISTRY.gauge("bot_outbox_pending", "Messages waiting in the outbox.",
+                           lambda: outbox.metrics()["pending"])
+    metrics.REGISTRY.counter("bot_outbox_messages_total", "Outbox messages by outcome.",
+                             lambda: {key: value for key, value in outbox.metrics().items()
+                                      if key in ("sent", "coalesced", "retried", "failed")}, "outcome")
+    metrics.REGISTRY.gauge("bot_reminder_threads", "Running reminder scheduler threads.",
+                           lambda: reminders.metrics()["threads"])
+    metrics.REGISTRY.gauge("bot_reminders_loaded", "Reminders held in memory by the scheduler.",
+                           lambda: reminders.metrics()["loaded"])
+
+
+if __name__ == "__main__":
+    import cli
+
+    cli.main(["polling"])
@@ -0,0 +1,217 @@
+"""Latency histograms and gauges in the Prometheus text format.
+
+Handlers are timed by instrument_bot and DataBase methods by timed_methods, each into a
+histogram labeled with the function name. Gauges and counters are read from the existing
+metrics() methods of the stores, the outbox and the dispatcher when the page is rendered,
+so they cost nothing between scrapes. With METRICS_PORT set in config, serve() exposes the
+page at http://<host>:<port>/metrics; render() returns the same text for a dump.
+"""
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; an observation is counted in the first bucket it fits
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+slow_query_seconds = 0.1  # DataBase calls slower than this are logged
+
+
+def configure(slow_query_ms):
+    global slow_query_seconds
+    slow_query_seconds = slow_query_ms / 1000
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, label, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # label value -> [count per bucket and +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def samples(self):
+        with self._lock:
+            series = {value: (list(counts), total) for value, (counts, total) in self._series.items()}
+        for value, (counts, total) in sorted(series.items()):
+            labels = f'{self.label}="{escape(value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels},le="{format_value(bound)}"}}', cumulative
+            yield f'{self.name}_sum{{{labels}}}', total
+            yield f'{self.name}_count{{{labels}}}', cumulative
+
+
+class Callback:
+    """A gauge or counter whose values are read when the metrics are rendered.
+
+    read() returns a number, or a dict of label value -> number when label is given."""
+
+    def __init__(self, name, help, kind, read, label=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.read = read
+        self.label = label
+
+    def samples(self):
+        try:
+            values = self.read()
+        except Exception:
+            logger.exception("Could not read metric %s", self.name)
+            return
+        if self.label is None:
+            yield self.name, values
+        else:
+            for value, number in sorted(values.items()):
+                yield f'{self.name}{{{self.label}="{escape(value)}"}}', number
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help, label):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = Histogram(name, help, label)
+            return self.metrics[name]
+
+    def gauge(self, name, help, read, label=None):
+        self._add(Callback(name, help, "gauge", read, label))
+
+    def counter(self, name, help, read, label=None):
+        self._add(Callback(name, help, "counter", read, label))
+
+    def _add(self, metric):
+        # Registering again replaces the callback, e.g. for a dispatcher that was restarted
+        with self._lock:
+            self.metrics[metric.name] = metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines += [f"{sample} {format_value(number)}" for sample, number in metric.samples()]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_seconds", "Time spent in a message or callback handler.",
+                                     "handler")
+QUERY_SECONDS = REGISTRY.histogram("bot_db_query_seconds", "Time spent in a DataBase method.", "query")
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(number):
+    if number == float("inf"):
+        return "+Inf"
+    return repr(float(number)) if isinstance(number, float) else str(number)
+
+
+def timed(histogram, name, slow=False):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                histogram.observe(name, elapsed)
+                if slow and elapsed >= slow_query_seconds:
+                    logger.warning("Slow query %s took %.1f ms", name, elapsed * 1000)
+        return wrapper
+    return decorator
+
+
+def timed_methods(histogram, exclude=()):
+    """Class decorator timing every public method into histogram, logging the slow calls.
+
+    Generators are left out: their time would include the caller's work between items.
+    So are the methods named in exclude, such as helpers the other methods call, which
+    would otherwise record every call twice."""
+    def decorator(cls):
+        for name, func in list(vars(cls).items()):
+            if (not name.startswith("_") and name not in exclude and inspect.isfunction(func)
+                    and not inspect.isgeneratorfunction(func)):
+                setattr(cls, name, timed(histogram, name, slow=True)(func))
+        return cls
+    return decorator
+
+
+def instrument_bot(bot, histogram=HANDLER_SECONDS):
+    """Times the bot's handlers by function name; call it once every handler is registered.
+
+    Decorated handlers are wrapped in place. Next-step handlers are stored (and may be
+    pickled) as they are, so they are timed where TeleBot runs them, in _exec_task; with
+    threaded=False, as under the dispatcher and the async runtime, that call returns when
+    the handler is done."""
+    for attribute, handlers in vars(bot).items():
+        if attribute.endswith("_handlers") and isinstance(handlers, list):
+            for handler in handlers:
+                handler["function"] = timed(histogram, handler["function"].__name__)(handler["function"])
+    run = bot._exec_task
+
+    def exec_task(task, *args, **kwargs):
+        name = getattr(task, "__name__", "unknown")
+        if name == "_run_middlewares_and_handler":
+            return run(task, *args, **kwargs)  # runs the decorated handlers timed above
+        start = time.perf_counter()
+        try:
+            run(task, *args, **kwargs)
+        finally:
+            histogram.observe(name, time.perf_counter() - start)
+
+    bot._exec_task = exec_task
+    return bot
+
+
+def serve(port, host="0.0.0.0", registry=REGISTRY):
+    """Serves GET /metrics on a daemon thread and returns the server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
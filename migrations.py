@@ -0,0 +1,221 @@
+"""Versioned schema migrations, tracked in SQLite's user_version.
+
+Every migration runs in its own transaction together with the user_version bump, so a
+database is always left at a well defined version. Append new migrations to the end of
+MIGRATIONS; never edit one that has been released.
+"""
+import sqlite3
+
+MIGRATIONS = [
+    # 1: the original words table and the reminders table
+    '''
+    CREATE TABLE IF NOT EXISTS words (
+        "chat_id" INTEGER,
+        "foreign_word" TEXT,
+        "native_word" TEXT,
+        "group" TEXT,
+        "lang" TEXT
+    );
+    CREATE TABLE IF NOT EXISTS reminders (
+        "id" INTEGER PRIMARY KEY,
+        "chat_id" INTEGER NOT NULL,
+        "group" TEXT NOT NULL,
+        "interval" INTEGER NOT NULL,
+        "time_input" TEXT NOT NULL,
+        "active" INTEGER NOT NULL DEFAULT 1,
+        "next_fire" REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS reminders_chat_id ON reminders ("chat_id");
+    CREATE INDEX IF NOT EXISTS reminders_next_fire ON reminders ("next_fire") WHERE "active" = 1;
+    ''',
+    # 2: composite indexes for the per-chat word lookups
+    '''
+    CREATE INDEX IF NOT EXISTS words_chat_lang_native ON words ("chat_id", "lang", "native_word");
+    CREATE INDEX IF NOT EXISTS words_chat_group_lang ON words ("chat_id", "group", "lang");
+    ''',
+    # 3: (chat_id, rowid) order for keyset pagination of a chat's words
+    '''
+    CREATE INDEX IF NOT EXISTS words_chat_id ON words ("chat_id");
+    ''',
+    # 4: spaced-repetition state; new cards have due = 0 and are due immediately
+    '''
+    ALTER TABLE words ADD COLUMN "ease" REAL NOT NULL DEFAULT 2.5;
+    ALTER TABLE words ADD COLUMN "interval_days" REAL NOT NULL DEFAULT 0;
+    ALTER TABLE words ADD COLUMN "repetitions" INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE words ADD COLUMN "due" REAL NOT NULL DEFAULT 0;
+    CREATE INDEX IF NOT EXISTS words_chat_due ON words ("chat_id", "due");
+    ''',
+    # 5: normalized schema; groups and languages are stored once and referenced by id.
+    # Words keep their rowid as "id", so ids held by open sessions stay valid.
+    '''
+    CREATE TABLE users (
+        "id" INTEGER PRIMARY KEY
+    );
+    CREATE TABLE languages (
+        "id" INTEGER PRIMARY KEY,
+        "code" TEXT NOT NULL UNIQUE
+    );
+    CREATE TABLE groups (
+        "id" INTEGER PRIMARY KEY,
+        "chat_id" INTEGER NOT NULL REFERENCES users ("id"),
+        "name" TEXT NOT NULL,
+        UNIQUE ("chat_id", "name")
+    );
+    INSERT INTO users ("id") SELECT DISTINCT "chat_id" FROM words WHERE "chat_id" IS NOT NULL;
+    INSERT INTO languages ("code") SELECT DISTINCT coalesce("lang", '') FROM words WHERE "chat_id" IS NOT NULL;
+    INSERT INTO groups ("chat_id", "name")
+        SELECT DISTINCT "chat_id", coalesce("group", 'default') FROM words WHERE "chat_id" IS NOT NULL;
+    CREATE TABLE words_normalized (
+        "id" INTEGER PRIMARY KEY,
+        "chat_id" INTEGER NOT NULL REFERENCES users ("id"),
+        "foreign_word" TEXT,
+        "native_word" TEXT,
+        "group_id" INTEGER NOT NULL REFERENCES groups ("id"),
+        "lang_id" INTEGER NOT NULL REFERENCES languages ("id"),
+        "ease" REAL NOT NULL DEFAULT 2.5,
+        "interval_days" REAL NOT NULL DEFAULT 0,
+        "repetitions" INTEGER NOT NULL DEFAULT 0,
+        "due" REAL NOT NULL DEFAULT 0
+    );
+    INSERT INTO words_normalized
+        SELECT words.rowid, words."chat_id", words."foreign_word", words."native_word", groups."id", languages."id",
+               words."ease", words."interval_days", words."repetitions", words."due"
+        FROM words
+        JOIN groups ON groups."chat_id" = words."chat_id" AND groups."name" = coalesce(words."group", 'default')
+        JOIN languages ON languages."code" = coalesce(words."lang", '');
+    DROP TABLE words;
+    ALTER TABLE words_normalized RENAME TO words;
+    CREATE INDEX words_chat_id ON words ("chat_id");
+    CREATE INDEX words_chat_lang_native ON words ("chat_id", "lang_id", "native_word");
+    CREATE INDEX words_chat_group_lang ON words ("chat_id", "group_id", "lang_id");
+    CREATE INDEX words_chat_due ON words ("chat_id", "due");
+    ''',
+    # 6: trigram full-text index for /find, kept in sync with words by triggers. It is
+    # contentless (results are read from words), so deletes must repeat the old values.
+    # Every value is indexed with a leading space, so " ab" matches a word starting with "ab".
+    '''
+    CREATE VIRTUAL TABLE words_fts USING fts5(foreign_word, native_word, content='', tokenize='trigram');
+    INSERT INTO words_fts (rowid, foreign_word, native_word)
+        SELECT "id", ' ' || "foreign_word", ' ' || "native_word" FROM words;
+    CREATE TRIGGER words_fts_insert AFTER INSERT ON words BEGIN
+        INSERT INTO words_fts (rowid, foreign_word, native_word)
+            VALUES (new."id", ' ' || new."foreign_word", ' ' || new."native_word");
+    END;
+    CREATE TRIGGER words_fts_delete AFTER DELETE ON words BEGIN
+        INSERT INTO words_fts (words_fts, rowid, foreign_word, native_word)
+            VALUES ('delete', old."id", ' ' || old."foreign_word", ' ' || old."native_word");
+    END;
+    CREATE TRIGGER words_fts_update AFTER UPDATE OF "foreign_word", "native_word" ON words BEGIN
+        INSERT INTO words_fts (words_fts, rowid, foreign_word, native_word)
+            VALUES ('delete', old."id", ' ' || old."foreign_word", ' ' || old."native_word");
+        INSERT INTO words_fts (rowid, foreign_word, native_word)
+            VALUES (new."id", ' ' || new."foreign_word", ' ' || new."native_word");
+    END;
+    ''',
+    # 7: a word is unique per chat, language and translation pair. Duplicates keep their
+    # oldest row (and its review progress); the unique index replaces words_chat_lang_native.
+    '''
+    DELETE FROM words WHERE "id" NOT IN (
+        SELECT min("id") FROM words GROUP BY "chat_id", "lang_id", "native_word", "foreign_word");
+    DROP INDEX words_chat_lang_native;
+    CREATE UNIQUE INDEX words_unique ON words ("chat_id", "lang_id", "native_word", "foreign_word");
+    ''',
+    # 8: change tracking for /sync. sync_clock counts the changes to words in this database
+    # and every added, edited or deleted word takes the next number as its "version";
+    # deleted words leave a tombstone. Existing words keep version 0 and no timestamps.
+    # INSERT_WORD stamps new words itself, which saves rewriting every imported row; other
+    # inserts (the shard rebalancer's) are stamped by the trigger, keeping a created_at given.
+    '''
+    CREATE TABLE sync_clock (
+        "id" INTEGER PRIMARY KEY CHECK ("id" = 0),
+        "database" TEXT NOT NULL,
+        "version" INTEGER NOT NULL
+    );
+    INSERT INTO sync_clock VALUES (0, lower(hex(randomblob(4))), 0);
+    ALTER TABLE words ADD COLUMN "created_at" REAL NOT NULL DEFAULT 0;
+    ALTER TABLE words ADD COLUMN "updated_at" REAL NOT NULL DEFAULT 0;
+    ALTER TABLE words ADD COLUMN "version" INTEGER NOT NULL DEFAULT 0;
+    CREATE INDEX words_chat_version ON words ("chat_id", "version");
+    CREATE TABLE word_tombstones (
+        "version" INTEGER PRIMARY KEY,
+        "chat_id" INTEGER NOT NULL,
+        "word_id" INTEGER NOT NULL,
+        "foreign_word" TEXT,
+        "native_word" TEXT,
+        "lang_id" INTEGER NOT NULL,
+        "deleted_at" REAL NOT NULL
+    );
+    CREATE INDEX word_tombstones_chat_version ON word_tombstones ("chat_id", "version");
+    CREATE TRIGGER words_sync_insert AFTER INSERT ON words WHEN new."version" != 0 BEGIN
+        UPDATE sync_clock SET "version" = new."version";
+    END;
+    CREATE TRIGGER words_sync_insert_stamp AFTER INSERT ON words WHEN new."version" = 0 BEGIN
+        UPDATE sync_clock SET "version" = "version" + 1;
+        UPDATE words SET "version" = (SELECT "version" FROM sync_clock),
+                         "updated_at" = (julianday('now') - 2440587.5) * 86400.0,
+                         "created_at" = CASE WHEN new."created_at" = 0
+                                             THEN (julianday('now') - 2440587.5) * 86400.0
+                                             ELSE new."created_at" END
+            WHERE "id" = new."id";
+    END;
+    CREATE TRIGGER words_sync_update AFTER UPDATE OF "foreign_word", "native_word", "group_id", "lang_id" ON words
+    WHEN old."foreign_word" IS NOT new."foreign_word" OR old."native_word" IS NOT new."native_word"
+        OR old."group_id" IS NOT new."group_id" OR old."lang_id" IS NOT new."lang_id"
+    BEGIN
+        UPDATE sync_clock SET "version" = "version" + 1;
+        UPDATE words SET "version" = (SELECT "version" FROM sync_clock),
+                         "updated_at" = (julianday('now') - 2440587.5) * 86400.0
+            WHERE "id" = new."id";
+    END;
+    CREATE TRIGGER words_sync_delete AFTER DELETE ON words BEGIN
+        UPDATE sync_clock SET "version" = "version" + 1;
+        INSERT INTO word_tombstones ("version", "chat_id", "word_id", "foreign_word", "native_word", "lang_id",
+                                     "deleted_at")
+            VALUES ((SELECT "version" FROM sync_clock), old."chat_id", old."id", old."foreign_word",
+                    old."native_word", old."lang_id", (julianday('now') - 2440587.5) * 86400.0);
+    END;
+    ''',
+]
+
+
+def schema_version(conn):
+    return conn.execute('pragma user_version').fetchone()[0]
+
+
+def statements(script):
+    """Splits a migration script into its statements; triggers stay whole."""
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \n;'):
+                yield statement
+            statement = ''
+
+
+def migrate(conn):
+    """Applies every pending migration and returns the resulting schema version.
+
+    Each migration takes the write lock with BEGIN IMMEDIATE and reads user_version again
+    under it, so processes opening a new database together apply every migration once:
+    the others wait for the lock and then find it applied."""
+    if schema_version(conn) >= len(MIGRATIONS):
+        return schema_version(conn)
+    isolation_level, conn.isolation_level = conn.isolation_level, None
+    try:
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = schema_version(conn)
+                if version < len(MIGRATIONS):
+                    for statement in statements(MIGRATIONS[version]):
+                        conn.execute(statement)
+                    conn.execute(f'pragma user_version = {version + 1}')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            if version >= len(MIGRATIONS):
+                return version
+    finally:
+        conn.isolation_level = isolation_level
@@ -0,0 +1,283 @@
+"""Outbound message queue that keeps the bot within Telegram's rate limits.
+
+Handlers enqueue a request (send_message, reply_to, edit_message_text, send_document) and
+return immediately with a Future. A few sender threads deliver the requests:
+
+* each chat's requests are sent in order, one at a time;
+* a token bucket per chat and a global one hold the request rate under Telegram's limits
+  (about one message per second per chat and thirty per second overall, with short bursts);
+* a 429 answer pauses the chat for the retry_after it names and sends the request again,
+  with file arguments read again from where they were when the request was queued;
+* an edit of a message that still has an edit waiting replaces the waiting one, so quickly
+  tapping through flashcards or pages only sends the latest text.
+"""
+import functools
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def delay(self, now):
+        """Seconds until a token is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self.delay(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        return self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+
+class _Job:
+    __slots__ = ("method", "args", "kwargs", "future", "edit_key", "attempts", "files")
+
+    def __init__(self, method, args, kwargs, edit_key=None):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.edit_key = edit_key
+        self.attempts = 0
+        # (file, position) of every file argument; each attempt reads them from there again
+        self.files = [(value, value.tell()) for value in itertools.chain(args, kwargs.values())
+                      if hasattr(value, "read") and hasattr(value, "seek")]
+
+    def rewind(self):
+        for file, position in self.files:
+            file.seek(position)
+
+
+class _Chat:
+    __slots__ = ("jobs", "bucket", "paused_until", "busy")
+
+    def __init__(self, bucket):
+        self.jobs = deque()
+        self.bucket = bucket
+        self.paused_until = 0.0
+        self.busy = False
+
+
+class Outbox:
+    def __init__(self, bot, workers=4, global_rate=30, chat_rate=1, chat_burst=3):
+        self.bot = bot
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.sent = self.coalesced = self.retried = self.failed = 0
+        self._chats = {}
+        self._edits = {}  # (chat_id, message_id) -> edit job that has not been sent yet
+        self._ready = []  # heap of (ready_at, seq, chat_id) of chats with jobs that are not busy
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._pending = 0
+        self._running = False
+        self._pruned_at = time.monotonic()
+
+    # -------------------------------
+    # Enqueueing
+    # -------------------------------
+    def send_message(self, chat_id, text, **kwargs):
+        return self._enqueue(chat_id, "send_message", (chat_id, text), kwargs)
+
+    def reply_to(self, message, text, **kwargs):
+        return self._enqueue(message.chat.id, "reply_to", (message, text), kwargs)
+
+    def send_document(self, chat_id, document, **kwargs):
+        return self._enqueue(chat_id, "send_document", (chat_id, document), kwargs)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self._enqueue(chat_id, "edit_message_text", (text, chat_id, message_id), kwargs,
+                             edit_key=(chat_id, message_id))
+
+    def _enqueue(self, chat_id, method, args, kwargs, edit_key=None):
+        with self._cond:
+            if not self._running:
+                self._start()
+            waiting = self._edits.get(edit_key) if edit_key else None
+            if waiting is not None:
+                waiting.args, waiting.kwargs = args, kwargs
+                self.coalesced += 1
+                return waiting.future
+            job = _Job(method, args, kwargs, edit_key)
+            if edit_key:
+                self._edits[edit_key] = job
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat(TokenBucket(self.chat_rate, self.chat_burst))
+            chat.jobs.append(job)
+            self._pending += 1
+            if len(chat.jobs) == 1 and not chat.busy:
+                self._push_ready(chat_id, chat, time.monotonic())
+            return job.future
+
+    # -------------------------------
+    # Sending
+    # -------------------------------
+    def _start(self):
+        self._running = True
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _push_ready(self, chat_id, chat, now):
+        ready_at = max(now + chat.bucket.delay(now), chat.paused_until)
+        heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+        self._cond.notify()
+
+    def _next_job(self):
+        """Waits until some chat may send and the global bucket has a token."""
+        with self._cond:
+            while True:
+                if not self._running and not self._pending:
+                    return None, None
+                now = time.monotonic()
+                if not self._ready:
+                    self._cond.wait()
+                    continue
+                ready_at = self._ready[0][0]
+                wait = max(ready_at - now, self.global_bucket.delay(now))
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                _, _, chat_id = heapq.heappop(self._ready)
+                chat = self._chats[chat_id]
+                chat.bucket.take(now)
+                self.global_bucket.take(now)
+                chat.busy = True
+                job = chat.jobs.popleft()
+                if job.edit_key:
+                    del self._edits[job.edit_key]
+                return chat_id, job
+
+    def _finish(self, chat_id, job, retry_after=None):
+        with self._cond:
+            chat = self._chats[chat_id]
+            chat.busy = False
+            now = time.monotonic()
+            if retry_after is not None:
+                chat.paused_until = now + retry_after
+                newer = self._edits.get(job.edit_key) if job.edit_key else None
+                if newer is not None:
+                    # A newer edit of the same message was queued meanwhile and replaces this one
+                    chat.jobs.remove(newer)
+                    newer.future.add_done_callback(functools.partial(_copy_outcome, job.future))
+                    job = newer
+                    self._pending -= 1
+                    self.coalesced += 1
+                chat.jobs.appendleft(job)
+                if job.edit_key:
+                    self._edits[job.edit_key] = job
+            else:
+                self._pending -= 1
+            if chat.jobs:
+                self._push_ready(chat_id, chat, now)
+            self._cond.notify_all()
+            if now - self._pruned_at > 60:
+                self._prune(now)
+
+    def _prune(self, now):
+        # Idle chats whose bucket has refilled hold no information any more
+        self._pruned_at = now
+        for chat_id in [chat_id for chat_id, chat in self._chats.items()
+                        if not chat.jobs and not chat.busy and chat.bucket.full(now)]:
+            del self._chats[chat_id]
+
+    def _run(self):
+        while True:
+            chat_id, job = self._next_job()
+            if job is None:
+                return
+            job.attempts += 1
+            try:
+                job.rewind()
+                result = getattr(self.bot, job.method)(*job.args, **job.kwargs)
+            except ApiTelegramException as e:
+                if e.error_code == 429 and job.attempts < MAX_ATTEMPTS:
+                    self.retried += 1
+                    self._finish(chat_id, job, retry_after=retry_after(e))
+                    continue
+                self._fail(chat_id, job, e)
+            except Exception as e:
+                self._fail(chat_id, job, e)
+            else:
+                self.sent += 1
+                job.future.set_result(result)
+                self._finish(chat_id, job)
+
+    def _fail(self, chat_id, job, error):
+        logger.error("Failed to %s in chat %s: %s", job.method, chat_id, error)
+        self.failed += 1
+        job.future.set_exception(error)
+        self._finish(chat_id, job)
+
+    # -------------------------------
+    # Lifecycle and metrics
+    # -------------------------------
+    def flush(self, timeout=None):
+        """Waits until every queued request has been sent; returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def stop(self):
+        """Sends every queued request and stops the sender threads."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def metrics(self):
+        with self._cond:
+            return {"pending": self._pending,
+                    "chats": len(self._chats),
+                    "sent": self.sent,
+                    "coalesced": self.coalesced,
+                    "retried": self.retried,
+                    "failed": self.failed}
+
+
+def _copy_outcome(target, source):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def retry_after(error):
+    parameters = (error.result_json or {}).get("parameters") or {}
+    return parameters.get("retry_after", 1)
+
+
+def pooled_session(size):
+    """A requests session with a connection pool shared by every thread of the bot."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,100 @@
+"""Read-through cache for the per-chat word queries of DataBase.
+
+A result is cached under (method, chat_id, arguments) together with the chat's version
+number at the time it was read. Every write to a chat's words bumps that version, so older
+results are never returned again and age out of the LRU order like any other entry.
+Versions are kept in a fixed table of VERSION_STRIPES counters indexed by the hash of the
+chat id, so they take the same memory however many chats write. Chats sharing a counter
+invalidate each other's results now and then, which costs a query but never serves a stale
+result.
+The cache lives in one process: with several bot processes writing to the same database it
+would serve results made stale by the others' writes, so create_app leaves it off when
+REDIS_URL is set unless QUERY_CACHE_SIZE says otherwise.
+"""
+import copy
+import functools
+import threading
+from collections import OrderedDict
+
+from state import sizeof
+
+VERSION_STRIPES = 4096
+
+
+class QueryCache:
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._versions = [0] * VERSION_STRIPES  # writes to the chats of each stripe
+        self._data = OrderedDict()  # key -> (version, size, value), least recently used first
+        self._lock = threading.Lock()
+
+    def version(self, chat_id):
+        return self._versions[hash(chat_id) % VERSION_STRIPES]
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                raise KeyError(key)
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, version, value):
+        size = sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._data.pop(key)[1]
+            self._data[key] = (version, size, value)
+            self.bytes += size
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                self.bytes -= self._data.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def invalidate(self, chat_id):
+        with self._lock:
+            self._versions[hash(chat_id) % VERSION_STRIPES] += 1
+            self.invalidations += 1
+
+    def metrics(self):
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "entries": len(self._data),
+                    "bytes": self.bytes,
+                    "evictions": self.evictions,
+                    "invalidations": self.invalidations}
+
+
+def cached(method):
+    """Caches a DataBase read method whose first argument is the chat_id.
+
+    Callers get a shallow copy of the result, so they may change the returned list or array.
+    """
+    @functools.wraps(method)
+    def wrapper(self, chat_id, *args, **kwargs):
+        cache = self.cache
+        if cache is None:
+            return method(self, chat_id, *args, **kwargs)
+        key = (method.__name__, chat_id, _freeze(args), _freeze(sorted(kwargs.items())))
+        version = cache.version(chat_id)
+        try:
+            return copy.copy(cache.get(key, version))
+        except KeyError:
+            pass
+        # The version is read before the query, so a write that lands meanwhile makes the
+        # stored result stale instead of hiding the write
+        value = method(self, chat_id, *args, **kwargs)
+        cache.put(key, version, value)
+        return copy.copy(value)
+    return wrapper
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
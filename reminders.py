@@ -0,0 +1,188 @@
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 1.0  # seconds between scheduler passes after a database error
+REMINDER_FIELDS = ("id", "chat_id", "group", "interval", "time_input", "active", "next_fire")
+
+
+def reminder_from_row(row):
+    reminder = dict(zip(REMINDER_FIELDS, row))
+    reminder["active"] = bool(reminder["active"])
+    return reminder
+
+
+class ReminderScheduler:
+    """Runs every reminder of every chat on one thread using a min-heap of fire times.
+
+    Reminders are stored in the database; only the ones due within ``horizon`` seconds
+    are kept in memory, and the window is refilled from the next_fire index as it moves.
+    A fire is sent only after it has been claimed in the database, so workers that share a
+    database each run a scheduler without sending a reminder twice or after it was stopped.
+    """
+
+    def __init__(self, db, send, horizon=3600):
+        self.db = db
+        self.send = send          # Called as send(chat_id, reminder) when a reminder fires
+        self.horizon = horizon
+        self._heap = []           # (next_fire, reminder_id), stale entries are skipped lazily
+        self._reminders = {}      # reminder_id -> reminder dict, only for the loaded window
+        self._loaded_until = 0.0  # Every active reminder firing before this is in memory
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._load(time.time() + self.horizon)
+                self._thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+                self._thread.start()
+
+    def add(self, chat_id, group, interval, time_input):
+        next_fire = time.time() + interval
+        with self._cond:
+            reminder_id = self.db.add_reminder(chat_id, group, interval, time_input, next_fire)
+            reminder = {"id": reminder_id,
+                        "chat_id": chat_id,
+                        "group": group,
+                        "interval": interval,
+                        "time_input": time_input,
+                        "active": True,
+                        "next_fire": next_fire}
+            self._schedule(reminder)
+        return reminder
+
+    def get_reminders(self, chat_id):
+        return [reminder_from_row(row) for row in self.db.get_reminders(chat_id)]
+
+    def stop(self, chat_id, index):
+        with self._cond:
+            reminder = self._get(chat_id, index)
+            self.db.set_reminder_active(reminder["id"], False, reminder["next_fire"])
+            self._unschedule(reminder["id"])
+
+    def run(self, chat_id, index):
+        with self._cond:
+            reminder = self._get(chat_id, index)
+            if not reminder["active"]:
+                reminder["active"] = True
+                reminder["next_fire"] = time.time() + reminder["interval"]
+                self.db.set_reminder_active(reminder["id"], True, reminder["next_fire"])
+                self._schedule(reminder)
+
+    def delete(self, chat_id, index):
+        with self._cond:
+            reminder = self._get(chat_id, index)
+            self.db.delete_reminder(reminder["id"])
+            self._unschedule(reminder["id"])
+
+    def metrics(self):
+        with self._cond:
+            return {"threads": int(self._thread is not None and self._thread.is_alive()),
+                    "loaded": len(self._reminders),
+                    "heap": len(self._heap)}
+
+    def _get(self, chat_id, index):
+        chat_reminders = self.get_reminders(chat_id)
+        if index < 0 or index >= len(chat_reminders):
+            raise IndexError("Invalid index")
+        return chat_reminders[index]
+
+    def _schedule(self, reminder):
+        # Reminders beyond the loaded window stay in the database until a refill reaches them
+        if reminder["next_fire"] <= self._loaded_until:
+            self._reminders[reminder["id"]] = reminder
+            heapq.heappush(self._heap, (reminder["next_fire"], reminder["id"]))
+            self._cond.notify()
+
+    def _unschedule(self, reminder_id):
+        self._reminders.pop(reminder_id, None)
+        # Stopped and deleted reminders leave stale heap entries behind; drop them once they pile up
+        # so memory stays proportional to the number of loaded reminders.
+        if len(self._heap) > 2 * len(self._reminders) + 64:
+            self._heap = [entry for entry in self._heap if self._is_live(entry)]
+            heapq.heapify(self._heap)
+
+    def _load(self, until):
+        # The window only moves once its reminders have been read
+        rows = self.db.get_due_reminders(until, self._loaded_until or None)
+        self._loaded_until = until
+        for row in rows:
+            self._schedule(reminder_from_row(row))
+
+    def _fire(self, now):
+        """Claims the reminders due by now and returns the ones to send.
+
+        The claim is the only database call, and memory changes only after it succeeded:
+        when it fails the heap entries are put back, so the same fires are claimed again."""
+        due = []  # (reminder, fire time, next fire time)
+        seen = set()  # a reminder can have two live heap entries for the same time
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not self._is_live(entry) or entry[1] in seen:
+                continue
+            seen.add(entry[1])
+            reminder = self._reminders[entry[1]]
+            # Skip missed fires instead of sending a burst after a long stall
+            next_fire = reminder["next_fire"] + reminder["interval"]
+            if next_fire <= now:
+                next_fire = now + reminder["interval"]
+            due.append((reminder, entry[0], next_fire))
+        if not due:
+            return []
+        try:
+            claimed, others = self.db.claim_reminders([(next_fire, r["id"], fired_at)
+                                                       for r, fired_at, next_fire in due])
+        except Exception:
+            for reminder, fired_at, _ in due:
+                heapq.heappush(self._heap, (fired_at, reminder["id"]))
+            raise
+        claimed = set(claimed)
+        for reminder, _, next_fire in due:
+            self._reminders.pop(reminder["id"])
+            if reminder["id"] in claimed:
+                reminder["next_fire"] = next_fire
+                self._schedule(reminder)
+            else:
+                # Fired by another process, or stopped or deleted there
+                row = others.get(reminder["id"])
+                if row is not None and row[5]:
+                    self._schedule(reminder_from_row(row))
+        return [reminder for reminder, _, _ in due if reminder["id"] in claimed]
+
+    def _is_live(self, entry):
+        reminder = self._reminders.get(entry[1])
+        return reminder is not None and reminder["next_fire"] == entry[0]
+
+    def _run(self):
+        while True:
+            try:
+                due = self._next_due()
+            except Exception:
+                # A database error (such as "database is locked" under several writers) must not
+                # end the only scheduler thread; the pass is tried again after a pause
+                logger.exception("Reminder scheduler pass failed, retrying in %ss", RETRY_DELAY)
+                time.sleep(RETRY_DELAY)
+                continue
+            for reminder in due:
+                try:
+                    self.send(reminder["chat_id"], reminder)
+                except Exception:
+                    logger.exception("Failed to send reminder %s", reminder["id"])
+
+    def _next_due(self):
+        # Waits until a reminder is due, refilling the window as it moves, and claims it
+        with self._cond:
+            while True:
+                now = time.time()
+                refill_at = self._loaded_until - self.horizon / 2
+                if now >= refill_at:
+                    self._load(now + self.horizon)
+                    continue
+                if self._heap and self._heap[0][0] <= now:
+                    return self._fire(now)
+                wake_at = min(self._heap[0][0], refill_at) if self._heap else refill_at
+                self._cond.wait(wake_at - now)
@@ -0,0 +1,86 @@
+"""Building FTS5 queries for /find and ranking its fuzzy matches.
+
+words_fts indexes the trigrams of every word's foreign and native side, each value
+prefixed with a space. A term of three or more characters matches anywhere in a word; a
+two-letter term is searched with the space in front, so it matches the start of a word.
+Single letters are too short for the index and are checked against the rows instead.
+
+Matching every chat's words costs as much as the most common trigram of the query across
+all chats, so small vocabularies are read whole and matched here by rank_rows instead.
+"""
+from difflib import SequenceMatcher
+
+MIN_TERM = 3  # the shortest substring a trigram matches
+MIN_PREFIX = 2  # with the leading space, two letters still make a trigram
+FUZZY_MIN_RESULTS = 5  # fewer exact matches than this adds the similarly spelled words
+FUZZY_MIN_RATIO = 0.6
+
+
+def terms(text):
+    return text.lower().split()
+
+
+def phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def term_phrase(term):
+    return phrase(term if len(term) >= MIN_TERM else " " + term)
+
+
+def match_expression(words):
+    """Words whose foreign or native side contains every term."""
+    return " AND ".join(map(term_phrase, words))
+
+
+def fuzzy_expression(words):
+    """Words sharing at least one trigram with the terms, for ranking by similarity."""
+    trigrams = sorted({word[i:i + 3] for word in words for i in range(len(word) - 2)})
+    return " OR ".join(map(phrase, trigrams))
+
+
+def has_prefixes(prefixes, row):
+    """Whether every prefix starts some word of a (rowid, foreign, native, ...) row."""
+    candidates = f"{row[1]} {row[2]}".lower().split()
+    return all(any(candidate.startswith(prefix) for candidate in candidates) for prefix in prefixes)
+
+
+def matches(word, candidates):
+    """Whether a term matches a row's words as the index would: long terms anywhere, short ones at a word start."""
+    if len(word) >= MIN_TERM:
+        return any(word in candidate for candidate in candidates)
+    return any(candidate.startswith(word) for candidate in candidates)
+
+
+def rank_rows(words, rows, limit):
+    """The rows of (rowid, foreign, native, ...) containing every term, whole words and word
+    starts first, followed by the similarly spelled ones when there are only a few."""
+    found = []
+    for row in rows:
+        candidates = f"{row[1]} {row[2]}".lower().split()
+        if all(matches(word, candidates) for word in words):
+            score = sum(2 if word in candidates else any(c.startswith(word) for c in candidates) for word in words)
+            found.append((-score, len(row[1]) + len(row[2]), row))
+    found.sort(key=lambda item: item[:2])
+    result = [row for _, _, row in found]
+    long_words = [word for word in words if len(word) >= MIN_TERM]
+    if len(result) < FUZZY_MIN_RESULTS and long_words:
+        prefixes = [word for word in words if len(word) < MIN_TERM]
+        trigrams = {word[i:i + 3] for word in long_words for i in range(len(word) - 2)}
+        ids = {row[0] for row in result}
+        candidates = []
+        for row in rows:
+            text = f"{row[1]} {row[2]}".lower()
+            if row[0] not in ids and any(trigram in text for trigram in trigrams) and has_prefixes(prefixes, row):
+                candidates.append((similarity(long_words, row), row))
+        result += [row for ratio, row in sorted(candidates, key=lambda item: -item[0]) if ratio >= FUZZY_MIN_RATIO]
+    return result[:limit]
+
+
+def similarity(words, row):
+    """How closely the terms match the words of a (rowid, foreign, native, ...) row, from 0 to 1."""
+    candidates = f"{row[1]} {row[2]}".lower().split()
+    if not candidates:
+        return 0.0
+    return sum(max(SequenceMatcher(None, word, candidate).ratio() for candidate in candidates)
+               for word in words) / len(words)
@@ -0,0 +1,180 @@
+"""Word storage split over several SQLite files, so that chats on different files write in parallel.
+
+ShardedDataBase has the methods of DataBase and sends every per-chat call to the shard of
+that chat: crc32 of the chat id modulo the number of paths, which gives every process the
+same answer. Each shard is a DataBase with its own connections, write lock and query cache.
+Reminders are not per chat for the scheduler (it reads every due reminder at once), so
+they all stay on the first shard.
+
+Changing the list of paths moves the home of most chats. Stop the bot and run
+
+    python shards.py EngTeacher.db words-1.db words-2.db words-3.db
+
+with the new list to move every chat to its new shard, then start the bot with that list
+as DB_SHARDS in config. The first path keeps the reminders, so it must stay first; going
+from one database to several, it is the existing EngTeacher.db. Moving a chat copies it
+and only then deletes the old copy, so an interrupted run can simply be started again.
+Words get new ids on their new shard, and the next /sync of a moved chat is a full export.
+"""
+import argparse
+import sqlite3 as lite
+import time
+import zlib
+
+from database import DataBase
+
+# DataBase methods whose first argument is the chat_id
+CHAT_METHODS = (
+    "invalidate", "input_words", "get_show_words", "get_show_words_page", "iter_show_words", "delete_word",
+    "get_word_for_editing", "change_native_word", "change_foreign_word", "change_group", "change_lang_code",
+    "get_words_by_group", "get_flash_words", "get_flash_word_ids", "get_words_by_ids", "search_words",
+    "get_due_words", "grade_word", "sync_token", "sync_version", "iter_word_changes",
+)
+# Reminder methods, served by the first shard
+PRIMARY_METHODS = (
+    "add_reminder", "get_reminders", "get_due_reminders", "set_reminder_active", "claim_reminders",
+    "delete_reminder",
+)
+
+
+def shard_index(chat_id, count):
+    return zlib.crc32(str(chat_id).encode()) % count
+
+
+class ShardedDataBase:
+    def __init__(self, paths, cache_size=10000, cache_bytes=64 * 1024 * 1024):
+        # The query cache budget is shared by the shards
+        self.shards = [DataBase(path, cache_size // len(paths), cache_bytes // len(paths)) for path in paths]
+        self.primary = self.shards[0]
+
+    def shard(self, chat_id):
+        return self.shards[shard_index(chat_id, len(self.shards))]
+
+    def input_words_many(self, words, batch_size=1000):
+        # Splits the words by shard, keeping batches as large as on a single database. Words read
+        # before an error are still added, as with DataBase.input_words_many.
+        pending = [[] for _ in self.shards]
+        count = 0
+        try:
+            for word in words:
+                index = shard_index(word[0], len(self.shards))
+                pending[index].append(word)
+                if len(pending[index]) >= batch_size:
+                    batch, pending[index] = pending[index], []
+                    count += self.shards[index].input_words_many(batch, batch_size)
+        finally:
+            for shard, batch in zip(self.shards, pending):
+                if batch:
+                    count += shard.input_words_many(batch, batch_size)
+        return count
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def _chat_method(name):
+    def method(self, chat_id, *args, **kwargs):
+        return getattr(self.shard(chat_id), name)(chat_id, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+def _primary_method(name):
+    def method(self, *args, **kwargs):
+        return getattr(self.primary, name)(*args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+for _name in CHAT_METHODS:
+    setattr(ShardedDataBase, _name, _chat_method(_name))
+for _name in PRIMARY_METHODS:
+    setattr(ShardedDataBase, _name, _primary_method(_name))
+
+
+# -------------------------------
+# Rebalancing
+# -------------------------------
+# Copies a chat from the connection's main database into the attached "target" one; the
+# target's triggers keep its search index up to date. Existing rows are kept, so copying
+# a chat again after an interrupted run changes nothing.
+COPY_CHAT = (
+    'INSERT OR IGNORE INTO target.users ("id") VALUES (:chat)',
+    'INSERT OR IGNORE INTO target.groups ("chat_id", "name") SELECT "chat_id", "name" FROM main.groups '
+    'WHERE "chat_id" = :chat',
+    'INSERT OR IGNORE INTO target.languages ("code") SELECT DISTINCT languages."code" FROM main.words '
+    'JOIN main.languages ON languages."id" = words."lang_id" WHERE words."chat_id" = :chat',
+    'INSERT INTO target.words ("chat_id", "foreign_word", "native_word", "group_id", "lang_id", '
+    '"ease", "interval_days", "repetitions", "due", "created_at") '
+    'SELECT words."chat_id", words."foreign_word", words."native_word", tg."id", tl."id", '
+    'words."ease", words."interval_days", words."repetitions", words."due", words."created_at" '
+    'FROM main.words JOIN main.groups ON groups."id" = words."group_id" '
+    'JOIN main.languages ON languages."id" = words."lang_id" '
+    'JOIN target.groups AS tg ON tg."chat_id" = words."chat_id" AND tg."name" = groups."name" '
+    'JOIN target.languages AS tl ON tl."code" = languages."code" '
+    'WHERE words."chat_id" = :chat ORDER BY words."id" '
+    'ON CONFLICT DO NOTHING',
+)
+# The deletes leave tombstones on the source, which are dropped with the chat's old ones: the
+# chat's sync tokens name the source database, so its next /sync is a full export anyway.
+DELETE_CHAT = (
+    'DELETE FROM main.words WHERE "chat_id" = :chat',
+    'DELETE FROM main.word_tombstones WHERE "chat_id" = :chat',
+    'DELETE FROM main.groups WHERE "chat_id" = :chat',
+    'DELETE FROM main.users WHERE "id" = :chat',
+)
+
+
+def misplaced_chats(paths):
+    """(chat_id, source path, target path) of every chat that is not on its shard."""
+    for index, path in enumerate(paths):
+        conn = lite.connect(path)
+        try:
+            chats = [row[0] for row in conn.execute('SELECT "id" FROM users')]
+        finally:
+            conn.close()
+        for chat_id in chats:
+            home = shard_index(chat_id, len(paths))
+            if home != index:
+                yield chat_id, path, paths[home]
+
+
+def move_chat(chat_id, source, target):
+    """Moves a chat's words and groups from the source database file to the target one.
+
+    The copy is committed before the original is deleted: with WAL, a transaction over two
+    files is not atomic across them."""
+    conn = lite.connect(source, isolation_level=None)
+    try:
+        conn.execute('pragma foreign_keys = on')
+        conn.execute('ATTACH ? AS target', (target,))
+        for statements in (COPY_CHAT, DELETE_CHAT):
+            conn.execute('BEGIN IMMEDIATE')
+            for statement in statements:
+                conn.execute(statement, {"chat": chat_id})
+            conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+
+def rebalance(paths, dry_run=False):
+    """Moves every chat to its shard for paths; returns the number of chats moved."""
+    for path in paths:
+        DataBase(path, cache_size=0).close()  # creates and migrates new shards
+    moved = 0
+    for chat_id, source, target in list(misplaced_chats(paths)):
+        if not dry_run:
+            move_chat(chat_id, source, target)
+        moved += 1
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move every chat to its shard for the given database files.")
+    parser.add_argument("paths", nargs="+", help="shard files in DB_SHARDS order; the first keeps the reminders")
+    parser.add_argument("--dry-run", action="store_true", help="only count the chats that would move")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    count = rebalance(args.paths, args.dry_run)
+    print(f"{count} chats {'to move' if args.dry_run else 'moved'} in {time.perf_counter() - start:.1f}s")
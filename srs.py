@@ -0,0 +1,28 @@
+"""SM-2 spaced-repetition scheduling.
+
+Every word carries an ease factor, an interval in days, the number of successful
+repetitions in a row and the time it is due next. Grading a card moves it along.
+"""
+
+DAY = 86400
+RELEARN_DELAY = 600  # "Again" shows the card again in ten minutes
+MIN_EASE = 1.3
+
+# SM-2 answer quality for the three buttons
+GRADES = {"again": 1, "good": 4, "easy": 5}
+
+
+def schedule(ease, interval, repetitions, grade, now):
+    """Returns the new (ease, interval, repetitions, due) of a card answered with grade."""
+    quality = GRADES[grade]
+    if quality < 3:
+        return max(MIN_EASE, ease - 0.2), 0, 0, now + RELEARN_DELAY
+    repetitions += 1
+    if repetitions == 1:
+        interval = 1
+    elif repetitions == 2:
+        interval = 6
+    else:
+        interval = round(interval * ease, 2)
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return ease, interval, repetitions, now + interval * DAY
@@ -0,0 +1,288 @@
+"""Conversation state with per-entry TTL, LRU eviction, memory accounting and metrics.
+
+Every multi-step flow in main.py keeps its per-chat data in a StateStore instead of a plain
+dict, so abandoned conversations expire instead of staying in memory for the lifetime of
+the process. Values must be reassigned after being changed so that their size and expiry
+are refreshed, and so that external backends see the change.
+
+Stores keep their entries in a backend: MemoryBackend by default, or RedisBackend so that
+several bot workers share the state of every conversation. The next-step handler chains
+are kept in a store as well, through StepHandlerBackend.
+"""
+import pickle
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+STORES = []
+
+
+class StateExpired(KeyError):
+    """Raised when a conversation's state is missing, usually because it expired."""
+
+
+class MemoryBackend:
+    """In-process entries, ordered from least to most recently used.
+
+    Every access refreshes the TTL, so the least recently used entry also expires first and
+    expired entries can be dropped from the front in O(1).
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = self.expirations = 0
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, ttl):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                raise KeyError(key)
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                raise KeyError(key)
+            self._data[key] = (time.monotonic() + ttl, entry[1], entry[2])
+            self._data.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, value, ttl):
+        size = sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, size, value)
+            self.bytes += size
+            self._evict()
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                raise KeyError(key)
+            self._remove(key)
+            return entry[2]
+
+    def update(self, key, func, ttl):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            value = func(None if entry is None else entry[2])
+            size = sizeof(value)
+            if entry is not None:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, size, value)
+            self.bytes += size
+            self._evict()
+            return value
+
+    def metrics(self):
+        with self._lock:
+            self._evict()
+            return {"entries": len(self._data),
+                    "bytes": self.bytes,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations}
+
+    def _remove(self, key):
+        self.bytes -= self._data.pop(key)[1]
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._data:
+            key, (expires_at, _, _) = next(iter(self._data.items()))
+            if expires_at <= now:
+                self.expirations += 1
+            elif len(self._data) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self.evictions += 1
+            else:
+                break
+            self._remove(key)
+
+
+class RedisBackend:
+    """Entries pickled into Redis keys with a TTL; eviction is left to Redis' maxmemory policy.
+
+    Besides get, set (with ex), expire and delete, pop runs a MULTI/EXEC transaction and
+    update a WATCH/MULTI/EXEC one, so that two workers never both take or both change an
+    entry; any client with redis-py's pipeline interface works.
+    """
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+        self.bytes_written = 0
+
+    def get(self, key, ttl):
+        raw = self.client.get(self._key(key))
+        if raw is None:
+            raise KeyError(key)
+        self.client.expire(self._key(key), ttl)
+        return pickle.loads(raw)
+
+    def set(self, key, value, ttl):
+        raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.client.set(self._key(key), raw, ex=ttl)
+        self.bytes_written += len(raw)
+
+    def pop(self, key):
+        with self.client.pipeline(transaction=True) as pipe:
+            raw, _ = pipe.get(self._key(key)).delete(self._key(key)).execute()
+        if raw is None:
+            raise KeyError(key)
+        return pickle.loads(raw)
+
+    def update(self, key, func, ttl):
+        from redis.exceptions import WatchError
+
+        name = self._key(key)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    raw = pipe.get(name)
+                    value = func(None if raw is None else pickle.loads(raw))
+                    raw = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                    pipe.multi()
+                    pipe.set(name, raw, ex=ttl)
+                    pipe.execute()
+                    break
+                except WatchError:
+                    # Another worker changed the entry in between; read it again
+                    continue
+        self.bytes_written += len(raw)
+        return value
+
+    def metrics(self):
+        return {"bytes_written": self.bytes_written}
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+
+def memory_backend(store):
+    return MemoryBackend(store.max_entries, store.max_bytes)
+
+
+_backend_factory = memory_backend
+
+
+def configure(backend_factory):
+    """Sets the factory building each store's backend, e.g.
+    ``configure(lambda store: RedisBackend(client, f"state:{store.name}:"))``.
+
+    Stores that already exist switch to the new backend, so call it before handling updates.
+    """
+    global _backend_factory
+    _backend_factory = backend_factory
+    for store in STORES:
+        store.backend = backend_factory(store)
+
+
+class StateStore:
+    def __init__(self, name, ttl=3600, max_entries=10000, max_bytes=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self.backend = _backend_factory(self)
+        STORES.append(self)
+
+    def __getitem__(self, key):
+        try:
+            value = self.backend.get(key, self.ttl)
+        except KeyError:
+            self.misses += 1
+            raise StateExpired(key) from None
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+    def __delitem__(self, key):
+        self.backend.pop(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        try:
+            return self.backend.pop(key)
+        except KeyError:
+            return default
+
+    def update(self, key, func):
+        """Atomically replaces the value of key with func(value), where value is None when the
+        key is missing or expired; returns the new value."""
+        return self.backend.update(key, func, self.ttl)
+
+    def metrics(self):
+        return {"hits": self.hits, "misses": self.misses, **self.backend.metrics()}
+
+
+class StepHandlerBackend:
+    """TeleBot next-step handler storage kept in a StateStore.
+
+    Pass it as ``TeleBot(..., next_step_backend=StepHandlerBackend(store))`` so that the
+    register_next_step_handler chains expire and live in the same backend as the rest of
+    the conversation state. It implements telebot.handler_backends.HandlerBackend without
+    inheriting it, so that the database layer can be imported without importing telebot.
+    """
+
+    def __init__(self, store):
+        self.handlers = {}
+        self.store = store
+
+    def register_handler(self, handler_group_id, handler):
+        self.store.update(handler_group_id, lambda handlers: (handlers or []) + [handler])
+
+    def clear_handlers(self, handler_group_id):
+        self.store.pop(handler_group_id)
+
+    def get_handlers(self, handler_group_id):
+        return self.store.pop(handler_group_id)
+
+
+def metrics():
+    return {store.name: store.metrics() for store in STORES}
+
+
+def sizeof(value, _seen=None):
+    """Approximate deep size of a state value in bytes."""
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, int, float, bool, array)) or value is None:
+        return size
+    if isinstance(value, dict):
+        return size + sum(sizeof(k, _seen) + sizeof(v, _seen) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return size + sum(sizeof(item, _seen) for item in value)
+    for slot in getattr(type(value), "__slots__", ()):
+        size += sizeof(getattr(value, slot, None), _seen)
+    if hasattr(value, "__dict__"):
+        size += sizeof(vars(value), _seen)
+    return size
@@ -0,0 +1,78 @@
+"""Webhook entry point: Telegram pushes updates to a local HTTP server instead of being polled.
+
+    python cli.py webhook
+
+needs WEBHOOK_URL (the public HTTPS address Telegram posts to, usually a reverse proxy in
+front of this server) in config. Optional settings: WEBHOOK_HOST, WEBHOOK_PORT,
+WEBHOOK_SECRET, WEBHOOK_WORKERS and WEBHOOK_QUEUE_SIZE.
+"""
+import json
+import logging
+import queue
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+RETRY_AFTER = 1  # seconds a sender should wait when the dispatcher is full
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """Accepts Telegram updates over HTTP and hands them to a ChatDispatcher.
+
+    An update is acknowledged as soon as it is queued. When the chat's worker queue is full
+    the server answers 429 with Retry-After, so Telegram keeps the update and delivers it
+    again later instead of the server buffering without bound.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, dispatcher, secret=None):
+        super().__init__(address, WebhookHandler)
+        self.dispatcher = dispatcher
+        self.secret = secret
+        self.accepted = self.rejected = 0
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        if server.secret is not None and self.headers.get(SECRET_HEADER) != server.secret:
+            self._respond(403)
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            update = Update.de_json(json.loads(self.rfile.read(length)))
+        except (ValueError, KeyError, TypeError):
+            self._respond(400)
+            return
+        if update is None:  # a body of null
+            self._respond(400)
+            return
+        try:
+            server.dispatcher.submit(update)
+        except queue.Full:
+            server.rejected += 1
+            self._respond(429, {"Retry-After": str(RETRY_AFTER)})
+            return
+        server.accepted += 1
+        self._respond(200)
+
+    def _respond(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+if __name__ == "__main__":
+    import cli
+
+    cli.main(["webhook"])
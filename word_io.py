@@ -0,0 +1,163 @@
+"""Streaming serialization of word lists for exports and imports.
+
+Rows are written one by one into a spooled buffer, which stays in memory for small
+vocabularies and rolls over to an anonymous temporary file for large ones, so reading and
+serializing the rows takes memory independent of the number of words, and concurrent
+exports never share a file. Sending is not bounded: requests reads the whole file into the
+multipart body, so an export is held in memory once while it is uploaded.
+Imports read the same formats back as a stream of (foreign, native) pairs. Sync exports
+are JSON documents of the changes since an earlier sync.
+"""
+import csv
+import io
+import json
+import re
+import tempfile
+
+EXPORT_FORMATS = ("txt", "csv", "json")
+SPOOL_MAX_SIZE = 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def write_txt(rows, file):
+    for line in rows:
+        file.write(f"{line[0]} --- {line[1]}\n")
+
+
+def write_csv(rows, file):
+    writer = csv.writer(file)
+    writer.writerow(["Foreign", "Native"])
+    for line in rows:
+        writer.writerow([line[0], line[1]])
+
+
+def write_json(rows, file):
+    # Produces the same text as json.dump(words_list, file, ensure_ascii=False, indent=2)
+    separator = "\n"
+    file.write("[")
+    for line in rows:
+        item = json.dumps({"foreign": line[0], "native": line[1]}, ensure_ascii=False, indent=2)
+        file.write(separator + "  " + item.replace("\n", "\n  "))
+        separator = ",\n"
+    file.write("]" if separator == "\n" else "\n]")
+
+
+WRITERS = {"txt": write_txt, "csv": write_csv, "json": write_json}
+
+
+def write_changes(rows, file, token, full):
+    # One change per line: {"token": ..., "full": ..., "changes": [...]}. Changed words carry
+    # their group and language, deleted ones only their id, words and language.
+    file.write(json.dumps({"token": token, "full": full}, ensure_ascii=False)[:-1] + ', "changes": [')
+    separator = "\n"
+    for word_id, foreign, native, group, lang, created_at, changed_at, deleted, _ in rows:
+        if deleted:
+            item = {"id": word_id, "deleted": True, "foreign": foreign, "native": native, "lang": lang,
+                    "changed_at": changed_at}
+        else:
+            item = {"id": word_id, "foreign": foreign, "native": native, "group": group, "lang": lang,
+                    "created_at": created_at, "changed_at": changed_at}
+        file.write(separator + json.dumps(item, ensure_ascii=False))
+        separator = ",\n"
+    file.write("]}\n" if separator == "\n" else "\n]}\n")
+
+
+def _spool(write):
+    buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+b")
+    text = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+    write(text)
+    text.flush()
+    text.detach()
+    buffer.seek(0)
+    return buffer
+
+
+def export_words(rows, fmt):
+    """Serializes rows of (foreign, native, ...) and returns a binary buffer positioned at the start."""
+    return _spool(lambda file: WRITERS[fmt](rows, file))
+
+
+def export_changes(rows, token, full):
+    """Serializes the rows of DataBase.iter_word_changes as a sync document, like export_words."""
+    return _spool(lambda file: write_changes(rows, file, token, full))
+
+
+def read_txt(file):
+    text = io.TextIOWrapper(file, encoding="utf-8-sig")
+    for number, line in enumerate(text, start=1):
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            continue
+        parts = line.split(" --- ", 1)
+        if len(parts) != 2:
+            raise ValueError(f"Line {number} is not in the 'foreign --- native' format")
+        yield parts[0], parts[1]
+
+
+def read_csv(file):
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        yield from _read_csv_rows(csv.reader(text))
+    except csv.Error as e:
+        raise ValueError(f"Malformed CSV: {e}") from e
+
+
+def _read_csv_rows(reader):
+    for number, row in enumerate(reader, start=1):
+        if not row:
+            continue
+        if number == 1 and [cell.lower() for cell in row] == ["foreign", "native"]:
+            continue
+        if len(row) < 2:
+            raise ValueError(f"Row {number} needs a foreign and a native column")
+        yield row[0], row[1]
+
+
+_SKIP_WHITESPACE = re.compile(r"\s*")
+_SKIP_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def read_json(file):
+    # Decodes the top-level array item by item instead of loading the whole document
+    decoder = json.JSONDecoder()
+    text = io.TextIOWrapper(file, encoding="utf-8-sig")
+    buf, pos = "", 0
+    started = eof = False
+    while True:
+        pos = (_SKIP_SEPARATORS if started else _SKIP_WHITESPACE).match(buf, pos).end()
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array of words")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                if not isinstance(item, dict) or "foreign" not in item or "native" not in item:
+                    raise ValueError("Every JSON item needs 'foreign' and 'native' keys")
+                yield item["foreign"], item["native"]
+                pos = end
+                continue
+        elif eof:
+            raise ValueError("Unexpected end of JSON document")
+        chunk = text.read(READ_CHUNK_SIZE)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+
+READERS = {"txt": read_txt, "csv": read_csv, "json": read_json}
+
+
+def import_words(file, fmt):
+    """Yields (foreign, native) pairs from a binary file in one of the export formats.
+
+    Malformed input raises ValueError while iterating.
+    """
+    return READERS[fmt](file)